@@ -0,0 +1,239 @@
+"""録音解析（長さ計算→文字起こし→評価→ログ保存）のバックグラウンドジョブ。
+
+submit_recording は音声を保存してジョブを登録したらすぐにジョブIDを返す。
+発話区間の検出（vad.py）はワーカーで保存済みの 16kHz モノラル音声に1回だけ行い、その区間を
+無音の削除・文字起こし・流暢さの指標（fluency.py）・発話/無音時間のすべてに使う。
+流暢さの指標は文字起こしを待たずに result["fluency"] に書くので、画面には先に出る。
+実際の処理はプロセス共有のワーカースレッドで進み、進捗と結果は analysis_jobs テーブルに書かれるので、
+画面側は get_analysis_job で状態を読むだけでよい。複数の録音は並行して解析される。
+
+同じ録音・設問・採点基準の解析結果は analysis_cache テーブルに残しておき、再投入されたら
+文字起こしも評価もせずに完了済みのジョブとして返す（セッションをまたいでも、再起動後も効く）。
+"""
+import datetime as dt
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import streamlit as st
+from openai import OpenAI
+
+from database import (
+    create_analysis_job,
+    get_analysis_job,
+    get_cached_analysis,
+    get_unfinished_analysis_jobs,
+    put_cached_analysis,
+    update_analysis_job,
+)
+from audio_processing import load_mono, read_audio_file, storage_extension
+from fluency import add_transcript_metrics, compute_fluency
+from vad import analyze_samples
+from recording_log import append_record
+from speaking import (
+    analysis_version,
+    compute_wav_duration_seconds,
+    evaluate_speaking,
+    evaluate_speaking_stream,
+    failed_evaluation,
+    fingerprint_audio,
+    save_recording,
+    transcribe_samples,
+)
+
+MAX_WORKERS = 3
+# 評価をストリーミングで受け取り、途中経過を result.partial_evaluation に書いていく
+STREAM_EVALUATION = True
+
+
+@st.cache_resource
+def _executor() -> ThreadPoolExecutor:
+    """プロセス全体で共有するワーカー"""
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="analysis")
+
+
+def analysis_cache_key(audio_hash: str, question: str, image_file: Optional[str] = None) -> str:
+    """(録音の指紋, 設問, 画像, 採点基準・モデルの版) のハッシュ"""
+    return hashlib.sha256(
+        json.dumps([audio_hash, question, image_file or "", analysis_version()], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def _cached_result(cached: dict, log_path: str) -> dict:
+    return dict(cached["details"], transcript=cached["transcript"], evaluation=cached["evaluation"],
+                log_path=log_path, warnings=[], cached=True)
+
+
+def _log_item(request: dict, result: dict) -> dict:
+    """録音ログ（recording_log）の1件。timestamp は append_record(stamp=True) で追記時に付け直す"""
+    item = {
+        "timestamp": request["timestamp"],
+        "recorded_at": request["timestamp"],
+        "category": "output",            # 要件どおり固定
+        "mode": request["mode"],         # "discussion" / "description"
+        "question": request["question"],
+        "audio_file": request["audio_file"],
+        "duration_sec": result["duration_sec"],
+        "speech_sec": result.get("speech_sec"),
+        "silence_sec": result.get("silence_sec"),
+        "fluency": result.get("fluency"),
+        "transcript": result["transcript"],
+        "evaluation": result["evaluation"],
+    }
+    if request.get("image_file"):
+        item["image_file"] = request["image_file"]
+    if result.get("cached"):
+        item["cached"] = True
+    return item
+
+
+def submit_recording(client: OpenAI, category: str, mode: str, question: str, wav_audio_data: bytes,
+                     recording_dir: str, log_path: str, image_file: Optional[str] = None) -> str:
+    """録音を保存して解析ジョブを登録し、ジョブIDを返す（解析の完了は待たない）。
+
+    同じ録音・設問の解析結果がキャッシュにあれば、保存も解析もせず完了済みのジョブを返す
+    （録音ログにはキャッシュの結果で1件追記するので、履歴には毎回の提出が残る）。
+    """
+    job_id = uuid.uuid4().hex
+    ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+    audio_hash = fingerprint_audio(wav_audio_data)
+    cache_key = analysis_cache_key(audio_hash, question, image_file)
+    cached = get_cached_analysis(cache_key)
+    if cached and os.path.exists(cached["details"].get("audio_path", "")):
+        request = {
+            "timestamp": ts,
+            "category": category,
+            "mode": mode,
+            "question": question,
+            "audio_file": cached["details"]["audio_path"],
+            "image_file": image_file,
+            "log_path": log_path,
+            "cache_key": cache_key,
+        }
+        result = _cached_result(cached, log_path)
+        create_analysis_job(job_id, request)
+        append_record(log_path, _log_item(request, result), stamp=True)
+        update_analysis_job(job_id, status="done", stage="done", progress=1.0, result=result)
+        return job_id
+
+    base = os.path.join(recording_dir, f"{category}_{mode}_{ts}")
+    reserved = base + storage_extension()
+    try:
+        # 同じ秒に複数の録音が来ても上書きしない（ファイル名は排他的に作って確保する）
+        open(reserved, "xb").close()
+    except FileExistsError:
+        base, reserved = f"{base}_{job_id[:8]}", None
+    try:
+        # 長さは元の録音から測っておく（保存するのは 16kHz モノラルに変換したもの）
+        dur = compute_wav_duration_seconds(wav_audio_data)
+        audio_path = save_recording(wav_audio_data, base)
+    except Exception:
+        # 確保しただけの空ファイル（や書きかけのファイル）を残さない
+        if reserved and os.path.exists(reserved):
+            os.remove(reserved)
+        raise
+
+    request = {
+        "timestamp": ts,
+        "category": category,
+        "mode": mode,
+        "question": question,
+        "audio_file": audio_path,
+        "duration_sec": round(dur, 2),
+        "image_file": image_file,
+        "log_path": log_path,
+        "audio_hash": audio_hash,
+        "cache_key": cache_key,
+    }
+    create_analysis_job(job_id, request)
+    _executor().submit(_run_job, client, job_id, request)
+    return job_id
+
+
+def _run_job(client: OpenAI, job_id: str, request: dict) -> None:
+    try:
+        update_analysis_job(job_id, status="running", stage="duration", progress=0.1)
+        wav_audio_data = read_audio_file(request["audio_file"])
+        dur = request.get("duration_sec") or compute_wav_duration_seconds(wav_audio_data)
+        warnings = []
+
+        # 発話区間の検出は1回だけ（保存済みの音声は 16kHz モノラルなので変換もしない）
+        x = load_mono(wav_audio_data)
+        speech = analyze_samples(x)
+        fluency = compute_fluency(speech["segments"])
+
+        # 文字起こし（同じ発話区間で前後の無音を削り、長い間を詰めて送る）
+        update_analysis_job(job_id, stage="transcribe", progress=0.3,
+                            result={"duration_sec": round(dur, 2), "fluency": fluency})
+        transcript = ""
+        try:
+            transcript = transcribe_samples(client, x, speech["segments"])
+        except Exception as e:
+            warnings.append(f"文字起こしに失敗しました: {e}")
+        if transcript:
+            fluency = add_transcript_metrics(fluency, transcript)
+
+        # 評価
+        update_analysis_job(job_id, stage="evaluate", progress=0.6)
+        evaluated = True
+        try:
+            if STREAM_EVALUATION:
+                evaluation = evaluate_speaking_stream(
+                    client, request["question"], transcript or "(no transcript)",
+                    on_update=lambda partial: update_analysis_job(
+                        job_id, result={"transcript": transcript, "duration_sec": round(dur, 2),
+                                        "fluency": fluency, "partial_evaluation": partial}),
+                    fluency=fluency,
+                )
+            else:
+                evaluation = evaluate_speaking(client, request["question"], transcript or "(no transcript)", fluency)
+        except Exception as e:
+            evaluation = failed_evaluation(e)
+            evaluated = False
+
+        # ログへ追記（画像パスも含める）
+        update_analysis_job(job_id, stage="save", progress=0.9)
+        result = {
+            "audio_path": request["audio_file"],
+            "image_path": request.get("image_file"),
+            "duration_sec": round(dur, 2),
+            "speech_sec": speech["speech_sec"],
+            "silence_sec": speech["silence_sec"],
+            "speech_segments": speech["segments"],
+            "fluency": fluency,
+            "transcript": transcript,
+            "evaluation": evaluation,
+            "log_path": request["log_path"],
+            "warnings": warnings,
+        }
+        # ジョブは完了順が前後するので、timestamp は追記時に付ける（録音した時刻は recorded_at）
+        append_record(request["log_path"], _log_item(request, result), stamp=True)
+
+        # 文字起こし・評価とも成功したものだけキャッシュする（失敗は次の投入でやり直す）
+        if request.get("cache_key") and evaluated and not warnings:
+            details = {k: result[k] for k in ("audio_path", "image_path", "duration_sec", "speech_sec",
+                                              "silence_sec", "speech_segments", "fluency")}
+            put_cached_analysis(request["cache_key"], request["audio_hash"], request["question"],
+                                analysis_version(), transcript, evaluation, details)
+        update_analysis_job(job_id, status="done", stage="done", progress=1.0, result=result)
+    except Exception as e:
+        update_analysis_job(job_id, status="failed", stage="failed", error=str(e))
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    return get_analysis_job(job_id)
+
+
+@st.cache_resource
+def resume_unfinished_jobs(_client: OpenAI) -> int:
+    """前回のプロセスで終わらなかったジョブを、プロセスごとに一度だけ再投入する"""
+    jobs = get_unfinished_analysis_jobs()
+    for job in jobs:
+        if os.path.exists(job["request"].get("audio_file", "")):
+            _executor().submit(_run_job, _client, job["id"], job["request"])
+        else:
+            update_analysis_job(job["id"], status="failed", stage="failed", error="audio file not found")
+    return len(jobs)
@@ -0,0 +1,124 @@
+"""録音音声の前処理（16kHz モノラルへの変換と、保存用の圧縮）。
+
+st_audiorec の WAV は 44.1/48kHz ステレオの PCM で、音声認識には 16kHz モノラルで足りる。
+文字起こしのアップロード前と録音の保存前にここで変換して、送信量とディスク使用量を減らす。
+変換は NumPy だけで行う（アンチエイリアスの FIR ローパス → 線形補間）。
+
+保存用の可逆圧縮（FLAC）は soundfile が入っていれば使い、無ければ 16kHz モノラルの WAV で保存する。
+"""
+import io
+import os
+import wave
+from typing import Tuple
+
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:  # 任意（FLAC で保存したいときだけ pip install soundfile）
+    soundfile = None
+
+TARGET_SAMPLE_RATE = 16000
+# ローパスフィルタのタップ数（奇数）
+FIR_TAPS = 63
+
+
+def decode_wav(wav_bytes: bytes) -> Tuple[np.ndarray, int]:
+    """WAV を (float32 の [サンプル数, チャンネル数] 配列（-1〜1）, サンプルレート) にする"""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        channels, width, rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+    if width == 1:
+        x = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        x = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        x = (np.where(v >= 1 << 23, v - (1 << 24), v)).astype(np.float32) / (1 << 23)
+    elif width == 4:
+        x = np.frombuffer(raw, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise ValueError(f"unsupported sample width: {width}")
+    return x.reshape(-1, channels), rate
+
+
+def encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    """float のモノラル（またはステレオ）配列を 16bit PCM の WAV にする"""
+    samples = samples if samples.ndim == 2 else samples[:, None]
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(samples.shape[1])
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def _lowpass(x: np.ndarray, cutoff: float) -> np.ndarray:
+    """窓付き sinc の FIR ローパス（cutoff はナイキスト比ではなくサンプルレート比 0〜0.5）"""
+    n = np.arange(FIR_TAPS) - (FIR_TAPS - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(FIR_TAPS)
+    taps /= taps.sum()
+    return np.convolve(x, taps.astype(np.float32), mode="same")
+
+
+def resample(x: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """モノラル信号のサンプルレートを変える（長さ＝再生時間は保つ）"""
+    if src_rate == dst_rate or len(x) == 0:
+        return x.astype(np.float32)
+    if dst_rate < src_rate:
+        # 折り返しノイズを防ぐため、変換先のナイキスト周波数の少し手前で落としておく
+        x = _lowpass(x, 0.45 * dst_rate / src_rate)
+    n_out = int(round(len(x) * dst_rate / src_rate))
+    t_out = np.arange(n_out) * (src_rate / dst_rate)
+    return np.interp(t_out, np.arange(len(x)), x).astype(np.float32)
+
+
+def load_mono(wav_bytes: bytes, rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """WAV を指定レートのモノラル float32 配列にする"""
+    samples, src_rate = decode_wav(wav_bytes)
+    return resample(to_mono(samples), src_rate, rate)
+
+
+def to_speech_wav(wav_bytes: bytes, rate: int = TARGET_SAMPLE_RATE) -> bytes:
+    """音声認識用に 16kHz モノラル 16bit の WAV にする（既にその形式ならそのまま返す）"""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        if wf.getnchannels() == 1 and wf.getframerate() == rate and wf.getsampwidth() == 2:
+            return wav_bytes
+    return encode_wav(load_mono(wav_bytes, rate), rate)
+
+
+def storage_extension() -> str:
+    return ".flac" if soundfile is not None else ".wav"
+
+
+def encode_for_storage(wav_bytes: bytes) -> Tuple[bytes, str]:
+    """保存用に 16kHz モノラルへ変換し、可能なら FLAC にする。(バイト列, 拡張子) を返す"""
+    return encode_mono_for_storage(load_mono(wav_bytes))
+
+
+def encode_mono_for_storage(mono: np.ndarray) -> Tuple[bytes, str]:
+    """load_mono 済みの 16kHz モノラル信号を保存用（FLAC / WAV）にする。(バイト列, 拡張子) を返す"""
+    if soundfile is not None:
+        buf = io.BytesIO()
+        soundfile.write(buf, mono, TARGET_SAMPLE_RATE, format="FLAC", subtype="PCM_16")
+        return buf.getvalue(), ".flac"
+    return encode_wav(mono, TARGET_SAMPLE_RATE), ".wav"
+
+
+def read_audio_file(path: str) -> bytes:
+    """保存した録音（WAV / FLAC）を WAV のバイト列として読む"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if os.path.splitext(path)[1].lower() == ".flac":
+        if soundfile is None:
+            raise RuntimeError("FLAC の読み込みには soundfile が必要です（pip install soundfile）")
+        samples, rate = soundfile.read(io.BytesIO(data), dtype="float32", always_2d=True)
+        return encode_wav(samples, rate)
+    return data
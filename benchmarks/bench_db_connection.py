@@ -0,0 +1,77 @@
+"""database.py の接続コスト比較ベンチマーク。
+
+旧実装（呼び出し毎に sqlite3.connect → close）と、ConnectionPool から接続を借りる
+新実装で、読み取り/書き込み1回あたりのオーバーヘッドを比べる。
+一時ディレクトリ上のDBで計測するので english_study.db には触れない。
+
+    python benchmarks/bench_db_connection.py [--calls 2000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _per_call_us(fn, calls: int) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_db_")
+    os.chdir(workdir)  # database.py は相対パスの DB_PATH を使う
+    import database
+
+    path = os.path.join(workdir, database.DB_PATH)
+    pool = database.ConnectionPool(path)
+
+    def old_read(_):
+        conn = sqlite3.connect(path)
+        conn.execute("SELECT name FROM folders ORDER BY name").fetchall()
+        conn.close()
+
+    def old_write(i):
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO phrases (folder, japanese, english) VALUES (?, ?, ?)", ("bench", f"jp{i}", f"en{i}"))
+        conn.commit()
+        conn.close()
+
+    def new_read(_):
+        with pool.connection() as conn:
+            conn.execute("SELECT name FROM folders ORDER BY name").fetchall()
+
+    def new_write(i):
+        # 同じフォルダ内の同じフレーズは一意制約で弾かれるので、旧実装とは別のフォルダに書く
+        with pool.connection() as conn, conn:
+            conn.execute("INSERT INTO phrases (folder, japanese, english) VALUES (?, ?, ?)", ("bench_pooled", f"jp{i}", f"en{i}"))
+
+    # 旧実装はロールバックジャーナル（DELETE）前提なので、計測前に戻しておく
+    database._connection_pool(database.DB_PATH).close_all()
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    results = {
+        "read  (connect per call)": _per_call_us(old_read, args.calls),
+        "write (connect per call)": _per_call_us(old_write, args.calls),
+    }
+    results["read  (pooled, WAL)"] = _per_call_us(new_read, args.calls)
+    results["write (pooled, WAL)"] = _per_call_us(new_write, args.calls)
+    pool.close_all()
+
+    print(f"calls={args.calls}  db={path}")
+    for name, us in results.items():
+        print(f"{name:<28} {us:10.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""MYクイズの答え合わせのベンチマーク（問題数を変えて比べる）。
+
+旧実装（_norm_text と単語集合の重なり率を1問ずつ）と、grading.grade を1問ずつ呼ぶ場合、
+grading.grade_batch でまとめて採点する場合の、1回あたりの待ち時間（p50）を英語・日本語の正解で表示する。
+正解の前処理キャッシュ（answer_signature）のヒット数もあわせて表示する。
+
+    python benchmarks/bench_grading.py [--sizes 10 100 1000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from grading import answer_signature, grade, grade_batch  # noqa: E402
+
+_EN_WORDS = ("the meeting was moved to next friday because several members could not attend "
+             "please let me know if you have any questions about the schedule").split()
+_JA_WORDS = ["会議", "は", "来週", "の", "金曜日", "に", "変更", "されました", "ご質問", "があれば",
+             "お知らせ", "ください", "予定", "について"]
+
+
+def _old_norm_text(s: str) -> str:
+    # 旧 pages/6 の _norm_text
+    if not s:
+        return ""
+    s = s.strip()
+    s = re.sub(r"\s+", " ", s)
+    s = re.sub(r"[^\w\s'\-]", "", s)
+    return s.lower()
+
+
+def _old_overlap_ratio(a: str, b: str) -> float:
+    # 旧 pages/6 の _overlap_ratio（単語集合の重なり）
+    ta = set(_old_norm_text(a).split())
+    tb = set(_old_norm_text(b).split())
+    if not tb:
+        return 0.0
+    return len(ta & tb) / len(tb)
+
+
+def _typo(s: str, rng: random.Random) -> str:
+    """1〜2文字を置き換え・削除して、ありがちな打ち間違いにする"""
+    chars = list(s)
+    for _ in range(rng.randint(1, 2)):
+        if len(chars) < 2:
+            break
+        i = rng.randrange(len(chars))
+        if rng.random() < 0.5:
+            chars[i] = rng.choice("aeioust")
+        else:
+            del chars[i]
+    return "".join(chars)
+
+
+def _pairs(lang: str, n: int, rng: random.Random):
+    words, sep = (_EN_WORDS, " ") if lang == "en" else (_JA_WORDS, "")
+    golds, answers = [], []
+    for _ in range(n):
+        gold = sep.join(rng.sample(words, rng.randint(4, 10)))
+        golds.append(gold)
+        answers.append(_typo(gold, rng))
+    return answers, golds
+
+
+def _p50_ms(fn, repeat: int) -> float:
+    fn()  # ウォームアップ
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"repeat={args.repeat}")
+    print(f"{'lang':<4s} {'n':>6s}  {'method':<24s} {'p50 ms':>9s}")
+    for lang in ("en", "ja"):
+        for n in args.sizes:
+            answers, golds = _pairs(lang, n, rng)
+            methods = {
+                "word overlap (old)": lambda: [_old_overlap_ratio(a, g) for a, g in zip(answers, golds)],
+                "grade per item": lambda: [grade(a, g) for a, g in zip(answers, golds)],
+                "grade_batch": lambda: grade_batch(answers, golds),
+            }
+            for name, fn in methods.items():
+                print(f"{lang:<4s} {n:>6,d}  {name:<24s} {_p50_ms(fn, args.repeat):9.3f}")
+            passed = (grade_batch(answers, golds) >= 0.8).mean()
+            old_passed = sum(_old_overlap_ratio(a, g) >= 0.8 for a, g in zip(answers, golds)) / n
+            print(f"{'':<4s} {'':>6s}  typo answers judged correct: old {old_passed:.0%} / new {passed:.0%}")
+    info = answer_signature.cache_info()
+    print(f"answer_signature cache: hits={info.hits} misses={info.misses} size={info.currsize}/{info.maxsize}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""LLM を使う各処理の待ち時間ベンチマーク（ローカルの代替サーバー相手）。
+
+benchmarks/fake_openai_server.py を起動し、アプリと同じ関数（llm_client 経由）を
+そのまま呼んで、処理ごとの p50 / p95 の待ち時間とスループットを表示する。
+一時ディレクトリ上のDB・ファイルで計測するので english_study.db には触れない。
+
+    python benchmarks/bench_llm_paths.py [--iterations 20] [--concurrency 4] [--error-rate 0.05]
+
+既定では llm_client のレート制限を外して処理そのものの待ち時間を測る。
+--keep-rate-limits を付けるとアプリと同じ制限のまま測る（画像生成は 0.2 回/秒 に抑えられる）。
+同じ内容の同時リクエストをまとめる処理（llm_client.COALESCE_REQUESTS）も既定では切る。
+--coalesce を付けると有効のまま測る（同じ引数の並列呼び出しは上流1回にまとまる）。
+"refill (fixed topic/level)" は設問プールを空から補充し、HIGH_WATERMARK まで増えたか確認する
+（生成の呼び出しは完了後の結果を使い回さないので、まとめを有効にしても毎回新しい設問が届く）。
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai_server import DEFAULT_LATENCY, FakeOpenAIServer  # noqa: E402
+
+
+def _sample_wav(seconds: float = 30.0, rate: int = 48000, channels: int = 2) -> bytes:
+    """440Hz の正弦波と間（st_audiorec の録音と同じ 48kHz ステレオ 16bit）。
+
+    前後2〜3秒の無音と、5秒ごとに1.5秒の間を入れて、話している録音に近づける。
+    """
+    t = np.arange(int(seconds * rate)) / rate
+    talking = (t >= 2) & (t < seconds - 3) & (t % 5 < 3.5)
+    noise = np.random.default_rng(0).normal(0, 30, len(t))
+    wave_ = (8000 * np.sin(2 * np.pi * 440 * t) * talking + noise).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(np.repeat(wave_[:, None], channels, axis=1).tobytes())
+    return buf.getvalue()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _run(fn: Callable[[int], None], iterations: int, concurrency: int) -> Tuple[List[float], int, float]:
+    """fn(i) を iterations 回、最大 concurrency 本並行で呼ぶ。(各回の秒数, 失敗数, 全体の秒数)"""
+    def timed(i: int) -> Tuple[float, bool]:
+        start = time.perf_counter()
+        try:
+            fn(i)
+            return time.perf_counter() - start, True
+        except Exception:
+            return time.perf_counter() - start, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results = list(pool.map(timed, range(iterations)))
+    wall = time.perf_counter() - start
+    return [t for t, ok in results if ok], sum(1 for _, ok in results if not ok), wall
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-texts", type=int, default=50, help="translate_batch 1回あたりの件数")
+    parser.add_argument("--chat-latency", type=float, default=DEFAULT_LATENCY["chat"])
+    parser.add_argument("--transcription-latency", type=float, default=DEFAULT_LATENCY["transcription"])
+    parser.add_argument("--image-latency", type=float, default=DEFAULT_LATENCY["image"])
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--keep-rate-limits", action="store_true")
+    parser.add_argument("--coalesce", action="store_true", help="同じリクエストのまとめを有効にしたまま測る")
+    parser.add_argument("--only", nargs="*", help="計測する処理名（既定はすべて）")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_llm_")
+    os.chdir(workdir)  # database.py は相対パスの DB_PATH を使う
+    from openai import OpenAI
+
+    import llm_client
+    if not args.keep_rate_limits:
+        llm_client.ENDPOINT_RATE_LIMITS = {k: (1e6, 1_000_000) for k in llm_client.ENDPOINT_RATE_LIMITS}
+    llm_client.BACKOFF_BASE = 0.05  # 注入したエラーのリトライで計測が間延びしないように
+    llm_client.COALESCE_REQUESTS = args.coalesce
+
+    from analysis_jobs import get_job, submit_recording
+    from audio_processing import to_speech_wav
+    from generation import (
+        description_categories,
+        generate_description_image,
+        generate_toefl_passage,
+        generate_toefl_question,
+    )
+    from image_pool import generate_into_pool, next_image
+    from database import count_pool_questions
+    from question_pool import HIGH_WATERMARK, next_question, refill
+    from speaking import (
+        TRANSCRIBE_MAX_PAUSE_SEC,
+        _transcribe_once,
+        evaluate_speaking,
+        evaluate_speaking_stream,
+        transcribe_wav_bytes,
+    )
+    from vad import trim_silence
+    from translation import translate_batch, translate_text
+
+    wav = _sample_wav()
+    long_wav = _sample_wav(180.0)
+    image_dir = os.path.join(workdir, "desc_images")
+    recording_dir = os.path.join(workdir, "recordings")
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(recording_dir, exist_ok=True)
+    log_path = os.path.join(workdir, "json", "recordings_output.jsonl")
+
+    server = FakeOpenAIServer(
+        latency={"chat": args.chat_latency, "transcription": args.transcription_latency, "image": args.image_latency},
+        error_rate=args.error_rate, error_status=args.error_status, seed=0,
+    ).start()
+    client = OpenAI(api_key="bench", base_url=server.base_url, max_retries=0)
+
+    def analysis_job(i: int) -> None:
+        job_id = submit_recording(client, "bench", "discussion", "What is your hobby?", wav,
+                                  recording_dir, log_path)
+        while True:
+            job = get_job(job_id)
+            if job and job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.02)
+        if job["status"] == "failed":
+            raise RuntimeError(job.get("error"))
+
+    def refill_fixed(i: int) -> None:
+        topic, level = f"bench topic {i}", "intermediate"
+        refill(client, topic, level)
+        if count_pool_questions(topic, level) < HIGH_WATERMARK:
+            raise RuntimeError(f"pool stalled at {count_pool_questions(topic, level)}")
+
+    paths: Dict[str, Callable[[int], None]] = {
+        "translate_text (miss)": lambda i: translate_text(client, f"benchmark sentence number {i}"),
+        "translate_text (hit)": lambda i: translate_text(client, "benchmark sentence number 0"),
+        f"translate_batch ({args.batch_texts})": lambda i: translate_batch(
+            client, [f"batch {i} sentence {j}" for j in range(args.batch_texts)]),
+        "generate_toefl_passage": lambda i: generate_toefl_passage(client),
+        "generate_toefl_question": lambda i: generate_toefl_question(client),
+        "next_question (prefilled pool)": lambda i: next_question(client),
+        "refill (fixed topic/level)": refill_fixed,
+        "generate_description_image": lambda i: generate_description_image(client, image_dir),
+        "next_image (prefilled pool)": lambda i: next_image(client, image_dir),
+        "transcription (raw WAV upload)": lambda i: llm_client.transcription(
+            client, model="whisper-1", file=("audio.wav", wav)),
+        "transcribe_wav_bytes": lambda i: transcribe_wav_bytes(client, wav),
+        "transcribe_wav_bytes (no trim)": lambda i: transcribe_wav_bytes(client, wav, trim=False),
+        "transcribe 3 min (single shot)": lambda i: _transcribe_once(client, to_speech_wav(long_wav)),
+        "transcribe 3 min (chunked)": lambda i: transcribe_wav_bytes(client, long_wav),
+        "trim_silence (local)": lambda i: trim_silence(wav, TRANSCRIBE_MAX_PAUSE_SEC),
+        "evaluate_speaking": lambda i: evaluate_speaking(client, "What is your hobby?", "I like hiking."),
+        "evaluate_speaking_stream": lambda i: evaluate_speaking_stream(client, "What is your hobby?", "I like hiking."),
+        "analysis job (end to end)": analysis_job,
+    }
+    if args.only:
+        paths = {k: v for k, v in paths.items() if any(name in k for name in args.only)}
+
+    if any(name.startswith("next_question") for name in paths):
+        refill(client)  # 画面表示前にワーカーが補充し終えている状態を再現する
+    if any(name.startswith("next_image") for name in paths):
+        for category in description_categories():
+            generate_into_pool(client, category, image_dir)
+
+    print(f"server={server.base_url} iterations={args.iterations} concurrency={args.concurrency} "
+          f"error_rate={args.error_rate} rate_limits={'app' if args.keep_rate_limits else 'off'} "
+          f"coalesce={'on' if args.coalesce else 'off'}")
+    print(f"{'path':34s} {'ok':>4s} {'err':>4s} {'p50 ms':>9s} {'p95 ms':>9s} {'req/s':>8s}")
+    try:
+        for name, fn in paths.items():
+            ok, errors, wall = _run(fn, args.iterations, args.concurrency)
+            print(f"{name:34s} {len(ok):4d} {errors:4d} {_percentile(ok, 0.5) * 1e3:9.1f} "
+                  f"{_percentile(ok, 0.95) * 1e3:9.1f} {args.iterations / wall:8.2f}")
+    finally:
+        # 裏で動いている補充ワーカーを待ってからサーバーを止める
+        import image_pool
+        import question_pool
+        image_pool._executor().shutdown(wait=True)
+        question_pool._executor().shutdown(wait=True)
+        server.stop()
+
+    print("\nllm_client.call_stats():")
+    for endpoint, stats in sorted(llm_client.call_stats().items()):
+        print(f"  {endpoint:14s} {stats}")
+    print(f"server requests: {server.counts}")
+    print("llm_client.metric_stats():")
+    for name, m in sorted(llm_client.metric_stats().items()):
+        print(f"  {name:36s} mean={m['mean']:.3f} max={m['max']:.3f} n={int(m['count'])}")
+
+if __name__ == "__main__":
+    main()
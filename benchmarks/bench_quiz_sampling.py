@@ -0,0 +1,126 @@
+"""MYクイズの出題抽出ベンチマーク（フォルダの大きさを変えて比べる）。
+
+旧実装（get_phrases_by_folder でフォルダ全体を DataFrame に読み、Python でシャッフルして先頭 N 件）と、
+SQL 側で抽出する sample_phrases（一様 / 間違い回数で重み付け）・復習の期限順の due_queue で、
+1回あたりの待ち時間とピークのメモリ（tracemalloc）を表示する。
+id が他のフォルダの行と交互に並ぶフォルダ（scattered）でも計測し、sample_phrases が毎回 n 件返すことと、
+id 順の区間ごとの選ばれ方の偏りも表示する。
+最後に、sample_phrases の p50 が最小のフォルダから最大のフォルダまでほぼ一定（--flat-ratio 倍以内）か確かめる。
+一時ディレクトリ上のDBで計測するので english_study.db には触れない。
+
+    python benchmarks/bench_quiz_sampling.py [--sizes 1000 20000 200000] [--flat-ratio 3] [--n 20] [--repeat 20] [--draws 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _measure(fn, repeat: int):
+    """(p50 ミリ秒, ピークメモリ KiB)"""
+    fn()  # ウォームアップ（ページキャッシュ）
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times) * 1e3, peak / 1024
+
+
+def _check_uniform(sample, folder: str, n: int, draws: int) -> str:
+    """draws 回抽出して、件数の最小値と、id 順で10等分した区間ごとの選ばれた割合（一様なら各10%）"""
+    import database
+    with database.get_connection() as conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM phrases WHERE folder = ? ORDER BY id", (folder,))]
+    decile = {pid: rank * 10 // len(ids) for rank, pid in enumerate(ids)}
+    buckets = [0] * 10
+    shortest = n
+    for _ in range(draws):
+        rows = sample()
+        shortest = min(shortest, len(rows))
+        for row in rows:
+            buckets[decile[row["id"]]] += 1
+    total = sum(buckets)
+    return (f"min rows {shortest}/{min(n, len(ids))}, "
+            f"id-decile share {min(buckets) / total:.1%}-{max(buckets) / total:.1%} (uniform 10%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 20000, 200000])
+    parser.add_argument("--n", type=int, default=20, help="出題数")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--draws", type=int, default=200, help="偏りの確認で抽出する回数")
+    parser.add_argument("--flat-ratio", type=float, default=3.0,
+                        help="最大のフォルダの p50 が最小のフォルダの何倍までなら一定とみなすか")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_quiz_")
+    os.chdir(workdir)  # database.py は相対パスの DB_PATH を使う
+    import database
+    from srs import due_queue
+
+    def old_sampling(folder: str):
+        df = database.get_phrases_by_folder(folder)
+        items = df[["id", "japanese", "english"]].to_dict("records")
+        random.shuffle(items)
+        return items[:args.n]
+
+    print(f"n={args.n} repeat={args.repeat} db={os.path.join(workdir, database.DB_PATH)}")
+    print(f"{'folder size':>11s}  {'ids':<10s} {'method':<30s} {'p50 ms':>9s} {'peak KiB':>10s}")
+    p50 = {}  # (layout, method) -> {size: ms}
+    for size in args.sizes:
+        for layout in ("contiguous", "scattered"):
+            folder = f"bench_{layout}_{size}"
+            if layout == "contiguous":
+                database.add_phrases_bulk([(folder, f"日本語のフレーズ {i}", f"english phrase number {i}")
+                                           for i in range(size)])
+            else:
+                # 1行ごとに別フォルダの行を5行挟み、フォルダの id 範囲に他の行が多く混ざるようにする
+                rows = []
+                for i in range(size):
+                    rows.append((folder, f"日本語のフレーズ {i}", f"english phrase number {i}"))
+                    rows.extend((f"{folder}_other", f"他のフレーズ {i}-{k}", f"other phrase {i}-{k}") for k in range(5))
+                database.add_phrases_bulk(rows)
+            # 一部を間違えた扱いにして、重み付き抽出に偏りの材料を入れておく
+            with database.get_connection() as conn, conn:
+                conn.execute(
+                    "UPDATE reviews SET lapses = abs(random()) % 4 WHERE folder = ? AND direction = 'ja-en' "
+                    "AND phrase_id % 10 = 0", (folder,)
+                )
+            methods = {
+                "full load + shuffle (old)": lambda: old_sampling(folder),
+                "sample_phrases": lambda: database.sample_phrases(folder, args.n),
+                "sample_phrases (weighted)": lambda: database.sample_phrases(folder, args.n, "ja-en", weight_errors=True),
+                "due_queue": lambda: due_queue(folder, "ja-en", args.n),
+            }
+            for name, fn in methods.items():
+                ms, kib = _measure(fn, args.repeat)
+                p50.setdefault((layout, name), {})[size] = ms
+                print(f"{size:>11,d}  {layout:<10s} {name:<30s} {ms:9.2f} {kib:10.1f}")
+            print(f"{'':>11s}  {layout:<10s} sample_phrases: "
+                  f"{_check_uniform(lambda: database.sample_phrases(folder, args.n), folder, args.n, args.draws)}")
+
+    # フォルダが大きくなっても抽出の待ち時間がほぼ変わらないこと（ミリ秒未満の揺れは 0.5ms まで許す）
+    smallest, largest = min(args.sizes), max(args.sizes)
+    for (layout, name), by_size in p50.items():
+        if not name.startswith("sample_phrases"):
+            continue
+        limit = max(by_size[smallest] * args.flat_ratio, by_size[smallest] + 0.5)
+        print(f"flat check {layout:<10s} {name:<26s} {by_size[smallest]:.2f} -> {by_size[largest]:.2f} ms "
+              f"(limit {limit:.2f})")
+        assert by_size[largest] <= limit, f"{name} ({layout}) p50 grows with folder size"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""ベンチマーク・動作確認用の、OpenAI 互換のローカル代替サーバー。
+
+チャット（/v1/chat/completions）・文字起こし（/v1/audio/transcriptions）・画像生成
+（/v1/images/generations）の3エンドポイントに、決まった形の応答を返す。
+エンドポイントごとの応答時間（＋ゆらぎ）とエラー率（429 / 5xx）を変えられるので、
+APIキーや課金なしで LLM を使う処理の待ち時間やリトライの挙動を再現できる。
+
+単体で起動してアプリをつなぐ場合は .streamlit/secrets.toml に
+OPENAI_BASE_URL = "http://127.0.0.1:8765/v1" を書く（llm_client.get_client が読む）。
+
+    python benchmarks/fake_openai_server.py [--port 8765] [--chat-latency 0.8] [--error-rate 0.05]
+
+チャットは "stream": true なら SSE で少しずつ返す。応答はプロンプトの内容から判定する（翻訳・まとめて翻訳・パッセージ・質問・評価）。
+--payloads に JSON ファイル {"chat": "...", "transcription": "...", "image": "<base64 PNG>"}
+を渡すと、その内容を固定で返す。
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+DEFAULT_LATENCY = {"chat": 0.8, "transcription": 1.5, "image": 6.0}
+# 文字起こしはアップロード量に比例して遅くなる（1MB あたりの追加秒数）
+DEFAULT_TRANSCRIPTION_PER_MB = 0.5
+# ストリーミング（"stream": true）では最初のチャンクまでが latency、以降はこの文字数ずつ送る
+STREAM_CHUNK_CHARS = 8
+DEFAULT_STREAM_INTERVAL = 0.02
+ENDPOINTS = {
+    "/v1/chat/completions": "chat",
+    "/v1/audio/transcriptions": "transcription",
+    "/v1/images/generations": "image",
+}
+
+PASSAGE_EN = (
+    "Cities around the world are experimenting with car-free zones in their historic centers. "
+    "Supporters argue that removing traffic reduces air pollution, makes streets safer, and "
+    "encourages people to walk, cycle, and spend more time in local shops. Critics respond that "
+    "such policies can make daily life harder for older residents and for businesses that rely on "
+    "deliveries. Research from several European cities suggests that the economic effects are "
+    "usually positive after an adjustment period, but only when public transport is improved at "
+    "the same time. The debate shows that urban planning is not simply a technical problem; it also "
+    "involves choices about who the city is designed for and how shared space should be used."
+)
+PASSAGE_JA = (
+    "世界中の都市が、歴史的な中心部で車の乗り入れを禁止する区域を試している。"
+    "支持者は、交通をなくすことで大気汚染が減り、道路が安全になり、人々が歩いたり自転車に乗ったり、"
+    "地元の店で過ごす時間が増えると主張する。批判する人々は、こうした政策は高齢の住民や配送に頼る"
+    "事業者の日常生活を難しくすると反論する。いくつかの欧州都市の調査では、調整期間を経れば経済的な"
+    "影響はたいてい良いものになるが、それは公共交通が同時に改善された場合に限られる。"
+    "この議論は、都市計画が単なる技術的な問題ではなく、都市を誰のために設計し、共有の空間を"
+    "どう使うべきかという選択でもあることを示している。"
+)
+QUESTION = "Do you agree or disagree that universities should require all students to take a course in public speaking?"
+TRANSCRIPT = (
+    "I think universities should require public speaking because it helps students explain their ideas "
+    "clearly, and it is useful in almost every job after graduation."
+)
+EVALUATION = {
+    "scores": {"grammar": 4, "content_relevance": 4, "fluency": 3},
+    "comment": "Your answer is relevant and clearly organized. Add one concrete example to make it more convincing.",
+    "tips": ["Give a specific example", "Vary your sentence openings", "Reduce long pauses"],
+}
+
+
+def _png(width: int = 64, height: int = 64, rgb=(90, 140, 200)) -> bytes:
+    """単色のPNG画像（画像生成の応答用）"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+def _is_japanese(text: str) -> bool:
+    return bool(re.search(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9faf]", text))
+
+
+def _translate(text: str) -> Dict[str, str]:
+    if _is_japanese(text):
+        return {"english": f"(en) {text}", "japanese": text}
+    return {"english": text, "japanese": f"（訳）{text}"}
+
+
+def canned_chat_reply(messages: list) -> str:
+    """プロンプトの内容から、アプリが期待する形の応答本文を作る"""
+    system = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+    user = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+    if "Items: " in user:
+        try:
+            items = json.loads(user.split("Items: ", 1)[1].strip())
+        except ValueError:
+            items = []
+        return json.dumps({"items": [dict(id=it.get("id"), **_translate(str(it.get("text", ""))))
+                                     for it in items]}, ensure_ascii=False)
+    if "Translate the following" in user:
+        text = user.split("Text: ", 1)[1].strip() if "Text: " in user else ""
+        return json.dumps(_translate(text), ensure_ascii=False)
+    if "ESL content writer" in system:
+        return json.dumps({"english": PASSAGE_EN, "japanese": PASSAGE_JA}, ensure_ascii=False)
+    if '{"questions"' in user:
+        n = int(re.search(r"Generate (\d+)", user).group(1)) if re.search(r"Generate (\d+)", user) else 1
+        topic = re.search(r"Topic: (.+)", user)
+        about = topic.group(1).strip() if topic else "daily life"
+        return json.dumps({"questions": [f"What is one change related to {about} that you would like to see, "
+                                         f"and why? ({uuid.uuid4().hex[:6]})" for _ in range(n)]})
+    if "discussion question" in user:
+        return QUESTION
+    if "Rate on 0" in user:
+        return json.dumps(EVALUATION, ensure_ascii=False)
+    return "OK"
+
+
+class FakeOpenAIServer:
+    """別スレッドで動く代替サーバー。with 文で起動/停止できる。
+
+    latency: エンドポイントごとの平均応答秒数 / jitter: ±の割合 /
+    error_rate: 各リクエストがエラーになる確率 / error_status: そのときのステータス（429 なら Retry-After: 0 付き）
+    stream_interval: ストリーミング応答のチャンク間隔（秒） / transcription_per_mb: 文字起こしの 1MB あたりの追加秒数
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: Optional[Dict[str, float]] = None,
+                 jitter: float = 0.2, error_rate: float = 0.0, error_status: int = 429,
+                 payloads: Optional[Dict[str, str]] = None, seed: Optional[int] = None,
+                 stream_interval: float = DEFAULT_STREAM_INTERVAL,
+                 transcription_per_mb: float = DEFAULT_TRANSCRIPTION_PER_MB):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.payloads = payloads or {}
+        self.stream_interval = stream_interval
+        self.transcription_per_mb = transcription_per_mb
+        self.counts: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _delay(self, endpoint: str) -> float:
+        base = self.latency.get(endpoint, 0.0)
+        with self._lock:
+            return max(0.0, base * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _respond(self, endpoint: str, body: bytes) -> Dict[str, Any]:
+        now = int(time.time())
+        if endpoint == "chat":
+            req = json.loads(body or b"{}")
+            content = self.payloads.get("chat") or canned_chat_reply(req.get("messages", []))
+            return {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": now,
+                "model": req.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(body) + len(content)) // 4},
+            }
+        if endpoint == "transcription":
+            return {"text": self.payloads.get("transcription") or TRANSCRIPT}
+        with self._lock:
+            rgb = tuple(self._random.randrange(256) for _ in range(3))  # 毎回違う画像にする
+        b64 = self.payloads.get("image") or base64.b64encode(_png(rgb=rgb)).decode("ascii")
+        return {"created": now, "data": [{"b64_json": b64}]}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, payload: Dict[str, Any], options: Dict[str, Any]) -> None:
+                """チャットの応答を SSE（chat.completion.chunk）で少しずつ送る"""
+                content = payload["choices"][0]["message"]["content"]
+                pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                base = {k: payload[k] for k in ("id", "created", "model")}
+                chunks = [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]
+                chunks += [{"index": 0, "delta": {"content": p}, "finish_reason": None} for p in pieces]
+                chunks += [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+                for choice in chunks:
+                    event = dict(base, object="chat.completion.chunk", choices=[choice])
+                    self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(server.stream_interval)
+                if options.get("include_usage"):
+                    event = dict(base, object="chat.completion.chunk", choices=[], usage=payload["usage"])
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                endpoint = ENDPOINTS.get(self.path.split("?", 1)[0])
+                if endpoint is None:
+                    self._send(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+                    return
+                server._count(endpoint)
+                delay = server._delay(endpoint)
+                if endpoint == "transcription":
+                    delay += server.transcription_per_mb * len(body) / 1e6
+                time.sleep(delay)
+                if server._should_fail():
+                    server._count(f"{endpoint}_errors")
+                    status = server.error_status
+                    self._send(status, {"error": {"message": "injected failure", "type": "fake_error"}},
+                               {"Retry-After": "0"} if status == 429 else None)
+                    return
+                try:
+                    payload = server._respond(endpoint, body)
+                    if endpoint == "chat" and json.loads(body or b"{}").get("stream"):
+                        self._stream(payload, json.loads(body).get("stream_options") or {})
+                        return
+                    self._send(200, payload)
+                except ValueError as e:
+                    self._send(400, {"error": {"message": str(e), "type": "invalid_request_error"}})
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-latency", type=float, default=DEFAULT_LATENCY["chat"])
+    parser.add_argument("--transcription-latency", type=float, default=DEFAULT_LATENCY["transcription"])
+    parser.add_argument("--image-latency", type=float, default=DEFAULT_LATENCY["image"])
+    parser.add_argument("--transcription-per-mb", type=float, default=DEFAULT_TRANSCRIPTION_PER_MB)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--stream-interval", type=float, default=DEFAULT_STREAM_INTERVAL)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--payloads", help="固定で返す応答を書いた JSON ファイル")
+    args = parser.parse_args()
+
+    payloads = None
+    if args.payloads:
+        with open(args.payloads, "r", encoding="utf-8") as f:
+            payloads = json.load(f)
+    server = FakeOpenAIServer(
+        args.host, args.port,
+        latency={"chat": args.chat_latency, "transcription": args.transcription_latency, "image": args.image_latency},
+        jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status, payloads=payloads,
+        stream_interval=args.stream_interval, transcription_per_mb=args.transcription_per_mb,
+    )
+    print(f"fake OpenAI server: {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,114 @@
 import streamlit as st
+import json
 import sqlite3
-import pandas as pd
+import queue
+import random
+import threading
 import time
-from datetime import date
+import pandas as pd
+from contextlib import contextmanager
+from datetime import date, datetime
 
 DB_PATH = 'english_study.db'
 
-def get_db_connection():
-    """データベース接続を取得し、テーブルが存在しない場合は作成する"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    # フレーズテーブル
-    conn.execute('''
+# 接続ごとに一度だけ適用するPRAGMA
+# WAL: 読み取りと書き込みが互いにブロックしない / NORMAL: WALではコミット毎のfsyncを省略しても安全
+BUSY_TIMEOUT_MS = 5000
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",   # 約20MBのページキャッシュ（負値はKiB指定）
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+)
+POOL_SIZE = 8
+# 翻訳キャッシュの上限件数（超えたら最後に使われたのが古いものから捨てる）
+TRANSLATION_CACHE_MAX_ENTRIES = 20000
+# 録音解析キャッシュの上限件数（同上）
+ANALYSIS_CACHE_MAX_ENTRIES = 2000
+# sample_phrases: id の範囲がこれ以下のフォルダは ORDER BY random() で選ぶ（それより広ければ棄却サンプリング）
+SAMPLE_SCAN_MAX_SPAN = 2000
+# 棄却サンプリングの回数と1回に試す id の上限（足りなければ残りを ORDER BY random() で補う）
+SAMPLE_PROBE_ROUNDS = 6
+SAMPLE_PROBE_BATCH_MAX = 4096
+# 間違いで重み付けするときに集める候補の倍率
+SAMPLE_WEIGHTED_CANDIDATES = 4
+
+
+class ConnectionPool:
+    """SQLite接続を使い回すための小さなプール。
+
+    Streamlit は再実行のたびに別スレッドでスクリプトを走らせるため、
+    スレッドローカルではなく「借りて返す」方式にしている。
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._open()
+        # 上限に達していれば返却を待つ
+        return self._idle.get(timeout=BUSY_TIMEOUT_MS / 1000)
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        # 例外で抜けた場合などに開きっぱなしのトランザクションを残さない
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+@st.cache_resource
+def _connection_pool(path: str) -> ConnectionPool:
+    """プロセス全体で共有する接続プール"""
+    return ConnectionPool(path)
+
+@contextmanager
+def get_connection():
+    """プールから接続を借りる。`with conn:` と組み合わせるとコミット/ロールバックされる"""
+    with _connection_pool(DB_PATH).connection() as conn:
+        yield conn
+
+# スキーマのマイグレーション定義: (バージョン, 説明, SQL文のリスト)
+# 既存テーブルへの変更は必ず末尾に新しいバージョンとして追加すること（適用済みの手順は書き換えない）
+MIGRATIONS = [
+    (1, "base schema", [
+        # フレーズテーブル
+        '''
         CREATE TABLE IF NOT EXISTS phrases (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             folder TEXT NOT NULL,
@@ -19,113 +116,843 @@ def get_db_connection():
             english TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    # フォルダテーブル
-    conn.execute('''
+        ''',
+        # フォルダテーブル
+        '''
         CREATE TABLE IF NOT EXISTS folders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT UNIQUE NOT NULL
         )
-    ''')
-    # study_logテーブルを追記
-    conn.execute('''
+        ''',
+        # 学習記録テーブル
+        '''
         CREATE TABLE IF NOT EXISTS study_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             session_date DATE NOT NULL,
             duration_minutes INTEGER NOT NULL,
             activity_type TEXT NOT NULL
         )
-    ''')
-    # 初期データとしてデフォルトフォルダを作成
+        ''',
+        # 初期データとしてデフォルトフォルダを作成
+        "INSERT OR IGNORE INTO folders (name) VALUES ('MYフレーズ')",
+    ]),
+    (2, "indexes for folder listing and study log", [
+        "CREATE INDEX IF NOT EXISTS idx_phrases_folder_created ON phrases (folder, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_study_log_session_date ON study_log (session_date)",
+    ]),
+    (3, "unique phrases per folder", [
+        # 既存の重複は最も古い行だけを残す
+        '''
+        DELETE FROM phrases WHERE id NOT IN (
+            SELECT MIN(id) FROM phrases GROUP BY folder, japanese, english
+        )
+        ''',
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_phrases_unique ON phrases (folder, japanese, english)",
+    ]),
+    (4, "study time rollups (daily / weekly / monthly)", [
+        # period: 'D' 日別 / 'W' 週別（月曜始まり） / 'M' 月別
+        '''
+        CREATE TABLE IF NOT EXISTS study_rollup (
+            period TEXT NOT NULL,
+            period_start DATE NOT NULL,
+            duration_minutes INTEGER NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, period_start)
+        ) WITHOUT ROWID
+        ''',
+        "DELETE FROM study_rollup",
+        '''
+        INSERT INTO study_rollup (period, period_start, duration_minutes, sessions)
+        SELECT 'D', date(session_date), SUM(duration_minutes), COUNT(*) FROM study_log GROUP BY 2
+        UNION ALL
+        SELECT 'W', date(session_date, 'weekday 0', '-6 days'), SUM(duration_minutes), COUNT(*) FROM study_log GROUP BY 2
+        UNION ALL
+        SELECT 'M', date(session_date, 'start of month'), SUM(duration_minutes), COUNT(*) FROM study_log GROUP BY 2
+        ''',
+        # study_log への追加・削除・更新に合わせて集計を差分更新する
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_study_log_rollup_insert AFTER INSERT ON study_log
+        BEGIN
+            INSERT INTO study_rollup (period, period_start, duration_minutes, sessions) VALUES
+                ('D', date(NEW.session_date), NEW.duration_minutes, 1),
+                ('W', date(NEW.session_date, 'weekday 0', '-6 days'), NEW.duration_minutes, 1),
+                ('M', date(NEW.session_date, 'start of month'), NEW.duration_minutes, 1)
+            ON CONFLICT (period, period_start) DO UPDATE SET
+                duration_minutes = duration_minutes + excluded.duration_minutes,
+                sessions = sessions + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_study_log_rollup_delete AFTER DELETE ON study_log
+        BEGIN
+            UPDATE study_rollup
+            SET duration_minutes = duration_minutes - OLD.duration_minutes, sessions = sessions - 1
+            WHERE (period = 'D' AND period_start = date(OLD.session_date))
+               OR (period = 'W' AND period_start = date(OLD.session_date, 'weekday 0', '-6 days'))
+               OR (period = 'M' AND period_start = date(OLD.session_date, 'start of month'));
+            DELETE FROM study_rollup WHERE sessions <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_study_log_rollup_update
+        AFTER UPDATE OF session_date, duration_minutes ON study_log
+        BEGIN
+            UPDATE study_rollup
+            SET duration_minutes = duration_minutes - OLD.duration_minutes, sessions = sessions - 1
+            WHERE (period = 'D' AND period_start = date(OLD.session_date))
+               OR (period = 'W' AND period_start = date(OLD.session_date, 'weekday 0', '-6 days'))
+               OR (period = 'M' AND period_start = date(OLD.session_date, 'start of month'));
+            DELETE FROM study_rollup WHERE sessions <= 0;
+            INSERT INTO study_rollup (period, period_start, duration_minutes, sessions) VALUES
+                ('D', date(NEW.session_date), NEW.duration_minutes, 1),
+                ('W', date(NEW.session_date, 'weekday 0', '-6 days'), NEW.duration_minutes, 1),
+                ('M', date(NEW.session_date, 'start of month'), NEW.duration_minutes, 1)
+            ON CONFLICT (period, period_start) DO UPDATE SET
+                duration_minutes = duration_minutes + excluded.duration_minutes,
+                sessions = sessions + 1;
+        END
+        ''',
+    ]),
+    (5, "weekly input materials", [
+        '''
+        CREATE TABLE IF NOT EXISTS weekly_materials (
+            week_num INTEGER PRIMARY KEY,
+            english_text TEXT NOT NULL,
+            japanese_text TEXT NOT NULL DEFAULT '',
+            audio_file TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (6, "translation cache", [
+        '''
+        CREATE TABLE IF NOT EXISTS translation_cache (
+            cache_key TEXT PRIMARY KEY,
+            direction TEXT NOT NULL,
+            model TEXT NOT NULL,
+            english TEXT NOT NULL,
+            japanese TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_translation_cache_last_used ON translation_cache (last_used_at)",
+    ]),
+    (7, "recording analysis jobs", [
+        # status: queued / running / done / failed
+        '''
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            stage TEXT NOT NULL DEFAULT '',
+            progress REAL NOT NULL DEFAULT 0,
+            request TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status, created_at)",
+    ]),
+    (8, "prefetched discussion question pool", [
+        # status: ready（出題待ち） / served（出題済み）。出題済みも残して重複チェックに使う
+        '''
+        CREATE TABLE IF NOT EXISTS question_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            question_key TEXT NOT NULL UNIQUE,
+            topic TEXT NOT NULL DEFAULT '',
+            level TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL DEFAULT 'ready',
+            created_at REAL NOT NULL,
+            served_at REAL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_question_pool_ready ON question_pool (status, topic, level, id)",
+    ]),
+    (9, "pre-generated description images", [
+        # content_hash: 元画像（PNG）の sha256。同じ画像は1行にまとまる
+        '''
+        CREATE TABLE IF NOT EXISTS description_images (
+            content_hash TEXT PRIMARY KEY,
+            category TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            original_path TEXT NOT NULL,
+            display_path TEXT NOT NULL,
+            thumb_path TEXT NOT NULL,
+            original_bytes INTEGER NOT NULL,
+            display_bytes INTEGER NOT NULL,
+            shown_count INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_shown_at REAL
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_description_images_category ON description_images (category, shown_count)",
+        "CREATE INDEX IF NOT EXISTS idx_description_images_original ON description_images (original_path)",
+    ]),
+    (10, "LLM call telemetry", [
+        # 1行 = APIリクエスト1回（リトライ込み）。status: ok / error、parse_status: ok / failed / NULL（解析なし）
+        '''
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            endpoint TEXT NOT NULL,
+            operation TEXT NOT NULL DEFAULT '',
+            model TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL,
+            error_type TEXT,
+            latency_ms REAL NOT NULL,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            request_bytes INTEGER,
+            audio_seconds REAL,
+            retries INTEGER NOT NULL DEFAULT 0,
+            stream INTEGER NOT NULL DEFAULT 0,
+            parse_status TEXT,
+            cost_usd REAL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_llm_calls_ts ON llm_calls (ts)",
+    ]),
+    (11, "recording analysis cache", [
+        # cache_key = (録音の指紋, 設問, 採点基準・モデルの版) のハッシュ。details は長さ・流暢さの指標など
+        '''
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            cache_key TEXT PRIMARY KEY,
+            audio_hash TEXT NOT NULL,
+            question TEXT NOT NULL,
+            version TEXT NOT NULL,
+            transcript TEXT NOT NULL,
+            evaluation TEXT NOT NULL,
+            details TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache (last_used_at)",
+    ]),
+    (12, "spaced repetition reviews", [
+        # フレーズ×出題方向（'ja-en' / 'en-ja'）ごとの SM-2 の状態。出題は (folder, direction, due_at) の索引を引くだけ
+        '''
+        CREATE TABLE IF NOT EXISTS reviews (
+            phrase_id INTEGER NOT NULL,
+            direction TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            repetitions INTEGER NOT NULL DEFAULT 0,
+            interval_days REAL NOT NULL DEFAULT 0,
+            ease REAL NOT NULL DEFAULT 2.5,
+            due_at REAL NOT NULL,
+            lapses INTEGER NOT NULL DEFAULT 0,
+            last_quality INTEGER,
+            reviewed_at REAL,
+            PRIMARY KEY (phrase_id, direction)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_reviews_due ON reviews (folder, direction, due_at)",
+        # 既存のフレーズは登録順に「新規（すぐ出題できる）」として入れる
+        '''
+        INSERT OR IGNORE INTO reviews (phrase_id, direction, folder, due_at)
+        SELECT p.id, d.direction, p.folder, CAST(strftime('%s', COALESCE(p.created_at, 'now')) AS REAL)
+        FROM phrases p CROSS JOIN (SELECT 'ja-en' AS direction UNION ALL SELECT 'en-ja') d
+        ''',
+        # フレーズの追加・削除・フォルダ変更に reviews を追従させる
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_phrases_reviews_insert AFTER INSERT ON phrases BEGIN
+            INSERT OR IGNORE INTO reviews (phrase_id, direction, folder, due_at)
+            SELECT NEW.id, d.direction, NEW.folder, (julianday('now') - 2440587.5) * 86400.0
+            FROM (SELECT 'ja-en' AS direction UNION ALL SELECT 'en-ja') d;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_phrases_reviews_delete AFTER DELETE ON phrases BEGIN
+            DELETE FROM reviews WHERE phrase_id = OLD.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_phrases_reviews_folder AFTER UPDATE OF folder ON phrases BEGIN
+            UPDATE reviews SET folder = NEW.folder WHERE phrase_id = NEW.id;
+        END
+        ''',
+    ]),
+    (13, "phrase id index per folder for random sampling", [
+        "CREATE INDEX IF NOT EXISTS idx_phrases_folder_id ON phrases (folder, id)",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn) -> int:
+    """適用済みのスキーマバージョンを返す（schema_versionテーブルが無ければ0）"""
     try:
-        conn.execute("INSERT INTO folders (name) VALUES (?)", ('MYフレーズ',))
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+def migrate(conn) -> int:
+    """未適用のマイグレーションを順番に適用し、最終バージョンを返す"""
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return SCHEMA_VERSION
+    # 複数プロセスが同時に起動しても二重適用しないよう、書き込みロックを取ってから再確認する
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        current = get_schema_version(conn)
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
         conn.commit()
-    except sqlite3.IntegrityError:
-        # すでに存在する場合は何もしない
-        pass
+    except Exception:
+        conn.rollback()
+        raise
+    return SCHEMA_VERSION
 
-    conn.close()
+@st.cache_resource
+def init_db() -> int:
+    """プロセスごとに一度だけスキーマを最新化する"""
+    with get_connection() as conn:
+        return migrate(conn)
 
 def add_folder(folder_name):
     """新しいフォルダを追加する"""
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        conn.execute("INSERT INTO folders (name) VALUES (?)", (folder_name,))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        # フォルダ名が重複している場合
-        return False
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        try:
+            with conn:
+                conn.execute("INSERT INTO folders (name) VALUES (?)", (folder_name,))
+        except sqlite3.IntegrityError:
+            # フォルダ名が重複している場合
+            return False
     return True
 
 def get_folders():
     """すべてのフォルダ名を取得する"""
-    conn = sqlite3.connect(DB_PATH)
-    folders = conn.execute("SELECT name FROM folders ORDER BY name").fetchall()
-    conn.close()
+    with get_connection() as conn:
+        folders = conn.execute("SELECT name FROM folders ORDER BY name").fetchall()
     return [folder[0] for folder in folders]
 
 def add_phrase(folder, japanese, english):
-    """新しいフレーズを追加する"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
-        "INSERT INTO phrases (folder, japanese, english) VALUES (?, ?, ?)",
-        (folder, japanese, english)
-    )
-    conn.commit()
-    conn.close()
+    """新しいフレーズを追加する（同じフォルダに同じフレーズがあれば追加せず False を返す）"""
+    with get_connection() as conn, conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO phrases (folder, japanese, english) VALUES (?, ?, ?)",
+            (folder, japanese, english)
+        )
+    return cur.rowcount > 0
+
+def add_phrases_bulk(rows):
+    """(folder, japanese, english) の組をまとめて1トランザクションで追加し、実際に追加した件数を返す
+
+    同じフォルダ内の重複（既存行・rows内の重複とも）はスキップされる。
+    """
+    with get_connection() as conn, conn:
+        # total_changes はトリガー（reviews への追加）の分も数えるので、文自体の件数を使う
+        cur = conn.executemany(
+            "INSERT OR IGNORE INTO phrases (folder, japanese, english) VALUES (?, ?, ?)",
+            rows
+        )
+        return cur.rowcount
 
 def get_phrases_by_folder(folder):
     """指定されたフォルダのフレーズをPandas DataFrameとして取得する"""
-    conn = sqlite3.connect(DB_PATH)
     query = "SELECT id, japanese, english FROM phrases WHERE folder = ? ORDER BY created_at"
-    df = pd.read_sql_query(query, conn, params=(folder,))
-    conn.close()
-    return df
+    with get_connection() as conn:
+        return pd.read_sql_query(query, conn, params=(folder,))
+
+def _sample_phrase_ids(conn, folder, n):
+    """フォルダ内から重複なしで一様に n 件の id を選ぶ（フォルダが n 件未満なら全件）
+
+    (folder, id) 索引の両端からフォルダの id の範囲を読み、その範囲の乱数の id のうち
+    このフォルダに実在するものだけを採る（棄却サンプリング）。1件ごとの確認は主キーを引くだけなので、
+    フォルダが大きくなっても待ち時間はほぼ変わらない。採れる割合（他のフォルダの行や削除の多さ）に
+    合わせて次の回に試す数を増やし、SAMPLE_PROBE_ROUNDS 回で足りなければ残りを ORDER BY random() で選ぶ。
+    """
+    n = int(n)
+    if n <= 0:
+        return []
+    # MIN と MAX を別々の副問い合わせにすると、どちらも索引の端を1回引くだけになる
+    lo, hi = conn.execute(
+        "SELECT (SELECT MIN(id) FROM phrases WHERE folder = ?), (SELECT MAX(id) FROM phrases WHERE folder = ?)",
+        (folder, folder)
+    ).fetchone()
+    if lo is None:
+        return []
+    ids = {}
+    if hi - lo + 1 > SAMPLE_SCAN_MAX_SPAN:
+        tried, accepted = 0, 0
+        for _ in range(SAMPLE_PROBE_ROUNDS):
+            need = n - len(ids)
+            if need <= 0:
+                break
+            # これまでに採れた割合から、足りない分を集めるのに要りそうな数を試す
+            rate = (accepted + 1) / (tried + 1)
+            k = min(SAMPLE_PROBE_BATCH_MAX, hi - lo + 1, max(2 * need, int(need / rate * 1.5) + 1))
+            probes = random.sample(range(lo, hi + 1), k)
+            rows = conn.execute(
+                f"WITH probes(x) AS (VALUES {', '.join(['(?)'] * k)}) "
+                "SELECT x FROM probes WHERE EXISTS (SELECT 1 FROM phrases WHERE id = x AND folder = ?)",
+                (*probes, folder)
+            ).fetchall()
+            tried, accepted = tried + k, accepted + len(rows)
+            for row in rows:
+                if len(ids) < n:
+                    ids[row[0]] = True
+    if len(ids) < n:
+        # 狭い・疎らなフォルダ（やフォルダが n 件未満のとき）は残りを並べ替えで選ぶ
+        rows = conn.execute(
+            f"SELECT id FROM phrases WHERE folder = ? AND id NOT IN ({', '.join('?' * len(ids))}) "
+            "ORDER BY random() LIMIT ?",
+            (folder, *ids, n - len(ids))
+        ).fetchall()
+        ids.update((row[0], True) for row in rows)
+    return list(ids)
+
+def sample_phrases(folder, n, direction=None, weight_errors=False):
+    """フォルダから一様ランダムに n 件のフレーズを [{"id", "japanese", "english"}] で返す（本文は選んだ行だけ読む）
+
+    weight_errors=True なら n 倍ほどの候補を集め、reviews の間違い回数（lapses）が多いものほど
+    選ばれやすくする（重み付きのリザーバーサンプリング）。direction は reviews の出題方向。
+    """
+    with get_connection() as conn:
+        if not weight_errors or direction is None:
+            ids = _sample_phrase_ids(conn, folder, n)
+        else:
+            candidates = _sample_phrase_ids(conn, folder, n * SAMPLE_WEIGHTED_CANDIDATES)
+            placeholders = ", ".join("?" * len(candidates))
+            lapses = dict(conn.execute(
+                f"SELECT phrase_id, lapses FROM reviews WHERE direction = ? AND phrase_id IN ({placeholders})",
+                (direction, *candidates)
+            ).fetchall()) if candidates else {}
+            # Efraimidis–Spirakis: キー u^(1/w) の大きい順に n 件
+            keyed = sorted(candidates, key=lambda i: random.random() ** (1.0 / (1 + lapses.get(i, 0))), reverse=True)
+            ids = keyed[:n]
+        if not ids:
+            return []
+        rows = conn.execute(
+            f"SELECT id, japanese, english FROM phrases WHERE id IN ({', '.join('?' * len(ids))})", ids
+        ).fetchall()
+    by_id = {row["id"]: dict(row) for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
 
 def update_phrase(phrase_id, new_japanese, new_english):
-    """フレーズを更新する"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
-        "UPDATE phrases SET japanese = ?, english = ? WHERE id = ?",
-        (new_japanese, new_english, phrase_id)
-    )
-    conn.commit()
-    conn.close()
+    """フレーズを更新する（同じフォルダに同じフレーズが既にあれば更新せず False を返す）"""
+    try:
+        with get_connection() as conn, conn:
+            conn.execute(
+                "UPDATE phrases SET japanese = ?, english = ? WHERE id = ?",
+                (new_japanese, new_english, phrase_id)
+            )
+    except sqlite3.IntegrityError:
+        return False
+    return True
 
 def delete_phrase(phrase_id):
     """フレーズを削除する"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("DELETE FROM phrases WHERE id = ?", (phrase_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn, conn:
+        conn.execute("DELETE FROM phrases WHERE id = ?", (phrase_id,))
+
+def get_due_reviews(folder, direction, limit):
+    """期限の早い順に limit 件のフレーズと復習状態を返す（期限前のものも、足りなければ早い順に含む）"""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT p.id, p.japanese, p.english, r.due_at, r.repetitions, r.interval_days, r.ease, r.lapses "
+            "FROM reviews r JOIN phrases p ON p.id = r.phrase_id "
+            "WHERE r.folder = ? AND r.direction = ? ORDER BY r.due_at LIMIT ?",
+            (folder, direction, int(limit))
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+def count_due_reviews(folder, direction, now):
+    """期限が来ている（due_at <= now）フレーズの件数"""
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM reviews WHERE folder = ? AND direction = ? AND due_at <= ?",
+            (folder, direction, now)
+        ).fetchone()[0]
+
+def get_review(phrase_id, direction):
+    """フレーズ1件の復習状態を dict で返す（無ければ None）"""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM reviews WHERE phrase_id = ? AND direction = ?", (phrase_id, direction)
+        ).fetchone()
+    return dict(row) if row else None
+
+def save_review(phrase_id, direction, state):
+    """採点後の復習状態（repetitions, interval_days, ease, due_at, lapses, last_quality, reviewed_at）を保存する"""
+    with get_connection() as conn, conn:
+        conn.execute(
+            "UPDATE reviews SET repetitions = ?, interval_days = ?, ease = ?, due_at = ?, lapses = ?, "
+            "last_quality = ?, reviewed_at = ? WHERE phrase_id = ? AND direction = ?",
+            (state["repetitions"], state["interval_days"], state["ease"], state["due_at"], state["lapses"],
+             state["last_quality"], state["reviewed_at"], phrase_id, direction)
+        )
 
 def log_study_session(duration_minutes, activity_type='speaking'):
     """学習セッションを記録する"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
-        "INSERT INTO study_log (session_date, duration_minutes, activity_type) VALUES (?, ?, ?)",
-        (date.today(), duration_minutes, activity_type)
-    )
-    conn.commit()
-    conn.close()
+    with get_connection() as conn, conn:
+        conn.execute(
+            "INSERT INTO study_log (session_date, duration_minutes, activity_type) VALUES (?, ?, ?)",
+            (date.today(), duration_minutes, activity_type)
+        )
 
 @st.cache_data
-def get_study_log():
-    """すべての学習記録をDataFrameとして取得する"""
-    # この関数が実行されたときにメッセージを表示し、3秒待つ
-    with st.spinner("データをロード中..."):
-        time.sleep(3) 
-
-    conn = sqlite3.connect(DB_PATH)
-    query = "SELECT session_date, duration_minutes FROM study_log"
-    df = pd.read_sql_query(query, conn)
-    # session_dateをdatetime型に変換
-    if not df.empty:
-        df['session_date'] = pd.to_datetime(df['session_date'])
-    conn.close()
+def get_study_rollup(period, start=None, end=None):
+    """集計済みの学習時間を取得する
+
+    period は 'D'（日別）/ 'W'（週別・月曜始まり）/ 'M'（月別）。
+    start / end（date または 'YYYY-MM-DD'）を指定すると、その範囲の集計行だけを読む。
+    """
+    query = "SELECT period_start, duration_minutes, sessions FROM study_rollup WHERE period = ?"
+    params = [period]
+    if start is not None:
+        query += " AND period_start >= ?"
+        params.append(str(start))
+    if end is not None:
+        query += " AND period_start <= ?"
+        params.append(str(end))
+    query += " ORDER BY period_start"
+    with get_connection() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    df['period_start'] = pd.to_datetime(df['period_start'])
+    return df
+
+@st.cache_data
+def get_study_total():
+    """累計の (学習時間[分], セッション数) を返す"""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT COALESCE(SUM(duration_minutes), 0), COALESCE(SUM(sessions), 0) "
+            "FROM study_rollup WHERE period = 'M'"
+        ).fetchone()
+    return int(row[0]), int(row[1])
+
+def get_week_numbers():
+    """登録済みの週番号を昇順で取得する（本文は読まない）"""
+    with get_connection() as conn:
+        rows = conn.execute("SELECT week_num FROM weekly_materials ORDER BY week_num").fetchall()
+    return [row[0] for row in rows]
+
+def get_weekly_material(week_num):
+    """指定した週の教材を dict で取得する（無ければ None）"""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT week_num, english_text, japanese_text, audio_file FROM weekly_materials WHERE week_num = ?",
+            (int(week_num),)
+        ).fetchone()
+    return dict(row) if row else None
+
+def next_week_number():
+    """次に使う週番号を返す"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT COALESCE(MAX(week_num), 0) + 1 FROM weekly_materials").fetchone()
+    return row[0]
+
+def add_weekly_material(week_num, english_text, japanese_text, audio_file=None):
+    """週の教材を追加する"""
+    with get_connection() as conn, conn:
+        conn.execute(
+            "INSERT INTO weekly_materials (week_num, english_text, japanese_text, audio_file) VALUES (?, ?, ?, ?)",
+            (int(week_num), english_text, japanese_text, audio_file)
+        )
+
+def update_weekly_audio(week_num, audio_file):
+    """週の音声ファイルのパスだけを更新する"""
+    with get_connection() as conn, conn:
+        conn.execute(
+            "UPDATE weekly_materials SET audio_file = ? WHERE week_num = ?",
+            (audio_file, int(week_num))
+        )
+
+def import_weekly_json(path):
+    """weekly_input.json の内容を weekly_materials に取り込み、追加した件数を返す
+
+    week_num は整数に揃える。既に登録済みの週はスキップする。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    rows = []
+    for item in items:
+        try:
+            week_num = int(item["week_num"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        rows.append((
+            week_num,
+            item.get("english_text", ""),
+            item.get("japanese_text", ""),
+            item.get("audio_file"),
+        ))
+    with get_connection() as conn, conn:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO weekly_materials (week_num, english_text, japanese_text, audio_file) "
+            "VALUES (?, ?, ?, ?)",
+            rows
+        )
+        return conn.total_changes - before
+
+def get_cached_translation(cache_key):
+    """翻訳キャッシュを引く。ヒットしたら使用時刻を更新して {"english", "japanese"} を返す"""
+    with get_connection() as conn, conn:
+        row = conn.execute(
+            "SELECT english, japanese FROM translation_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE translation_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?",
+            (time.time(), cache_key)
+        )
+    return {"english": row["english"], "japanese": row["japanese"]}
+
+def put_cached_translation(cache_key, direction, model, english, japanese,
+                           max_entries=TRANSLATION_CACHE_MAX_ENTRIES):
+    """翻訳結果をキャッシュに保存し、上限を超えた分は古い順（LRU）に削除する"""
+    with get_connection() as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO translation_cache "
+            "(cache_key, direction, model, english, japanese, last_used_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (cache_key, direction, model, english, japanese, time.time())
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0] - max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM translation_cache WHERE cache_key IN ("
+                "SELECT cache_key FROM translation_cache ORDER BY last_used_at LIMIT ?)",
+                (overflow,)
+            )
+
+def get_translation_cache_size():
+    """翻訳キャッシュの件数を返す"""
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM translation_cache").fetchone()[0]
+
+def get_cached_analysis(cache_key):
+    """録音解析キャッシュを引く。ヒットしたら使用時刻を更新して {"transcript", "evaluation", "details"} を返す"""
+    with get_connection() as conn, conn:
+        row = conn.execute(
+            "SELECT transcript, evaluation, details FROM analysis_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE analysis_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?",
+            (time.time(), cache_key)
+        )
+    return {"transcript": row["transcript"], "evaluation": json.loads(row["evaluation"]),
+            "details": json.loads(row["details"])}
+
+def put_cached_analysis(cache_key, audio_hash, question, version, transcript, evaluation, details,
+                        max_entries=ANALYSIS_CACHE_MAX_ENTRIES):
+    """録音解析の結果をキャッシュに保存し、上限を超えた分は古い順（LRU）に削除する"""
+    now = time.time()
+    with get_connection() as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO analysis_cache "
+            "(cache_key, audio_hash, question, version, transcript, evaluation, details, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (cache_key, audio_hash, question, version, transcript,
+             json.dumps(evaluation, ensure_ascii=False), json.dumps(details, ensure_ascii=False), now, now)
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0] - max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM analysis_cache WHERE cache_key IN ("
+                "SELECT cache_key FROM analysis_cache ORDER BY last_used_at LIMIT ?)",
+                (overflow,)
+            )
+
+def _job_row_to_dict(row):
+    job = dict(row)
+    job["request"] = json.loads(job["request"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def create_analysis_job(job_id, request):
+    """解析ジョブを queued 状態で登録する（request はJSONにできる dict）"""
+    now = time.time()
+    with get_connection() as conn, conn:
+        conn.execute(
+            "INSERT INTO analysis_jobs (id, status, request, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, json.dumps(request, ensure_ascii=False), now, now)
+        )
+
+def update_analysis_job(job_id, status=None, stage=None, progress=None, result=None, error=None):
+    """解析ジョブの状態を更新する（None の項目は変更しない）"""
+    sets, params = ["updated_at = ?"], [time.time()]
+    for column, value in (("status", status), ("stage", stage), ("progress", progress), ("error", error)):
+        if value is not None:
+            sets.append(f"{column} = ?")
+            params.append(value)
+    if result is not None:
+        sets.append("result = ?")
+        params.append(json.dumps(result, ensure_ascii=False))
+    params.append(job_id)
+    with get_connection() as conn, conn:
+        conn.execute(f"UPDATE analysis_jobs SET {', '.join(sets)} WHERE id = ?", params)
+
+def get_analysis_job(job_id):
+    """解析ジョブを dict で取得する（request / result はデコード済み）"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_row_to_dict(row) if row else None
+
+def get_unfinished_analysis_jobs():
+    """queued / running のまま残っている解析ジョブを古い順に取得する"""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT * FROM analysis_jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+    return [_job_row_to_dict(row) for row in rows]
+
+def add_pool_questions(rows, status='ready'):
+    """(question, question_key, topic, level) の行を設問プールに追加する。
+
+    question_key が既にある設問（出題済みを含む）は追加しない。追加できた件数を返す。
+    """
+    now = time.time()
+    with get_connection() as conn, conn:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO question_pool (question, question_key, topic, level, status, created_at, served_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(q, key, topic, level, status, now, now if status == 'served' else None)
+             for q, key, topic, level in rows]
+        )
+        return conn.total_changes - before
+
+def pop_pool_question(topic=None, level=None):
+    """出題待ちの設問を古い順に1件取り出して served にする。無ければ None"""
+    where, params = ["status = 'ready'"], []
+    if topic:
+        where.append("topic = ?")
+        params.append(topic)
+    if level:
+        where.append("level = ?")
+        params.append(level)
+    with get_connection() as conn, conn:
+        row = conn.execute(
+            "UPDATE question_pool SET status = 'served', served_at = ? WHERE id = ("
+            f"SELECT id FROM question_pool WHERE {' AND '.join(where)} ORDER BY id LIMIT 1) "
+            "RETURNING id, question, topic, level",
+            [time.time()] + params
+        ).fetchone()
+    return dict(row) if row else None
+
+def count_pool_questions(topic=None, level=None):
+    """出題待ちの設問数を返す"""
+    where, params = ["status = 'ready'"], []
+    if topic:
+        where.append("topic = ?")
+        params.append(topic)
+    if level:
+        where.append("level = ?")
+        params.append(level)
+    with get_connection() as conn:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM question_pool WHERE {' AND '.join(where)}", params
+        ).fetchone()[0]
+
+def add_description_image(image):
+    """生成した説明用画像を登録する（image は description_images の列名をキーにした dict）。
+
+    同じ content_hash が既にあれば何もせず False を返す。
+    """
+    columns = ["content_hash", "category", "prompt", "original_path", "display_path", "thumb_path",
+               "original_bytes", "display_bytes"]
+    with get_connection() as conn, conn:
+        cur = conn.execute(
+            f"INSERT OR IGNORE INTO description_images ({', '.join(columns)}, created_at) "
+            f"VALUES ({', '.join('?' * len(columns))}, ?)",
+            [image[c] for c in columns] + [time.time()]
+        )
+        return cur.rowcount > 0
+
+def pick_description_image(category=None, exclude_hash=None):
+    """表示回数の少ない画像を1枚選んで表示回数を増やし、dict で返す。無ければ None"""
+    where, params = ["1 = 1"], []
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if exclude_hash:
+        where.append("content_hash != ?")
+        params.append(exclude_hash)
+    with get_connection() as conn, conn:
+        row = conn.execute(
+            "UPDATE description_images SET shown_count = shown_count + 1, last_shown_at = ? "
+            "WHERE content_hash = ("
+            f"SELECT content_hash FROM description_images WHERE {' AND '.join(where)} "
+            "ORDER BY shown_count, random() LIMIT 1) RETURNING *",
+            [time.time()] + params
+        ).fetchone()
+    return dict(row) if row else None
+
+def get_description_image_counts():
+    """カテゴリごとの {category: (画像数, まだ表示していない画像数)}"""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT category, COUNT(*), SUM(shown_count = 0) FROM description_images GROUP BY category"
+        ).fetchall()
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+def count_description_images_since(since):
+    """created_at が since（UNIX 秒）以降の画像の数"""
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM description_images WHERE created_at >= ?", (since,)
+        ).fetchone()[0]
+
+def get_description_image_by_path(original_path):
+    """元画像のパスから登録情報を引く（表示用の縮小版を探すため）"""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM description_images WHERE original_path = ?", (original_path,)
+        ).fetchone()
+    return dict(row) if row else None
+
+LLM_CALL_COLUMNS = ["ts", "endpoint", "operation", "model", "status", "error_type", "latency_ms",
+                    "prompt_tokens", "completion_tokens", "request_bytes", "audio_seconds", "retries",
+                    "stream", "parse_status", "cost_usd"]
+
+def insert_llm_calls(calls):
+    """API呼び出しの記録（LLM_CALL_COLUMNS をキーにした dict のリスト）をまとめて書き込む"""
+    with get_connection() as conn, conn:
+        conn.executemany(
+            f"INSERT INTO llm_calls ({', '.join(LLM_CALL_COLUMNS)}) VALUES ({', '.join('?' * len(LLM_CALL_COLUMNS))})",
+            [[c.get(col) for col in LLM_CALL_COLUMNS] for c in calls]
+        )
+
+def prune_llm_calls(before_ts):
+    """before_ts（UNIX秒）より古い記録を削除し、削除件数を返す"""
+    with get_connection() as conn, conn:
+        return conn.execute("DELETE FROM llm_calls WHERE ts < ?", (before_ts,)).rowcount
+
+@st.cache_data(ttl=30)
+def get_llm_calls(since_ts):
+    """since_ts（UNIX秒）以降のAPI呼び出しの記録を DataFrame で返す（ts は datetime に変換済み）"""
+    with get_connection() as conn:
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(LLM_CALL_COLUMNS)} FROM llm_calls WHERE ts >= ? ORDER BY ts",
+            conn, params=[since_ts]
+        )
+    # 画面はローカル時刻で表示する
+    local_tz = datetime.now().astimezone().tzinfo
+    df['ts'] = pd.to_datetime(df['ts'], unit='s', utc=True).dt.tz_convert(local_tz).dt.tz_localize(None)
     return df
 
 # アプリ起動時に一度だけ実行
-get_db_connection()
\ No newline at end of file
+init_db()
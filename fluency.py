@@ -0,0 +1,67 @@
+"""録音から手元で計算する流暢さの指標。
+
+API を呼ばずに発話区間（vad.py）だけから出せるので、録音が止まった直後に画面に出せる。
+語数を使う指標（発話速度・平均発話長）は文字起こしが届いてから add_transcript_metrics で足す。
+評価の LLM にも根拠として渡す（fluency_evidence）。
+
+- 発話速度 speech_rate_wpm: 1分の発話（有声区間）あたりの語数
+- ポーズ: 発話区間のあいだの無音（vad.MIN_GAP_SEC より短い間は発話に含まれる）
+- 平均発話長 mean_length_of_run: ポーズで区切られたひと続きの発話あたりの語数
+- 発話率 articulation_ratio: 話し始めから話し終わりまでのうち、声が出ていた割合
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from vad import analyze_wav
+
+# これ以上の無音は「長いポーズ」として別に数える
+LONG_PAUSE_SEC = 1.0
+
+
+def compute_fluency(segments: List[Tuple[float, float]]) -> Dict:
+    """発話区間 [(開始秒, 終了秒), ...] からポーズと発話率の指標を計算する"""
+    seg = np.asarray(segments, dtype=np.float64).reshape(-1, 2)
+    if len(seg) == 0:
+        return {"speech_sec": 0.0, "pause_count": 0, "long_pause_count": 0, "mean_pause_sec": 0.0,
+                "max_pause_sec": 0.0, "run_count": 0, "mean_run_sec": 0.0, "articulation_ratio": 0.0}
+    runs = seg[:, 1] - seg[:, 0]
+    pauses = seg[1:, 0] - seg[:-1, 1]
+    span = seg[-1, 1] - seg[0, 0]
+    return {
+        "speech_sec": round(float(runs.sum()), 2),
+        "pause_count": int(len(pauses)),
+        "long_pause_count": int(np.count_nonzero(pauses >= LONG_PAUSE_SEC)),
+        "mean_pause_sec": round(float(pauses.mean()), 2) if len(pauses) else 0.0,
+        "max_pause_sec": round(float(pauses.max()), 2) if len(pauses) else 0.0,
+        "run_count": int(len(runs)),
+        "mean_run_sec": round(float(runs.mean()), 2),
+        "articulation_ratio": round(float(runs.sum() / span), 2) if span > 0 else 0.0,
+    }
+
+
+def add_transcript_metrics(metrics: Dict, transcript: str) -> Dict:
+    """文字起こしの語数から発話速度と平均発話長を足した指標を返す（元の dict は変えない）"""
+    words = len(transcript.split())
+    out = dict(metrics, word_count=words)
+    out["speech_rate_wpm"] = round(words / metrics["speech_sec"] * 60, 1) if metrics["speech_sec"] else 0.0
+    out["mean_length_of_run"] = round(words / metrics["run_count"], 1) if metrics["run_count"] else 0.0
+    return out
+
+
+def analyze_fluency(wav_bytes: bytes, transcript: Optional[str] = None) -> Dict:
+    """WAV から指標を計算する（transcript があれば語数を使う指標も足す）"""
+    metrics = compute_fluency(analyze_wav(wav_bytes)["segments"])
+    return add_transcript_metrics(metrics, transcript) if transcript is not None else metrics
+
+
+def fluency_evidence(metrics: Dict) -> str:
+    """評価プロンプトに添える英語の説明（1〜2行）"""
+    parts = []
+    if "speech_rate_wpm" in metrics:
+        parts.append(f"speech rate {metrics['speech_rate_wpm']} words per minute of voiced time, "
+                     f"mean length of run {metrics['mean_length_of_run']} words")
+    parts.append(f"{metrics['pause_count']} pauses (mean {metrics['mean_pause_sec']} s, "
+                 f"longest {metrics['max_pause_sec']} s, {metrics['long_pause_count']} of {LONG_PAUSE_SEC:g} s or more)")
+    parts.append(f"articulation ratio {metrics['articulation_ratio']} (voiced time / speaking span)")
+    return "; ".join(parts)
@@ -0,0 +1,165 @@
+"""学習素材の生成（インプット用パッセージ・ディスカッション質問・説明タスク用の画像）。
+
+画面から切り離してあるので、ベンチマーク（benchmarks/bench_llm_paths.py）からも同じ関数を呼べる。
+"""
+import base64
+import datetime as dt
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from llm_client import chat_completion, image_generation
+from telemetry import instrumented
+
+
+@instrumented("generate_toefl_passage", parses_json=True)
+def generate_toefl_passage(client: OpenAI) -> Dict[str, str]:
+    sys = "You are an expert ESL content writer for TOEFL preparation."
+    user = """
+Return ONLY valid compact JSON. No markdown. Keys: {"english": "...", "japanese": "..."}.
+
+Requirements for "english":
+- Level: TOEFL iBT reading/listening passage difficulty (B2–C1).
+- Length: about 150 words (±20%).
+- Topic: academic or social (technology & society, environment, psychology, education, culture).
+- Style: clear, neutral, coherent, with 2–4 sentences or short paragraphs.
+
+Requirements for "japanese":
+- Provide a natural and faithful Japanese translation of the English passage.
+
+Again, output strict JSON with keys "english" and "japanese" only.
+"""
+    resp = chat_completion(
+        client,
+        model="gpt-4o-mini",
+        temperature=0.8,
+        messages=[
+            {"role": "system", "content": sys},
+            {"role": "user", "content": user}
+        ]
+    )
+    content = resp.choices[0].message.content.strip()
+    start = content.find("{"); end = content.rfind("}")
+    if start != -1 and end != -1:
+        content = content[start:end+1]
+    data = json.loads(content)
+    return {"english": data["english"], "japanese": data["japanese"]}
+
+
+@instrumented("generate_toefl_question")
+def generate_toefl_question(client: OpenAI, output_json_path: Optional[str] = None) -> str:
+    """TOEFLレベルのディスカッション質問を1つ生成（output_json_path があればそこにも保存）。"""
+    prompt = """Generate ONE TOEFL-style discussion question (B2–C1) in one sentence.
+Return only the question text."""
+    resp = chat_completion(
+        client,
+        model="gpt-4o-mini",
+        temperature=0.7,
+        messages=[
+            {"role": "system", "content": "You create concise TOEFL-style prompts."},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    q = resp.choices[0].message.content.strip().strip('"')
+    if output_json_path:
+        try:
+            # { "key": int, "question": "..." } の配列想定（サンプル準拠）
+            # 新規 key は連番で採番
+            dat = []
+            if os.path.exists(output_json_path):
+                with open(output_json_path, "r", encoding="utf-8") as f:
+                    dat = json.load(f)
+            next_key = (max([d.get("key", 0) for d in dat]) + 1) if dat else 1
+            dat.append({"key": next_key, "question": q})
+            with open(output_json_path, "w", encoding="utf-8") as f:
+                json.dump(dat, f, ensure_ascii=False, indent=2)
+        except Exception:
+            pass
+    return q
+
+
+# 設問プール（question_pool.py）で使うタグ
+QUESTION_TOPICS = ["education", "technology", "environment", "society", "work", "culture", "health"]
+QUESTION_LEVELS = ["B2", "C1"]
+
+
+@instrumented("generate_toefl_questions", parses_json=True)
+def generate_toefl_questions(client: OpenAI, n: int, topic: str, level: str) -> List[str]:
+    """指定トピック・レベルのディスカッション質問を n 個まとめて生成する（1リクエスト）。"""
+    prompt = f"""Generate {n} different TOEFL-style discussion questions.
+- Topic: {topic}
+- Level: {level}
+- Each question is one sentence and can be answered in about one minute.
+
+Return ONLY JSON: {{"questions": ["...", "..."]}}"""
+    resp = chat_completion(
+        client,
+        model="gpt-4o-mini",
+        temperature=0.9,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": "You create concise TOEFL-style prompts."},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    content = resp.choices[0].message.content.strip()
+    start = content.find("{"); end = content.rfind("}")
+    if start != -1 and end != -1:
+        content = content[start:end+1]
+    questions = json.loads(content).get("questions", [])
+    return [str(q).strip().strip('"') for q in questions if str(q).strip()]
+
+
+def description_categories() -> List[str]:
+    # 多様な日常/公共シーン
+    return [
+        "modern open-plan office",
+        "cozy living room at home",
+        "airplane cabin during boarding",
+        "busy train station concourse",
+        "university classroom with projector",
+        "quiet library interior",
+        "coffee shop counter and seating area",
+        "suburban kitchen interior",
+        "hotel lobby reception area",
+        "tech startup workspace with whiteboards"
+    ]
+
+
+@instrumented("generate_description_image")
+def generate_description_image_bytes(client: OpenAI, category: Optional[str] = None) -> Tuple[bytes, str]:
+    """説明タスク用の写真を1枚生成して (PNGのバイト列, prompt_used) を返す。category 省略時はランダム"""
+    category = category or random.choice(description_categories())
+    prompt = (
+        f"Photorealistic, high-resolution interior or public scene: {category}. "
+        "Natural lighting, realistic textures, rich details. No text or watermarks."
+    )
+
+    # OpenAI Images API（base64で受け取る）
+    img_resp = image_generation(
+        client,
+        model="gpt-image-1",
+        prompt=prompt,
+        size="1024x1024",
+        quality="high",
+        n=1,
+    )
+    return base64.b64decode(img_resp.data[0].b64_json), prompt
+
+
+def generate_description_image(client: OpenAI, out_dir: str) -> Tuple[str, str]:
+    """
+    説明タスク用の写真を1枚生成して out_dir に保存。
+    戻り値: (image_path, prompt_used)
+    """
+    img_bytes, prompt = generate_description_image_bytes(client)
+
+    ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+    out_path = os.path.join(out_dir, f"description_{ts}.png")
+    with open(out_path, "wb") as f:
+        f.write(img_bytes)
+
+    return out_path, prompt
@@ -0,0 +1,144 @@
+"""MYクイズの答え合わせ（あいまい一致の採点）。
+
+- 日本語の正解: 文字 bigram の Dice 係数（語順や送り仮名の小さな違いに強い。空白は無視）
+- 英語の正解: 正規化した文字列の編集距離（Levenshtein）を長い方の長さで割って 1 から引いたもの
+
+grade_batch はクイズ全体の解答を NumPy でまとめて採点する（編集距離も全問を同時に1行ずつ進める）。
+正解側の前処理（正規化・bigram・文字コード列）は answer_signature で正解の文字列ごとにキャッシュする。
+"""
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+# これ以上の一致度なら正解にする
+PASS_RATIO = 0.8
+SIGNATURE_CACHE_SIZE = 4096
+
+_JAPANESE = re.compile(r"[぀-ヿ㐀-䶿一-鿿]")
+
+
+def normalize(s: str) -> str:
+    """全角半角（NFKC）・大文字小文字・余分な空白・句読点差を吸収する（英日両対応）"""
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFKC", s).strip()
+    s = re.sub(r"\s+", " ", s)
+    # 句読点など広めに除去（ひらカナ漢字は残す／- ' は残す）
+    s = re.sub(r"[^\w\s'\-]", "", s)
+    return s.lower()
+
+
+def is_japanese(s: str) -> bool:
+    return bool(_JAPANESE.search(s or ""))
+
+
+def _bigrams(s: str) -> Counter:
+    s = s.replace(" ", "")
+    if len(s) < 2:
+        return Counter([s]) if s else Counter()
+    return Counter(s[i:i + 2] for i in range(len(s) - 1))
+
+
+class Signature(NamedTuple):
+    norm: str
+    japanese: bool
+    bigrams: Counter
+    codes: np.ndarray  # 正規化した文字列のコードポイント（編集距離用）
+
+
+@lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def answer_signature(text: str) -> Signature:
+    """正解の前処理（同じ正解の文字列なら2回目以降はキャッシュから返す）"""
+    norm = normalize(text)
+    return Signature(norm, is_japanese(text), _bigrams(norm),
+                     np.frombuffer(norm.encode("utf-32-le"), dtype=np.uint32))
+
+
+def _dice_batch(answers: List[str], sigs: List[Signature]) -> np.ndarray:
+    """bigram の多重集合の Dice 係数をまとめて計算する"""
+    ans_grams = [_bigrams(a) for a in answers]
+    vocab = {g: i for i, g in enumerate({g for c in ans_grams for g in c} | {g for s in sigs for g in s.bigrams})}
+    a = np.zeros((len(answers), len(vocab)), dtype=np.int32)
+    b = np.zeros_like(a)
+    for row, (ca, sig) in enumerate(zip(ans_grams, sigs)):
+        for g, n in ca.items():
+            a[row, vocab[g]] = n
+        for g, n in sig.bigrams.items():
+            b[row, vocab[g]] = n
+    total = a.sum(axis=1) + b.sum(axis=1)
+    overlap = np.minimum(a, b).sum(axis=1)
+    return np.where(total > 0, 2 * overlap / np.maximum(total, 1), 1.0)
+
+
+def _codes_matrix(codes: List[np.ndarray]) -> np.ndarray:
+    width = max((len(c) for c in codes), default=0)
+    m = np.zeros((len(codes), width), dtype=np.int64) - 1
+    for row, c in enumerate(codes):
+        m[row, :len(c)] = c
+    return m
+
+
+def _levenshtein_batch(answers: List[np.ndarray], golds: List[np.ndarray]) -> np.ndarray:
+    """編集距離を全組まとめて計算する。
+
+    正解側の1文字ごとに DP の1行を全組同時に更新する。行内の挿入（左隣からの遷移）は
+    D[j] = j + cummin(T[k] - k) で求まるので、np.minimum.accumulate で一度に出せる。
+    """
+    n = len(answers)
+    la = np.array([len(a) for a in answers])
+    lg = np.array([len(g) for g in golds])
+    A = _codes_matrix(answers)               # (n, wa)
+    G = _codes_matrix(golds)                 # (n, wg)
+    wa = A.shape[1]
+    j = np.arange(wa + 1)
+    prev = np.broadcast_to(j, (n, wa + 1)).copy()
+    dist = np.where(lg == 0, la, 0)
+    for i in range(1, G.shape[1] + 1):
+        cost = (A != G[:, i - 1:i]).astype(np.int64)                     # (n, wa)
+        t = np.empty_like(prev)
+        t[:, 0] = i
+        t[:, 1:] = np.minimum(prev[:, 1:] + 1, prev[:, :-1] + cost)
+        cur = np.minimum.accumulate(t - j, axis=1) + j
+        prev = cur
+        done = lg == i
+        dist[done] = cur[done, la[done]]
+    return dist
+
+
+def grade_batch(answers: Sequence[str], golds: Sequence[str]) -> np.ndarray:
+    """解答と正解の組をまとめて採点し、一致度（0〜1）の配列を返す"""
+    sigs = [answer_signature(g) for g in golds]
+    norms = [normalize(a) for a in answers]
+    ratios = np.zeros(len(sigs))
+    ja = np.array([s.japanese for s in sigs], dtype=bool)
+
+    if ja.any():
+        idx = np.flatnonzero(ja)
+        ratios[idx] = _dice_batch([norms[i] for i in idx], [sigs[i] for i in idx])
+
+    if (~ja).any():
+        idx = np.flatnonzero(~ja)
+        ans_codes = [np.frombuffer(norms[i].encode("utf-32-le"), dtype=np.uint32) for i in idx]
+        gold_codes = [sigs[i].codes for i in idx]
+        dist = _levenshtein_batch(ans_codes, gold_codes)
+        longest = np.maximum([len(c) for c in ans_codes], [len(c) for c in gold_codes])
+        ratios[idx] = np.where(longest > 0, 1 - dist / np.maximum(longest, 1), 1.0)
+
+    # 片方だけ空なら 0
+    empty = np.array([(not a) != (not s.norm) for a, s in zip(norms, sigs)], dtype=bool)
+    ratios[empty] = 0.0
+    return ratios
+
+
+def grade(answer: str, gold: str) -> float:
+    """1問分の一致度（0〜1）"""
+    return float(grade_batch([answer], [gold])[0])
+
+
+def is_correct(answer: str, gold: str, ratio: float) -> bool:
+    """正規化して完全一致、または一致度が PASS_RATIO 以上なら正解"""
+    return normalize(answer) == answer_signature(gold).norm or ratio >= PASS_RATIO
@@ -0,0 +1,158 @@
+"""DESCRIPTION モード用の、事前生成した写真のプール。
+
+画像生成（gpt-image-1, 1024x1024, high）は1枚に何秒もかかるので、画面では生成を待たずに
+description_images テーブルから表示回数の少ない画像を選ぶだけにする。
+不足分（まだ表示していない画像が FRESH_PER_CATEGORY 枚未満のカテゴリ）はバックグラウンドで補充する。
+1カテゴリ MAX_PER_CATEGORY 枚に達したら、それ以上は生成せず既存の画像を使い回す。
+画像生成は有料なので、バックグラウンドの補充は直近24時間で BACKGROUND_DAILY_LIMIT 枚まで
+（secrets の IMAGE_POOL_DAILY_LIMIT で変えられる。0 なら補充しない）。上限に達したら既存の画像を使い回す。
+
+画像は元のPNGの sha256 をファイル名にして保存し（同じ画像は1つにまとまる）、
+画面表示用の縮小版（WebP）とサムネイル（JPEG）も作っておく。
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import streamlit as st
+from openai import OpenAI
+from PIL import Image, features
+
+from database import (
+    add_description_image,
+    count_description_images_since,
+    get_description_image_by_path,
+    get_description_image_counts,
+    pick_description_image,
+)
+from generation import description_categories, generate_description_image_bytes
+
+FRESH_PER_CATEGORY = 1
+MAX_PER_CATEGORY = 12
+# 画面表示用（長辺px, 品質）とサムネイル（長辺px, 品質）
+DISPLAY_SIZE, DISPLAY_QUALITY = 768, 80
+THUMB_SIZE, THUMB_QUALITY = 256, 75
+POOL_SUBDIR = "pool"
+# バックグラウンドで生成する画像の、直近24時間あたりの上限
+BACKGROUND_DAILY_LIMIT = 8
+
+# 生成中のカテゴリ。同じカテゴリを二重に生成しない
+_generating = set()
+_generating_lock = threading.Lock()
+
+
+@st.cache_resource
+def _executor() -> ThreadPoolExecutor:
+    """補充用のワーカー（画像生成のレート制限は llm_client 側で共有）"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-pool")
+
+
+def _resized(img: Image.Image, longest: int) -> Image.Image:
+    img = img.convert("RGB")
+    img.thumbnail((longest, longest), Image.LANCZOS)
+    return img
+
+
+def store_image(png_bytes: bytes, category: str, prompt: str, image_dir: str) -> dict:
+    """元画像と縮小版を保存してプールに登録し、登録内容を返す（同じ画像なら既存の行を返す）"""
+    content_hash = hashlib.sha256(png_bytes).hexdigest()
+    pool_dir = os.path.join(image_dir, POOL_SUBDIR)
+    os.makedirs(pool_dir, exist_ok=True)
+    original_path = os.path.join(pool_dir, f"{content_hash}.png")
+    existing = get_description_image_by_path(original_path)
+    if existing:
+        return existing
+
+    with open(original_path, "wb") as f:
+        f.write(png_bytes)
+    img = Image.open(io.BytesIO(png_bytes))
+
+    # WebP が使えない Pillow では表示用も JPEG にする
+    display_format = "WEBP" if features.check("webp") else "JPEG"
+    display_path = os.path.join(pool_dir, f"{content_hash}_display.{display_format.lower()}")
+    _resized(img, DISPLAY_SIZE).save(display_path, display_format, quality=DISPLAY_QUALITY)
+    thumb_path = os.path.join(pool_dir, f"{content_hash}_thumb.jpg")
+    _resized(img, THUMB_SIZE).save(thumb_path, "JPEG", quality=THUMB_QUALITY, optimize=True)
+
+    image = {
+        "content_hash": content_hash,
+        "category": category,
+        "prompt": prompt,
+        "original_path": original_path,
+        "display_path": display_path,
+        "thumb_path": thumb_path,
+        "original_bytes": len(png_bytes),
+        "display_bytes": os.path.getsize(display_path),
+    }
+    add_description_image(image)
+    return image
+
+
+def generate_into_pool(client: OpenAI, category: str, image_dir: str) -> dict:
+    png_bytes, prompt = generate_description_image_bytes(client, category)
+    return store_image(png_bytes, category, prompt, image_dir)
+
+
+def _generate_job(client: OpenAI, category: str, image_dir: str) -> None:
+    try:
+        generate_into_pool(client, category, image_dir)
+    finally:
+        with _generating_lock:
+            _generating.discard(category)
+
+
+def background_daily_limit() -> int:
+    """バックグラウンド生成の24時間あたりの上限（secrets の IMAGE_POOL_DAILY_LIMIT があればそちら）"""
+    try:
+        return int(st.secrets.get("IMAGE_POOL_DAILY_LIMIT", BACKGROUND_DAILY_LIMIT))
+    except Exception:
+        return BACKGROUND_DAILY_LIMIT
+
+
+def ensure_image_pool(client: OpenAI, image_dir: str) -> int:
+    """新しい画像が足りないカテゴリの生成をバックグラウンドで始める。始めた件数を返す
+
+    直近24時間に作った画像と生成中の画像の合計が background_daily_limit() に達していたら始めない。
+    """
+    budget = background_daily_limit() - count_description_images_since(time.time() - 86400)
+    counts = get_description_image_counts()
+    started = 0
+    for category in description_categories():
+        total, fresh = counts.get(category, (0, 0))
+        if fresh >= FRESH_PER_CATEGORY or total >= MAX_PER_CATEGORY:
+            continue
+        with _generating_lock:
+            if category in _generating or len(_generating) >= budget:
+                continue
+            _generating.add(category)
+        _executor().submit(_generate_job, client, category, image_dir)
+        started += 1
+    return started
+
+
+def next_image(client: OpenAI, image_dir: str, exclude_hash: Optional[str] = None) -> dict:
+    """表示する画像を1枚選ぶ。プールが空のときだけその場で生成する（最初の1回）"""
+    image = pick_description_image(exclude_hash=exclude_hash)
+    if image is None:
+        image = generate_into_pool(client, _least_stocked_category(), image_dir)
+        image = pick_description_image(exclude_hash=exclude_hash) or image
+    ensure_image_pool(client, image_dir)
+    return image
+
+
+def _least_stocked_category() -> str:
+    counts = get_description_image_counts()
+    return min(description_categories(), key=lambda c: counts.get(c, (0, 0))[0])
+
+
+def display_path_for(image_path: str, thumb: bool = False) -> str:
+    """プールの元画像なら画面表示用の縮小版（thumb=True ならサムネイル）のパスを返す。それ以外はそのまま"""
+    image = get_description_image_by_path(image_path)
+    variant = image and image["thumb_path" if thumb else "display_path"]
+    if variant and os.path.exists(variant):
+        return variant
+    return image_path
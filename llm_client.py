@@ -0,0 +1,281 @@
+"""OpenAI クライアントの共有と、API呼び出しの共通処理。
+
+- get_client(): プロセスで1つだけ作るクライアント（keep-alive の接続プールを使い回す）
+- chat_completion / transcription / image_generation:
+  エンドポイントごとのタイムアウト、トークンバケットによるレート制限、
+  429 / 5xx / 通信エラー時のジッター付き指数バックオフでのリトライをまとめて行う
+
+アプリ内のLLM呼び出しはすべてこの3関数を通すこと。各リクエストの所要時間・トークン数などは
+telemetry.record_call で llm_calls テーブルに記録される。
+
+chat_completion（ストリーム以外）と transcription は、同じ内容のリクエストが実行中（と完了後
+singleflight.GRACE_SEC 秒以内）なら上流を呼ばずにその結果を共有する。まとめた回数は call_stats の coalesced。
+temperature > 0 の chat（設問・教材の生成など、呼ぶたびに違う結果がほしいもの）は、実行中の重複だけを
+まとめ、完了後の結果は使い回さない（「新しく生成」を続けて押したときや、続けて補充するときに同じ結果を返さない）。
+"""
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import wave
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import streamlit as st
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    DefaultHttpxClient,
+    OpenAI,
+    RateLimitError,
+    Timeout,
+)
+
+from singleflight import SingleFlight
+from telemetry import record_call
+
+# エンドポイントごとの (全体タイムアウト秒, 接続タイムアウト秒)
+ENDPOINT_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    "chat": (60.0, 5.0),
+    "transcription": (120.0, 5.0),
+    "image": (180.0, 5.0),
+}
+# エンドポイントごとの (1秒あたりの補充数, バケット容量)
+ENDPOINT_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "chat": (5.0, 20),
+    "transcription": (1.0, 5),
+    "image": (0.2, 3),
+}
+MAX_RETRIES = 4
+# 同じ内容の同時リクエストをまとめる（singleflight.py）。計測などで毎回上流を呼びたいときは False にする
+COALESCE_REQUESTS = True
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限（スレッド間で共有する）"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """トークンが取れるまで待つ。待った秒数を返す"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                shortage = (tokens - self._tokens) / self.rate
+            time.sleep(shortage)
+            waited += shortage
+
+
+@st.cache_resource
+def get_client() -> OpenAI:
+    """アプリ全体で共有する OpenAI クライアント。
+
+    リトライはこのモジュールで行うので SDK 側のリトライは切っておく。
+    secrets に OPENAI_BASE_URL があればそちらに接続する（ローカルの代替サーバーなど）。
+    """
+    total, connect = ENDPOINT_TIMEOUTS["chat"]
+    return OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        base_url=st.secrets.get("OPENAI_BASE_URL") or None,
+        max_retries=0,
+        timeout=Timeout(total, connect=connect),
+        http_client=DefaultHttpxClient(),
+    )
+
+
+@st.cache_resource
+def _rate_limiters() -> Dict[str, TokenBucket]:
+    return {name: TokenBucket(rate, capacity) for name, (rate, capacity) in ENDPOINT_RATE_LIMITS.items()}
+
+
+# プロセス内の呼び出し回数（エンドポイントごと）
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(endpoint: str, name: str, n: int = 1) -> None:
+    with _stats_lock:
+        bucket = _stats.setdefault(endpoint, {"calls": 0, "retries": 0, "errors": 0, "coalesced": 0})
+        bucket[name] += n
+
+
+def call_stats() -> Dict[str, Dict[str, int]]:
+    """エンドポイントごとの呼び出し・リトライ・失敗回数と、同じリクエストをまとめて省いた回数"""
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+# プロセス内で計測した所要時間など（名前ごとの 件数 / 合計 / 最大 / 直近）
+_metrics: Dict[str, Dict[str, float]] = {}
+
+
+def record_metric(name: str, value: float) -> None:
+    """呼び出し側で測った値（例: 評価の最初の表示までの秒数）を記録する"""
+    with _stats_lock:
+        m = _metrics.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        m["count"] += 1
+        m["total"] += value
+        m["max"] = max(m["max"], value)
+        m["last"] = value
+
+
+def metric_stats() -> Dict[str, Dict[str, float]]:
+    """record_metric で記録した値の集計（平均 mean を含む）"""
+    with _stats_lock:
+        return {k: dict(v, mean=v["total"] / v["count"]) for k, v in _metrics.items() if v["count"]}
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, (RateLimitError, APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+def _retry_after(e: Exception) -> float:
+    """Retry-After ヘッダ（秒）があれば返す"""
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter: 0〜(base * 2^attempt) の一様乱数
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _call(endpoint: str, fn: Callable[[OpenAI], Any], client: OpenAI, model: str = "",
+          request_bytes: Optional[int] = None, audio_seconds: Optional[float] = None,
+          stream: bool = False, images: int = 0) -> Any:
+    total, connect = ENDPOINT_TIMEOUTS[endpoint]
+    scoped = client.with_options(timeout=Timeout(total, connect=connect))
+    limiter = _rate_limiters()[endpoint]
+    attempt = 0
+    started = time.perf_counter()
+
+    def record(status: str, usage: Any = None, error: Optional[Exception] = None) -> None:
+        record_call(endpoint, model, status, (time.perf_counter() - started) * 1e3, attempt, usage=usage,
+                    error_type=type(error).__name__ if error else None, request_bytes=request_bytes,
+                    audio_seconds=audio_seconds, stream=stream, images=images)
+
+    while True:
+        limiter.acquire()
+        _count(endpoint, "calls")
+        try:
+            resp = fn(scoped)
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                _count(endpoint, "errors")
+                record("error", error=e)
+                raise
+            _count(endpoint, "retries")
+            time.sleep(max(_retry_after(e), _backoff(attempt)))
+            attempt += 1
+            continue
+        # ストリームは読み終えたときに呼び出し側が telemetry.record_stream_end で所要時間と usage を補う
+        record("ok", usage=None if stream else getattr(resp, "usage", None))
+        return resp
+
+
+@st.cache_resource
+def _inflight() -> SingleFlight:
+    """プロセス全体（全セッション）で共有する"""
+    return SingleFlight()
+
+
+def _request_key(endpoint: str, client: OpenAI, kwargs: Dict[str, Any], body: bytes = b"") -> str:
+    """エンドポイント・接続先・引数（キー順をそろえた JSON）・アップロード内容のハッシュ"""
+    h = hashlib.sha256()
+    h.update(json.dumps([endpoint, str(client.base_url), kwargs], sort_keys=True, ensure_ascii=False,
+                        separators=(",", ":"), default=str).encode("utf-8"))
+    h.update(body)
+    return h.hexdigest()
+
+
+def _coalesced(endpoint: str, key: str, fn: Callable[[], Any], reuse_finished: bool = True) -> Any:
+    """reuse_finished=False なら実行中の重複だけをまとめ、完了した結果は次の呼び出しに渡さない"""
+    if not COALESCE_REQUESTS:
+        return fn()
+    leader = []
+
+    def run() -> Any:
+        leader.append(True)
+        return fn()
+    result = _inflight().do(key, run, grace_sec=None if reuse_finished else 0)
+    if not leader:
+        _count(endpoint, "coalesced")
+    return result
+
+
+def _json_size(value: Any) -> int:
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _file_size_and_duration(f: Any) -> Tuple[Optional[int], Optional[float]]:
+    """アップロードするファイルのバイト数と、WAV なら再生秒数"""
+    if not hasattr(f, "read") or not hasattr(f, "seek"):
+        return None, None
+    f.seek(0)
+    data = f.read()
+    f.seek(0)
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wf:
+            return len(data), wf.getnframes() / float(wf.getframerate() or 1)
+    except (wave.Error, EOFError):
+        return len(data), None
+
+
+def chat_completion(client: OpenAI, **kwargs: Any) -> Any:
+    """client.chat.completions.create と同じ引数で呼ぶ（stream=True ならストリームを返す。リトライは接続まで）"""
+    def call() -> Any:
+        return _call("chat", lambda c: c.chat.completions.create(**kwargs), client, model=kwargs.get("model", ""),
+                     request_bytes=_json_size(kwargs.get("messages")), stream=bool(kwargs.get("stream")))
+    if kwargs.get("stream"):
+        return call()  # ストリームは1人しか読めないので共有しない
+    # temperature を省略すると API の既定値（1）になるので、0 を指定したときだけ完了後の結果も使い回す
+    deterministic = kwargs.get("temperature") == 0
+    return _coalesced("chat", _request_key("chat", client, kwargs), call, reuse_finished=deterministic)
+
+
+def transcription(client: OpenAI, **kwargs: Any) -> Any:
+    """client.audio.transcriptions.create と同じ引数で呼ぶ（file はリトライ毎に先頭へ戻す）"""
+    def fn(c: OpenAI) -> Any:
+        f = kwargs.get("file")
+        if hasattr(f, "seek"):
+            f.seek(0)
+        return c.audio.transcriptions.create(**kwargs)
+    size, seconds = _file_size_and_duration(kwargs.get("file"))
+
+    def call() -> Any:
+        return _call("transcription", fn, client, model=kwargs.get("model", ""),
+                     request_bytes=size, audio_seconds=seconds)
+    f = kwargs.get("file")
+    if not (hasattr(f, "read") and hasattr(f, "seek")):
+        return call()
+    f.seek(0)
+    body = f.read()
+    f.seek(0)
+    options = {k: v for k, v in kwargs.items() if k != "file"}
+    return _coalesced("transcription", _request_key("transcription", client, options, body), call)
+
+
+def image_generation(client: OpenAI, **kwargs: Any) -> Any:
+    """client.images.generate と同じ引数で呼ぶ"""
+    return _call("image", lambda c: c.images.generate(**kwargs), client, model=kwargs.get("model", ""),
+                 request_bytes=_json_size(kwargs.get("prompt")), images=int(kwargs.get("n") or 1))
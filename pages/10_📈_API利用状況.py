@@ -0,0 +1,111 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import time
+from database import get_llm_calls
+from llm_client import call_stats, metric_stats
+from telemetry import dropped_count, flush
+
+st.set_page_config(page_title="API利用状況", layout="wide")
+st.title("📈 API利用状況")
+st.caption("OpenAI API の呼び出しごとの所要時間・トークン数・概算コスト（telemetry.py が llm_calls テーブルに記録）")
+
+# 表示期間ごとの (遡る秒数, 集計単位)
+RANGE_SETTINGS = {
+    "24時間": (24 * 3600, "h"),
+    "7日": (7 * 86400, "D"),
+    "30日": (30 * 86400, "D"),
+    "90日": (90 * 86400, "D"),
+}
+HISTOGRAM_BINS = 30
+
+with st.sidebar:
+    selected_range = st.radio("表示期間", list(RANGE_SETTINGS), index=1)
+    if st.button("🔄 最新の記録を読み込む"):
+        flush()
+        st.cache_data.clear()
+        st.rerun()
+
+span, freq = RANGE_SETTINGS[selected_range]
+# 集計単位の境界に揃えて、キャッシュが再実行のたびに外れないようにする
+since = (int(time.time()) // 3600 - span // 3600) * 3600
+df = get_llm_calls(since)
+
+if df.empty:
+    st.info("この期間のAPI呼び出しの記録はまだありません。")
+    st.stop()
+
+ok = df[df['status'] == 'ok']
+tokens = df['prompt_tokens'].fillna(0) + df['completion_tokens'].fillna(0)
+parsed = df[df['parse_status'].notna()]
+
+# --- 概要 ---
+c1, c2, c3, c4, c5 = st.columns(5)
+c1.metric("呼び出し回数", f"{len(df):,}")
+c2.metric("エラー率", f"{(df['status'] != 'ok').mean():.1%}")
+c3.metric("所要時間 p50 / p95", f"{ok['latency_ms'].quantile(0.5) / 1000:.1f}s / {ok['latency_ms'].quantile(0.95) / 1000:.1f}s"
+          if not ok.empty else "-")
+c4.metric("トークン数", f"{int(tokens.sum()):,}")
+c5.metric("概算コスト", f"${df['cost_usd'].fillna(0).sum():.2f}")
+
+tab1, tab2, tab3, tab4 = st.tabs(["⏱️ 所要時間", "📊 スループット", "💰 コスト", "🧩 処理別"])
+
+with tab1:
+    endpoints = sorted(ok['endpoint'].unique())
+    endpoint = st.selectbox("エンドポイント", endpoints) if endpoints else None
+    if endpoint:
+        lat = ok.loc[ok['endpoint'] == endpoint, 'latency_ms'] / 1000
+        counts, edges = np.histogram(lat, bins=HISTOGRAM_BINS)
+        hist = pd.DataFrame({"呼び出し回数": counts}, index=[f"{e:.2f}" for e in edges[:-1]])
+        hist.index.name = "所要時間（秒）"
+        st.bar_chart(hist)
+        st.caption(f"p50 {lat.quantile(0.5):.2f}s / p95 {lat.quantile(0.95):.2f}s / 最大 {lat.max():.2f}s（{len(lat)} 回）")
+
+with tab2:
+    per_bucket = df.set_index('ts').groupby('endpoint').resample(freq).size().unstack(0).fillna(0)
+    st.subheader("呼び出し回数")
+    st.line_chart(per_bucket)
+    tokens_per_bucket = pd.DataFrame({
+        "prompt": df.set_index('ts')['prompt_tokens'].resample(freq).sum(),
+        "completion": df.set_index('ts')['completion_tokens'].resample(freq).sum(),
+    }).fillna(0)
+    st.subheader("トークン数")
+    st.bar_chart(tokens_per_bucket)
+
+with tab3:
+    cost = df.assign(cost_usd=df['cost_usd'].fillna(0)).set_index('ts')
+    cost_per_bucket = cost.groupby('model')['cost_usd'].resample(freq).sum().unstack(0).fillna(0)
+    st.subheader("概算コスト（USD）")
+    st.bar_chart(cost_per_bucket)
+    st.subheader("累計")
+    st.line_chart(cost_per_bucket.sum(axis=1).cumsum().rename("USD"))
+    st.caption("単価は telemetry.MODEL_PRICES の値による概算です。")
+
+with tab4:
+    # トークンは概要と同じく prompt + completion
+    summary = df.assign(total_tokens=tokens).groupby('operation').agg(
+        呼び出し回数=('status', 'size'),
+        エラー=('status', lambda s: int((s != 'ok').sum())),
+        リトライ=('retries', 'sum'),
+        p50_ms=('latency_ms', lambda s: s.quantile(0.5)),
+        p95_ms=('latency_ms', lambda s: s.quantile(0.95)),
+        送信KB=('request_bytes', lambda s: s.fillna(0).sum() / 1024),
+        トークン=('total_tokens', lambda s: int(s.sum())),
+        コストUSD=('cost_usd', lambda s: s.fillna(0).sum()),
+    )
+    if not parsed.empty:
+        summary['JSON解析失敗率'] = parsed.groupby('operation')['parse_status'].apply(lambda s: (s == 'failed').mean())
+    st.dataframe(summary.round(2), use_container_width=True)
+
+    errors = df[df['status'] != 'ok'].tail(20)
+    if not errors.empty:
+        st.subheader("直近のエラー")
+        st.dataframe(errors[['ts', 'endpoint', 'operation', 'model', 'error_type', 'retries']],
+                     use_container_width=True, hide_index=True)
+
+# --- このプロセスでの集計（再起動でリセット） ---
+with st.expander("このプロセスでの集計"):
+    st.write("呼び出し / リトライ / 失敗 / 同じリクエストをまとめた回数", call_stats())
+    st.write("計測値（秒）", metric_stats())
+    if dropped_count():
+        st.warning(f"書き込みが追いつかず捨てた記録: {dropped_count()} 件")
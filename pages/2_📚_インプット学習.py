@@ -1,25 +1,35 @@
 # pages/2_📚_インプット学習.py
 import streamlit as st
-import json
-import io
 import os
-import re
-import wave
 import datetime as dt
-from typing import Dict, Any, List, Optional
+from typing import List, Optional
 # from dotenv import load_dotenv
-from openai import OpenAI
+from llm_client import get_client
 from st_audiorec import st_audiorec
 
 # メモ：オーディオを生成、オーディオファイルに保存、パスをjsonに保存、画面上で音声を再生できる
 # 既存DB関数群はそのまま利用（UI動作維持）
+from recording_log import append_record, migrate_json_array
+from translation import translate_text
+from generation import generate_toefl_passage
+from audio_processing import load_mono
+from speaking import compute_wav_duration_seconds, save_recording, transcribe_samples
+from vad import analyze_samples
+from tts_cache import synthesize_gtts, synthesize_pyttsx3
+from fluency import add_transcript_metrics, compute_fluency
 from database import (
     get_folders,
     add_folder,
     get_phrases_by_folder,
     add_phrase,
     update_phrase,
-    delete_phrase
+    delete_phrase,
+    get_week_numbers,
+    get_weekly_material,
+    next_week_number,
+    add_weekly_material,
+    update_weekly_audio,
+    import_weekly_json,
 )
 
 # =========================
@@ -37,9 +47,9 @@ AUDIO_DIR_CANDIDATES = [
     "/mnt/data/audio",
 ]
 LOG_JSON_CANDIDATES = [
-    "./json/recordings_input.json",                               # 新しい録音ログ（出力要件）
-    os.path.join(os.path.dirname(__file__), "./json/recordings_input.json"),
-    "/mnt/data/json/recordings_input.json",
+    "./json/recordings_input.jsonl",                               # 新しい録音ログ（出力要件）
+    os.path.join(os.path.dirname(__file__), "./json/recordings_input.jsonl"),
+    "/mnt/data/json/recordings_input.jsonl",
 ]
 RECORDINGS_DIR_CANDIDATES = [
     "./recordings",
@@ -96,201 +106,85 @@ def _resolve_writable_json_path(candidates: List[str]) -> str:
             continue
     # 最後の手段
     os.makedirs("./json", exist_ok=True)
-    return "./json/recordings_input.json"
+    return "./json/recordings_input.jsonl"
 
 JSON_PATH  = _find_json_path(DEFAULT_JSON_CANDIDATES)
 AUDIO_DIR  = _ensure_audio_dir(AUDIO_DIR_CANDIDATES)
 RECORD_LOG_PATH = _resolve_writable_json_path(LOG_JSON_CANDIDATES)
 RECORDING_DIR = record_ensure_dir()
 
-# =============== ユーティリティ ===============
-def save_bytes_to_file(b: bytes, path: str) -> None:
-    with open(path, "wb") as f:
-        f.write(b)
-
-def compute_wav_duration_seconds(wav_bytes: bytes) -> float:
-    # st_audiorec は WAV ヘッダ付与済み
-    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
-        frames = wf.getnframes()
-        rate = wf.getframerate()
-        return float(frames) / float(rate) if rate else 0.0
-
-def append_json(path: str, item: dict) -> None:
-    data = []
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            data = []
-    data.append(item)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+# 旧形式（JSON配列）の録音ログがあれば JSON Lines へ一度だけ移行する
+migrate_json_array(os.path.splitext(RECORD_LOG_PATH)[0] + ".json", RECORD_LOG_PATH)
 
 # OpenAI 初期化 (.env から取得)
 # load_dotenv()
 # client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+client = get_client()  # 再実行をまたいで共有（llm_client.py）
 
 # =========================
 # データ読み込み/保存ユーティリティ
 # =========================
-@st.cache_data(show_spinner=False)
-def load_weekly_data(path: str) -> List[Dict[str, Any]]:
-    if not path or not os.path.exists(path):
-        return []
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def write_weekly_data(path: str, data: List[Dict[str, Any]]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def to_week_dict(items: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
-    wk = {}
-    for item in items:
-        try:
-            wk[int(item["week_num"])] = item
-        except Exception:
-            continue
-    return wk
-
-def next_week_number(wk_dict: Dict[int, Any]) -> int:
-    return (max(wk_dict.keys()) + 1) if wk_dict else 1
-
-def is_japanese(text: str) -> bool:
-    return bool(re.search(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9faf]", text))
-
-def audio_path_for_week(week_num: int, ext: str = "mp3") -> str:
-    fname = f"week_{week_num:02d}.{ext}"
-    return os.path.join(AUDIO_DIR, fname)
+@st.cache_resource(show_spinner=False)
+def ensure_weekly_imported(path: Optional[str]) -> int:
+    """weekly_materials が空なら、既存の weekly_input.json を一度だけ取り込む"""
+    if get_week_numbers() or not path or not os.path.exists(path):
+        return 0
+    return import_weekly_json(path)
 
 # =========================
 # TTS（gTTS優先 → pyttsx3フォールバック）
 # =========================
-def synthesize_audio(english_text: str, week_num: int) -> Optional[str]:
+def synthesize_audio(english_text: str) -> Optional[str]:
     """
     英文を音声にして保存。基本は gTTS で MP3、失敗したら pyttsx3 で WAV。
-    成功したら音声ファイルの相対パスを返す。失敗なら None。
+    同じ英文・エンジン・声の音声が保存済みなら作り直さない（tts_cache.py）。
+    成功したら音声ファイルのパスを返す。失敗なら None。
     """
     # 1) gTTS (オンライン)
     try:
-        from gtts import gTTS
-        out_path = audio_path_for_week(week_num, "mp3")
-        tts = gTTS(english_text)  # 言語自動判定。英語ならOK
-        tts.save(out_path)
-        return out_path
+        return synthesize_gtts(english_text, AUDIO_DIR)
     except Exception as e:
         st.info(f"gTTSでの生成に失敗しました（{e}）。pyttsx3にフォールバックします。")
 
     # 2) pyttsx3 (オフライン, 形式は環境依存・WAV推奨)
     try:
-        import pyttsx3
-        engine = pyttsx3.init()
-        # 英語声に切替（環境によっては未対応）
-        try:
-            voices = engine.getProperty("voices")
-            for v in voices:
-                if "en" in (v.languages[0].decode() if v.languages else "").lower() or "english" in v.name.lower():
-                    engine.setProperty("voice", v.id)
-                    break
-        except Exception:
-            pass
-        out_path = audio_path_for_week(week_num, "wav")
-        engine.save_to_file(english_text, out_path)
-        engine.runAndWait()
-        return out_path
+        return synthesize_pyttsx3(english_text, AUDIO_DIR)
     except Exception as e:
         st.error(f"pyttsx3でも音声生成に失敗しました: {e}")
         return None
 
-# =========================
-# 生成 & 翻訳（OpenAI）
-# =========================
-def generate_toefl_passage(client: OpenAI) -> Dict[str, str]:
-    sys = "You are an expert ESL content writer for TOEFL preparation."
-    user = """
-Return ONLY valid compact JSON. No markdown. Keys: {"english": "...", "japanese": "..."}. 
-
-Requirements for "english":
-- Level: TOEFL iBT reading/listening passage difficulty (B2–C1).
-- Length: about 150 words (±20%).
-- Topic: academic or social (technology & society, environment, psychology, education, culture).
-- Style: clear, neutral, coherent, with 2–4 sentences or short paragraphs.
-
-Requirements for "japanese":
-- Provide a natural and faithful Japanese translation of the English passage.
-
-Again, output strict JSON with keys "english" and "japanese" only.
-"""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.8,
-        messages=[
-            {"role": "system", "content": sys},
-            {"role": "user", "content": user}
-        ]
-    )
-    content = resp.choices[0].message.content.strip()
-    start = content.find("{"); end = content.rfind("}")
-    if start != -1 and end != -1:
-        content = content[start:end+1]
-    data = json.loads(content)
-    return {"english": data["english"], "japanese": data["japanese"]}
-
-def translate_text(client: OpenAI, text: str) -> Dict[str, str]:
-    src_is_jp = is_japanese(text)
-    sys = "You are a professional translator for English↔Japanese study."
-    if src_is_jp:
-        user = f"""
-Translate the following Japanese text into natural, concise, study-friendly English.
-Keep meaning faithful; don't add info.
-
-Return ONLY JSON: {{"english":"...","japanese":"..."}}.
-- "japanese" MUST be the original input (unchanged).
-Text: {text}
-"""
-    else:
-        user = f"""
-Translate the following English text into natural, concise, study-friendly Japanese.
-Keep meaning faithful; don't add info.
-
-Return ONLY JSON: {{"english":"...","japanese":"..."}}.
-- "english" MUST be the original input (unchanged).
-Text: {text}
-"""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.2,
-        messages=[
-            {"role": "system", "content": sys},
-            {"role": "user", "content": user}
-        ]
-    )
-    content = resp.choices[0].message.content.strip()
-    start = content.find("{"); end = content.rfind("}")
-    if start != -1 and end != -1:
-        content = content[start:end+1]
-    data = json.loads(content)
-    return {"english": data["english"], "japanese": data["japanese"]}
-
-def handle_recording(category: str, eng_txt: str, jpn_txt: str, wav_audio_data: bytes | None = None):
-    """録音データを保存→長さ計算→録音ログJSONへ追記。"""
+def handle_recording(category: str, eng_txt: str, jpn_txt: str, wav_audio_data: bytes | None = None,
+                     transcribe: bool = False):
+    """録音データを保存→長さ計算→（transcribe=True なら文字起こし）→録音ログJSONへ追記。"""
     if not wav_audio_data:
         st.warning("音声データがありません。もう一度録音してください。")
         return
 
     ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
     base = f"{category}_weekly_{ts}"  # ← 未定義だった base をここで定義
-    audio_path = os.path.join(RECORDING_DIR, f"{base}.wav")
 
-    # 1) 保存
-    save_bytes_to_file(wav_audio_data, audio_path)
+    # 1) 保存（16kHz モノラルの FLAC / WAV に変換して保存。デコードは1回だけで、以降も同じ信号を使う）
+    x = load_mono(wav_audio_data)
+    audio_path = save_recording(wav_audio_data, os.path.join(RECORDING_DIR, base), samples=x)
 
-    # 2) 長さ
+    # 2) 長さ（元の録音から）と、発話 / 無音の時間（発話区間は文字起こしでも使い回す）
     dur = compute_wav_duration_seconds(wav_audio_data)
+    speech = analyze_samples(x)
+    fluency = compute_fluency(speech["segments"])
+    st.caption(f"ポーズ {fluency['pause_count']} 回（平均 {fluency['mean_pause_sec']} 秒）・発話率 {fluency['articulation_ratio']:.0%}")
 
-    # 3) ログJSONへ追記（category は引数をそのまま保存）
+    # 3) 文字起こし（有料の API 呼び出しなので選んだときだけ。長い音読は無音の位置で分けて並列に送る）
+    transcript = ""
+    if transcribe:
+        try:
+            with st.spinner("文字起こし中..."):
+                transcript = transcribe_samples(client, x, speech["segments"])
+        except Exception as e:
+            st.warning(f"文字起こしに失敗しました: {e}")
+    if transcript:
+        fluency = add_transcript_metrics(fluency, transcript)
+
+    # 4) ログJSONへ追記（category は引数をそのまま保存）
     log_item = {
         "timestamp": ts,
         "category": category,     # ← "output" で固定せず、渡された値を使う
@@ -298,15 +192,25 @@ def handle_recording(category: str, eng_txt: str, jpn_txt: str, wav_audio_data:
         "jpn_txt": jpn_txt,
         "audio_file": audio_path,
         "duration_sec": round(dur, 2),
+        "speech_sec": speech["speech_sec"],
+        "silence_sec": speech["silence_sec"],
+        "fluency": fluency,
+        "transcript": transcript,
     }
-    append_json(RECORD_LOG_PATH, log_item)
+    append_record(RECORD_LOG_PATH, log_item)
 
-    # 4) 画面表示
+    # 5) 画面表示
     st.success("録音・保存が完了しました。")
     st.audio(audio_path)
+    if transcript:
+        st.markdown("**文字起こし**")
+        st.write(transcript)
     st.json({
         "saved_to": RECORD_LOG_PATH,
         "duration_sec": round(dur, 2),
+        "speech_sec": speech["speech_sec"],
+        "silence_sec": speech["silence_sec"],
+        "fluency": fluency,
     })
 
 # =========================
@@ -315,13 +219,9 @@ def handle_recording(category: str, eng_txt: str, jpn_txt: str, wav_audio_data:
 st.set_page_config(page_title="📚 インプット学習", page_icon="📚", layout="centered")
 st.header("📚 インプット練習")
 
-if JSON_PATH is None:
-    st.error("`weekly_input.json` の保存先を見つけられませんでした。`./json/weekly_input.json` を作成するか、書き込み可能なパスを用意してください。")
-    st.stop()
-
-weekly_list = load_weekly_data(JSON_PATH)
-weekly_dict = to_week_dict(weekly_list)
-available_weeks = sorted(weekly_dict.keys())
+# 週の一覧だけを取得（本文は選択した週の分だけ後で読む）
+ensure_weekly_imported(JSON_PATH)
+available_weeks = get_week_numbers()
 
 if "generated_preview" not in st.session_state:
     st.session_state.generated_preview = None
@@ -335,14 +235,14 @@ with tab1:
     st.header("weeklyインプット教材")
 
     if not available_weeks:
-        st.warning("表示できる週がありません。下の『新しく生成する』で作成するか、`weekly_input.json` にデータを追加してください。")
+        st.warning("表示できる週がありません。下の『新しく生成する』で作成するか、`weekly_input.json` を用意してください（初回に自動で取り込みます）。")
         st.stop()
     else:
         # 週選択
         options = [f"WEEK {n}" for n in available_weeks]
         selected = st.selectbox("学習する週を選択してください", options, index=len(options)-1)
         num = int(selected.split()[-1])
-        item = weekly_dict[num]
+        item = get_weekly_material(num) or {}
 
         english_text = item.get("english_text", "")
         japanese_text = item.get("japanese_text", "")
@@ -363,18 +263,10 @@ with tab1:
         # 選択週の音声を再生成するボタン
         if st.button("🔊 この週の音声を再生成（英語→TTS）", use_container_width=True):
             if english_text.strip():
-                out_path = synthesize_audio(english_text, num)
+                out_path = synthesize_audio(english_text)
                 if out_path:
-                    # JSON更新
-                    for i, rec in enumerate(weekly_list):
-                        if str(rec.get("week_num")) == str(num):
-                            weekly_list[i]["audio_file"] = out_path
-                            break
-                    write_weekly_data(JSON_PATH, weekly_list)
-                    load_weekly_data.clear()
-                    weekly_list = load_weekly_data(JSON_PATH)
-                    weekly_dict = to_week_dict(weekly_list)
-                    available_weeks = sorted(weekly_dict.keys())
+                    # 該当週の音声パスだけを更新
+                    update_weekly_audio(num, out_path)
                     st.success(f"音声を生成しました：{out_path}")
                     st.audio(out_path)
                 else:
@@ -429,15 +321,19 @@ with tab1:
             elif not ((jp_input or "").strip() and (en_input or "").strip()):
                 st.warning("日本語と英語の両方を入力してください（翻訳ボタンで自動補完も可能です）。")
             else:
-                ok = 0
+                ok, skipped = 0, []
                 for f in selected_folder:
                     try:
-                        add_phrase(f, jp_input.strip(), en_input.strip())
-                        ok += 1
+                        if add_phrase(f, jp_input.strip(), en_input.strip()):
+                            ok += 1
+                        else:
+                            skipped.append(f)
                     except Exception as e:
                         st.error(f"'{f}' への追加でエラー: {e}")
                 if ok:
                     st.success(f"{ok} 件のフォルダにフレーズを登録しました！")
+                if skipped:
+                    st.info(f"同じフレーズが既にあったためスキップしたフォルダ: {', '.join(skipped)}")
     st.divider()
     st.subheader("")
     
@@ -448,6 +344,7 @@ with tab1:
         st.subheader("録音した音声")
         st.audio(wav_audio_data, format="audio/wav")
 
+        transcribe = st.checkbox("保存時に文字起こしもする（Whisper API・有料。終わるまで待ちます）", value=False)
         c1, c2, _ = st.columns([1,1,2])
         with c1:
             if st.button("保存"):
@@ -456,6 +353,7 @@ with tab1:
                     eng_txt=english_text,          # ← 選択中の英語本文
                     jpn_txt=japanese_text,         # ← 選択中の日本語訳
                     wav_audio_data=wav_audio_data,
+                    transcribe=transcribe,
                 )
         with c2:
             st.download_button("⬇️ ダウンロード", wav_audio_data,
@@ -463,7 +361,7 @@ with tab1:
 
     st.divider()
     st.subheader("教材生成")
-    st.caption("TOEFLレベルの英文＋日本語訳をAPIで自動生成し、音声も作って weekly_input.json に追記保存します。")
+    st.caption("TOEFLレベルの英文＋日本語訳をAPIで自動生成し、音声も作って週の教材として保存します。")
 
     # 生成ボタン
     c1, c2, c3 = st.columns([1,1,1])
@@ -490,30 +388,18 @@ with tab1:
                 st.write(data["japanese"])
 
             audio_path = None
-            new_week_num = next_week_number(weekly_dict) if gen_btn else None
+            new_week_num = next_week_number() if gen_btn else None
 
             # 音声も作成
             if gen_btn and gen_audio:
                 progress.progress(70)
-                audio_path = synthesize_audio(data["english"], new_week_num)
+                audio_path = synthesize_audio(data["english"])
                 progress.progress(80)
 
             if gen_btn:
-                # 追記保存
-                new_item = {
-                    "week_num": str(new_week_num),
-                    "english_text": data["english"],
-                    "japanese_text": data["japanese"],
-                    "audio_file": audio_path,
-                }
-                weekly_list.append(new_item)
-                write_weekly_data(JSON_PATH, weekly_list)
-
-                # キャッシュ更新
-                load_weekly_data.clear()
-                weekly_list = load_weekly_data(JSON_PATH)
-                weekly_dict = to_week_dict(weekly_list)
-                available_weeks = sorted(weekly_dict.keys())
+                # 新しい週として保存
+                add_weekly_material(new_week_num, data["english"], data["japanese"], audio_path)
+                available_weeks = get_week_numbers()
 
                 progress.progress(100)
                 st.success(
@@ -1,17 +1,15 @@
 # pages/3_🗣️_アウトプット練習.py
-import io
-import json
 import os
-import time
-import wave
-import datetime as dt
 import streamlit as st
-import base64
-import random
-import hashlib
 # from dotenv import load_dotenv
-from openai import OpenAI
+from llm_client import get_client, metric_stats
 from st_audiorec import st_audiorec  # pip install streamlit-audiorec
+from recording_log import migrate_json_array
+from analysis_jobs import get_job, resume_unfinished_jobs, submit_recording
+from speaking import fingerprint_audio
+from generation import QUESTION_LEVELS, QUESTION_TOPICS
+from image_pool import display_path_for, ensure_image_pool, next_image
+from question_pool import ensure_refill, next_question, seed_asked_questions
 
 # =============== 基本設定 ===============
 st.set_page_config(page_title="アウトプット練習", layout="wide")
@@ -20,7 +18,7 @@ st.markdown("## 🗣️ アウトプット練習")
 # .env → OPENAI_API_KEY
 # load_dotenv()
 # client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+client = get_client()  # 再実行をまたいで共有（llm_client.py）
 
 # 保存先（録音音声 / ログJSON）
 RECORDINGS_DIR_CANDIDATES = [
@@ -29,9 +27,9 @@ RECORDINGS_DIR_CANDIDATES = [
     "/mnt/data/recordings",
 ]
 LOG_JSON_CANDIDATES = [
-    "./json/recordings_output.json",                               # 新しい録音ログ（出力要件）
-    os.path.join(os.path.dirname(__file__), "./json/recordings_output.json"),
-    "/mnt/data/json/recordings_output.json",
+    "./json/recordings_output.jsonl",                               # 新しい録音ログ（出力要件）
+    os.path.join(os.path.dirname(__file__), "./json/recordings_output.jsonl"),
+    "/mnt/data/json/recordings_output.jsonl",
 ]
 OUTPUT_JSON_PATHS = [
     "./json/output.json",                                          # 既存の出題保存（サンプル）に対応
@@ -71,169 +69,133 @@ RECORDING_DIR = ensure_dir()
 RECORD_LOG_PATH = resolve_path(LOG_JSON_CANDIDATES)
 OUTPUT_JSON_PATH = resolve_path(OUTPUT_JSON_PATHS)
 
-# =============== ユーティリティ ===============
-def save_bytes_to_file(b: bytes, path: str) -> None:
-    with open(path, "wb") as f:
-        f.write(b)
-
-def compute_wav_duration_seconds(wav_bytes: bytes) -> float:
-    # st_audiorec は WAV ヘッダ付与済み
-    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
-        frames = wf.getnframes()
-        rate = wf.getframerate()
-        return float(frames) / float(rate) if rate else 0.0
-
-def append_json(path: str, item: dict) -> None:
-    data = []
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            data = []
-    data.append(item)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-# =============== 出題生成（任意） ===============
-def generate_toefl_question() -> str:
-    """TOEFLレベルのディスカッション質問を1つ生成（必要なら output.json にも保存可能）。"""
-    prompt = """Generate ONE TOEFL-style discussion question (B2–C1) in one sentence.
-Return only the question text."""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.7,
-        messages=[
-            {"role": "system", "content": "You create concise TOEFL-style prompts."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    q = resp.choices[0].message.content.strip().strip('"')
-    # 既存方針：output.json にも保存しておく（必要なら）
-    try:
-        # { "key": int, "question": "..." } の配列想定（サンプル準拠）
-        # 新規 key は連番で採番
-        dat = []
-        if os.path.exists(OUTPUT_JSON_PATH):
-            with open(OUTPUT_JSON_PATH, "r", encoding="utf-8") as f:
-                dat = json.load(f)
-        next_key = (max([d.get("key", 0) for d in dat]) + 1) if dat else 1
-        dat.append({"key": next_key, "question": q})
-        with open(OUTPUT_JSON_PATH, "w", encoding="utf-8") as f:
-            json.dump(dat, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
-    return q
-
-# =============== 文字起こし & 評価 ===============
-def transcribe_wav_bytes(wav_bytes: bytes) -> str:
-    """OpenAI Whisperで文字起こし（要APIキー）。"""
-    # OpenAI API はファイルlikeを受け付ける
-    audio_f = io.BytesIO(wav_bytes)
-    audio_f.name = "audio.wav"
-    r = client.audio.transcriptions.create(
-        model="whisper-1",
-        file=audio_f
-    )
-    return r.text.strip()
-
-def evaluate_speaking(question: str, transcript: str) -> dict:
-    """文法/内容/流暢さを5点満点で評価し、短い講評と改善提案をJSONで返す。"""
-    user = f"""
-Question: {question}
-Learner's response (transcribed): {transcript}
-
-Rate on 0–5 scale:
-- grammar
-- content_relevance
-- fluency
-
-Return strict JSON:
-{{
-  "scores": {{"grammar": <int>, "content_relevance": <int>, "fluency": <int>}},
-  "comment": "<one-paragraph natural feedback>",
-  "tips": ["<short fix 1>", "<short fix 2>", "<short fix 3>"]
-}}
-"""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.4,
-        messages=[
-            {"role": "system", "content": "You are a precise English speaking evaluator for TOEFL practice."},
-            {"role": "user", "content": user}
-        ]
-    )
-    content = resp.choices[0].message.content
-    # JSON抽出
-    start = content.find("{"); end = content.rfind("}")
-    if start != -1 and end != -1:
-        content = content[start:end+1]
-    return json.loads(content)
+# 前回終わらなかった解析ジョブがあれば再開する（プロセスごとに一度だけ）
+resume_unfinished_jobs(client)
+
+# 旧形式（JSON配列）の録音ログがあれば JSON Lines へ一度だけ移行する
+migrate_json_array(os.path.splitext(RECORD_LOG_PATH)[0] + ".json", RECORD_LOG_PATH)
+
+# ストリーミング評価で最初のスコアが出るまでの時間（speaking.evaluate_speaking_stream が記録）
+_ttff = metric_stats().get("evaluation_time_to_first_feedback")
+if _ttff:
+    st.sidebar.caption(f"評価の最初の表示まで: 平均 {_ttff['mean']:.1f} 秒 / 直近 {_ttff['last']:.1f} 秒（{int(_ttff['count'])} 回）")
+
+# 以前 output.json に保存した設問は出題済みとして設問プールの重複チェックに使う
+seed_asked_questions(OUTPUT_JSON_PATH)
 
 # =============== 録音ハンドラ ===============
-def handle_recording(category: str, mode: str, question: str, wav_audio_data: bytes, image_file: str | None = None):
-    """録音データを保存→長さ計算→文字起こし→評価→録音ログJSONへ追記。"""
-    ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
-    base = f"{category}_{mode}_{ts}"
-    audio_path = os.path.join(RECORDING_DIR, f"{base}.wav")
-
-    # 1) 保存
-    save_bytes_to_file(wav_audio_data, audio_path)
-
-    # 2) 長さ
-    dur = compute_wav_duration_seconds(wav_audio_data)
-
-    # 3) 文字起こし
-    transcript = ""
-    try:
-        transcript = transcribe_wav_bytes(wav_audio_data)
-    except Exception as e:
-        transcript = ""
-        st.warning(f"文字起こしに失敗しました: {e}")
-
-    # 4) 評価
-    evaluation = {}
-    try:
-        evaluation = evaluate_speaking(question, transcript or "(no transcript)")
-    except Exception as e:
-        evaluation = {"scores": {"grammar": 0, "content_relevance": 0, "fluency": 0},
-                      "comment": f"Evaluation failed: {e}", "tips": []}
-
-    # 5) ログJSONへ追記（画像パスも含める）
-    log_item = {
-        "timestamp": ts,
-        "category": "output",            # 要件どおり固定
-        "mode": mode,                    # "discussion" / "description"
-        "question": question,
-        "audio_file": audio_path,
-        "duration_sec": round(dur, 2),
-        "transcript": transcript,
-        "evaluation": evaluation
-    }
-    if image_file:
-        log_item["image_file"] = image_file
-
-    append_json(RECORD_LOG_PATH, log_item)
-
-    # 6) 画面表示
-    st.success("録音・保存が完了しました。")
-    st.audio(audio_path)
-    if image_file:
-        st.image(image_file, caption="Saved picture for DESCRIPTION", use_container_width=True)
-    st.json({
-        "saved_to": RECORD_LOG_PATH,
-        "duration_sec": round(dur, 2),
-        "evaluation_summary": evaluation.get("scores", {})
-    })
-    # 👉 追加：呼び出し側で詳細表示できるよう返す
-    return {
-        "audio_path": audio_path,
-        "image_path": image_file,
-        "duration_sec": round(dur, 2),
-        "transcript": transcript,
-        "evaluation": evaluation,
-        "log_path": RECORD_LOG_PATH,
-    }
+def handle_recording(category: str, mode: str, question: str, wav_audio_data: bytes, image_file: str | None = None) -> str:
+    """録音データを保存して解析ジョブ（長さ計算→文字起こし→評価→ログ追記）を登録し、ジョブIDを返す。
+
+    解析はバックグラウンドで進むので、ここでは待たない。結果は _render_jobs で表示する。
+    同じ録音・設問を解析済みなら、保存済みの結果がすぐに返る（analysis_jobs.analysis_cache_key）。
+    """
+    job_id = submit_recording(
+        client,
+        category=category,
+        mode=mode,
+        question=question,
+        wav_audio_data=wav_audio_data,
+        recording_dir=RECORDING_DIR,
+        log_path=RECORD_LOG_PATH,
+        image_file=image_file,
+    )
+    st.session_state.analysis_jobs.append(job_id)
+    return job_id
+
+JOB_STAGE_LABELS = {
+    "": "順番待ち",
+    "duration": "音声の長さを計算中",
+    "transcribe": "文字起こし中",
+    "evaluate": "AIが評価中",
+    "save": "保存中",
+}
+MAX_SHOWN_JOBS = 5
+
+def _render_evaluation(ev: dict, partial: bool = False):
+    """評価（スコア・総評・ヒント）を表示する。partial なら届いた分だけ出す（ストリーミング中）"""
+    scores = ev.get("scores", {})
+    st.markdown("### 📝 評価結果" + ("（受信中…）" if partial else ""))
+    m1, m2, m3 = st.columns(3)
+    for col, label, key in ((m1, "Grammar", "grammar"), (m2, "Content Relevance", "content_relevance"),
+                            (m3, "Fluency", "fluency")):
+        with col:
+            st.metric(label, int(scores[key]) if key in scores else "…")
+
+    for key in ("grammar", "content_relevance", "fluency"):
+        st.progress(min((int(scores.get(key, 0))/5), 1.0))
+
+    if ev.get("comment") or not partial:
+        st.markdown("#### 総評")
+        st.write(ev.get("comment", ""))
+
+    tips = [t for t in ev.get("tips", []) if t]
+    if tips:
+        st.markdown("#### 改善のヒント")
+        for t in tips:
+            st.write(f"- {t}")
+
+def _render_fluency(fl: dict):
+    """録音から手元で測った流暢さの指標（fluency.py）。語数を使う指標は文字起こし後に埋まる"""
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("発話速度", f"{fl['speech_rate_wpm']} wpm" if "speech_rate_wpm" in fl else "…")
+    c2.metric("ポーズ", f"{fl['pause_count']} 回", help=f"平均 {fl['mean_pause_sec']} 秒 / 最長 {fl['max_pause_sec']} 秒")
+    c3.metric("平均発話長", f"{fl['mean_length_of_run']} 語" if "mean_length_of_run" in fl else f"{fl['mean_run_sec']} 秒")
+    c4.metric("発話率", f"{fl['articulation_ratio']:.0%}")
+
+def _render_result(result: dict, compact: bool = False):
+    """解析結果（評価・補助情報）を表示する。compact なら画像はサムネイルで出す"""
+    for w in result.get("warnings", []):
+        st.warning(w)
+    st.audio(result["audio_path"])
+    if result.get("image_path"):
+        st.image(display_path_for(result["image_path"], thumb=compact), caption="Saved picture for DESCRIPTION",
+                 use_container_width=not compact)
+
+    _render_evaluation(result.get("evaluation", {}))
+
+    st.markdown("#### 補助情報")
+    st.write(f"- 音声の長さ: **{result.get('duration_sec', 0)} sec**")
+    if "speech_sec" in result:
+        st.write(f"- 発話 / 無音: **{result['speech_sec']} sec** / {result['silence_sec']} sec")
+    if result.get("fluency"):
+        _render_fluency(result["fluency"])
+    if result.get("transcript"):
+        with st.expander("文字起こしを表示"):
+            st.write(result["transcript"])
+    st.caption(f"保存先: `{result.get('log_path')}`")
+
+def _render_jobs(polling: bool):
+    """このセッションで投げた解析ジョブの進捗と結果を新しい順に表示する"""
+    pending = False
+    for i, job_id in enumerate(reversed(st.session_state.analysis_jobs[-MAX_SHOWN_JOBS:])):
+        job = get_job(job_id)
+        if job is None:
+            continue
+        ts = job["request"].get("timestamp", "")
+        if job["status"] in ("queued", "running"):
+            pending = True
+            st.progress(job["progress"], text=f"🎧 {ts}: {JOB_STAGE_LABELS.get(job['stage'], job['stage'])}...")
+            fluency = (job["result"] or {}).get("fluency")
+            if fluency:
+                _render_fluency(fluency)
+            partial = (job["result"] or {}).get("partial_evaluation")
+            if partial:
+                _render_evaluation(partial, partial=True)
+        elif job["status"] == "failed":
+            st.error(f"{ts}: 解析に失敗しました: {job['error']}")
+        elif i == 0:
+            if job["result"].get("cached"):
+                st.success(f"{ts}: 同じ録音の解析結果を表示しています（保存済みの結果を再利用）。")
+            else:
+                st.success(f"{ts}: 録音・保存・評価が完了しました。")
+            _render_result(job["result"])
+        else:
+            with st.expander(f"これまでの結果: {ts}"):
+                _render_result(job["result"], compact=True)
+    if polling and not pending:
+        # すべて終わったらページ全体を再実行して定期更新を止める
+        st.rerun()
 
 def _ensure_desc_img_dir() -> str:
     for d in DESC_IMG_DIR_CANDIDATES:
@@ -252,50 +214,6 @@ def _ensure_desc_img_dir() -> str:
 
 DESC_IMG_DIR = _ensure_desc_img_dir()
 
-def _description_categories() -> list[str]:
-    # 多様な日常/公共シーン
-    return [
-        "modern open-plan office",
-        "cozy living room at home",
-        "airplane cabin during boarding",
-        "busy train station concourse",
-        "university classroom with projector",
-        "quiet library interior",
-        "coffee shop counter and seating area",
-        "suburban kitchen interior",
-        "hotel lobby reception area",
-        "tech startup workspace with whiteboards"
-    ]
-
-def generate_description_image(client: OpenAI) -> tuple[str, str]:
-    """
-    説明タスク用の写真を1枚生成して保存。
-    戻り値: (image_path, prompt_used)
-    """
-    category = random.choice(_description_categories())
-    prompt = (
-        f"Photorealistic, high-resolution interior or public scene: {category}. "
-        "Natural lighting, realistic textures, rich details. No text or watermarks."
-    )
-
-    # OpenAI Images API（base64で受け取りPNG保存）
-    img_resp = client.images.generate(
-        model="gpt-image-1",
-        prompt=prompt,
-        size="1024x1024",
-        quality="high",
-        n=1,
-    )
-    b64 = img_resp.data[0].b64_json
-    img_bytes = base64.b64decode(b64)
-
-    ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
-    out_path = os.path.join(DESC_IMG_DIR, f"description_{ts}.png")
-    with open(out_path, "wb") as f:
-        f.write(img_bytes)
-
-    return out_path, prompt
-
 # モード選択（DISCUSSION / DESCRIPTION）
 mode = st.radio("モードを選んでください", ["DISCUSSION", "DESCRIPTION"], horizontal=True)
 
@@ -305,52 +223,62 @@ if "auto_eval" not in st.session_state:
     st.session_state.auto_eval = True
 if "last_audio_fingerprint" not in st.session_state:
     st.session_state.last_audio_fingerprint = None
-
-def _fingerprint_audio(b: bytes) -> str:
-    return hashlib.md5(b).hexdigest()
+if "analysis_jobs" not in st.session_state:
+    st.session_state.analysis_jobs = []
 
 if mode == "DISCUSSION":
     st.subheader("Question")
     colq1, colq2 = st.columns([3,1])
-    with colq1:
-        st.write(st.session_state.discussion_q)
     with colq2:
+        topic = st.selectbox("トピック", ["おまかせ"] + QUESTION_TOPICS)
+        level = st.selectbox("レベル", ["おまかせ"] + QUESTION_LEVELS)
+        topic = None if topic == "おまかせ" else topic
+        level = None if level == "おまかせ" else level
+        # 出題待ちが少なければ裏で補充しておく（設問プール: question_pool.py）
+        ensure_refill(client, topic, level)
         if st.button("🔄 設問を生成"):
-            st.session_state.discussion_q = generate_toefl_question()
-            st.rerun()
+            try:
+                st.session_state.discussion_q = next_question(client, topic, level)["question"]
+            except Exception as e:
+                st.error(f"設問の生成に失敗しました: {e}")
+    with colq1:
+        st.write(st.session_state.discussion_q)
     current_question = st.session_state.discussion_q
     current_image_path = None  # DISCUSSIONでは画像なし
 
 else:
     st.subheader("Description Task")
     st.caption("オフィス/家/飛行機/駅など、日常や公共のシーン写真が自動生成されます。1分ほどで明快に説明してみましょう。")
-    # 画像の自動生成（初回のみ）
+    # 説明用の写真が足りないカテゴリは裏で生成しておく（有料なので DESCRIPTION を開いたときだけ。上限は image_pool.py）
+    ensure_image_pool(client, DESC_IMG_DIR)
+
+    def _show_next_image():
+        # 事前生成したプールから選ぶだけ（プールが空の最初の1回だけ生成を待つ。image_pool.py）
+        try:
+            image = next_image(client, DESC_IMG_DIR, exclude_hash=st.session_state.get("desc_image_hash"))
+            st.session_state.desc_image_path = image["original_path"]
+            st.session_state.desc_image_display = image["display_path"]
+            st.session_state.desc_image_hash = image["content_hash"]
+            st.session_state.desc_image_prompt = image["prompt"]
+        except Exception as e:
+            st.error(f"画像生成に失敗しました: {e}")
+
+    # 初回のみ
     if "desc_image_path" not in st.session_state or st.session_state.desc_image_path is None:
-        with st.spinner("写真を生成中..."):
-            try:
-                img_path, used_prompt = generate_description_image(client)
-                st.session_state.desc_image_path = img_path
-                st.session_state.desc_image_prompt = used_prompt
-            except Exception as e:
-                st.error(f"画像生成に失敗しました: {e}")
-                st.session_state.desc_image_path = None
-                st.session_state.desc_image_prompt = None
+        with st.spinner("写真を準備中..."):
+            _show_next_image()
 
     # 再生成ボタン
     regen = st.button("🔄 別の画像を生成")
     if regen:
-        with st.spinner("写真を生成中..."):
-            try:
-                img_path, used_prompt = generate_description_image(client)
-                st.session_state.desc_image_path = img_path
-                st.session_state.desc_image_prompt = used_prompt
-            except Exception as e:
-                st.error(f"画像生成に失敗しました: {e}")
+        with st.spinner("写真を準備中..."):
+            _show_next_image()
 
-    # 表示
+    # 表示（縮小版を送る）
     current_image_path = st.session_state.get("desc_image_path")
     if current_image_path:
-        st.image(current_image_path, caption="Generated picture", use_container_width=True)
+        st.image(st.session_state.get("desc_image_display") or current_image_path,
+                 caption="Generated picture", use_container_width=True)
         with st.expander("画像生成プロンプト（参考）"):
             st.code(st.session_state.get("desc_image_prompt", ""), language="text")
 
@@ -371,10 +299,10 @@ if wav_audio_data is not None:
     st.subheader("録音した音声")
     st.audio(wav_audio_data, format="audio/wav")
 
-    # ★ ここで自動採点：新しい録音なら一度だけ走らせる
-    fp = _fingerprint_audio(wav_audio_data)
+    # ★ ここで自動採点：新しい録音なら一度だけジョブを投げる
+    fp = fingerprint_audio(wav_audio_data)
     if st.session_state.auto_eval and fp != st.session_state.last_audio_fingerprint:
-        result = handle_recording(
+        handle_recording(
             category="output",
             mode=mode.lower(),                       # "discussion"/"description"
             question=current_question,
@@ -383,45 +311,11 @@ if wav_audio_data is not None:
         )
         st.session_state.last_audio_fingerprint = fp
 
-        # 既存の評価表示ロジック（ボタンと同じ表示）を流用したい場合はこの下に転記してOK
-        if result and "evaluation" in result:
-            ev = result["evaluation"]
-            scores = ev.get("scores", {})
-            grammar = int(scores.get("grammar", 0))
-            content_rel = int(scores.get("content_relevance", 0))
-            fluency = int(scores.get("fluency", 0))
-
-            st.markdown("### 📝 評価結果（自動）")
-            m1, m2, m3 = st.columns(3)
-            with m1: st.metric("Grammar", grammar)
-            with m2: st.metric("Content Relevance", content_rel)
-            with m3: st.metric("Fluency", fluency)
-
-            st.progress(min((grammar/5), 1.0))
-            st.progress(min((content_rel/5), 1.0))
-            st.progress(min((fluency/5), 1.0))
-
-            st.markdown("#### 総評")
-            st.write(ev.get("comment", ""))
-
-            tips = ev.get("tips", [])
-            if tips:
-                st.markdown("#### 改善のヒント")
-                for t in tips:
-                    st.write(f"- {t}")
-
-            st.markdown("#### 補助情報")
-            st.write(f"- 音声の長さ: **{result.get('duration_sec', 0)} sec**")
-            if result.get("transcript"):
-                with st.expander("文字起こしを表示"):
-                    st.write(result["transcript"])
-            st.caption(f"保存先: `{result.get('log_path')}`")
-
     # 手動でも走らせたい人向けのボタンは残す（従来通り）
     c1, c2, _ = st.columns([1,1,2])
     with c1:
         if st.button("💾 保存してAI評価"):
-            result = handle_recording(
+            handle_recording(
                 category="output",
                 mode=mode.lower(),
                 question=current_question,
@@ -429,8 +323,15 @@ if wav_audio_data is not None:
                 image_file=current_image_path if mode == "DESCRIPTION" else None
             )
             # 手動実行でも指紋を更新して二重実行を防ぐ
-            st.session_state.last_audio_fingerprint = _fingerprint_audio(wav_audio_data)
+            st.session_state.last_audio_fingerprint = fingerprint_audio(wav_audio_data)
 
     with c2:
         st.download_button("⬇️ ダウンロード", wav_audio_data,
                            file_name="recorded_voice.wav", mime="audio/wav")
+
+# 解析ジョブの進捗と結果（処理中のジョブがある間だけ0.5秒ごとに更新）
+if st.session_state.analysis_jobs:
+    _jobs = [get_job(j) for j in st.session_state.analysis_jobs[-MAX_SHOWN_JOBS:]]
+    _polling = any(j and j["status"] in ("queued", "running") for j in _jobs)
+    # 評価はストリーミングで少しずつ届くので、解析中は短めの間隔で読み直す
+    st.fragment(_render_jobs, run_every=0.5 if _polling else None)(_polling)
@@ -1,65 +1,25 @@
 import json
 import io
 import os
-import re
 import streamlit as st
 import pandas as pd
 # from dotenv import load_dotenv
-from openai import OpenAI
+from llm_client import get_client
 from database import (
     get_folders,
     add_folder,
     get_phrases_by_folder,
     add_phrase,
+    add_phrases_bulk,
     update_phrase,
     delete_phrase
 )
+from translation import translate_text, translate_batch, cache_stats
 from pathlib import Path
 
 # load_dotenv()
 # client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-
-def _is_japanese(text: str) -> bool:
-    return bool(re.search(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9faf]", text))
-
-def translate_text(client: OpenAI, text: str) -> dict:
-    """日↔英を自動判定して、{"english": "...", "japanese": "..."} を返す"""
-    src_is_jp = _is_japanese(text)
-    sys = "You are a professional translator for English↔Japanese study."
-    if src_is_jp:
-        user = f"""
-Translate the following Japanese text into natural, concise, study-friendly English.
-Keep meaning faithful; don't add info.
-
-Return ONLY JSON: {{"english":"...","japanese":"..."}}.
-- "japanese" MUST be the original input (unchanged).
-Text: {text}
-"""
-    else:
-        user = f"""
-Translate the following English text into natural, concise, study-friendly Japanese.
-Keep meaning faithful; don't add info.
-
-Return ONLY JSON: {{"english":"...","japanese":"..."}}.
-- "english" MUST be the original input (unchanged).
-Text: {text}
-"""
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0.2,
-        messages=[
-            {"role": "system", "content": sys},
-            {"role": "user", "content": user}
-        ]
-    )
-    content = resp.choices[0].message.content.strip()
-    start = content.find("{"); end = content.rfind("}")
-    if start != -1 and end != -1:
-        content = content[start:end+1]
-    import json
-    data = json.loads(content)
-    return {"english": data["english"], "japanese": data["japanese"]}
+client = get_client()  # 再実行をまたいで共有（llm_client.py）
 
 st.set_page_config(page_title="MYフレーズ", layout="wide")
 
@@ -71,6 +31,10 @@ st.sidebar.header("📁 フォルダ管理")
 # フォルダ一覧を取得
 folders = get_folders()
 
+# 翻訳キャッシュの状況
+_tc = cache_stats()
+st.sidebar.caption(f"翻訳キャッシュ: {_tc['entries']} 件 / ヒット {_tc['hits']} 回・ミス {_tc['misses']} 回")
+
 # フォルダの新規作成
 with st.sidebar.expander("新しいフォルダを作成"):
     new_folder_name = st.text_input("フォルダ名", key="new_folder_name")
@@ -135,9 +99,11 @@ if submit_button:
     else:
         ok = 0
         for f in add_target_folders:
-            add_phrase(f, jp, en)
-            ok += 1
+            if add_phrase(f, jp, en):
+                ok += 1
         st.success(f"{ok} 件のフォルダにフレーズを登録しました！")
+        if ok < len(add_target_folders):
+            st.info(f"{len(add_target_folders) - ok} 件のフォルダには同じフレーズが既にあったためスキップしました。")
 st.divider()
 
 
@@ -185,10 +151,16 @@ if not phrases_df.empty:
         ]
 
         if not changed_rows.empty:
-            for _, row in changed_rows.iterrows():
-                update_phrase(row['id'], row['japanese_new'], row['english_new'])
-            st.success(f"{len(changed_rows)}件のフレーズを更新しました。")
-            st.rerun()
+            # 同じフォルダの既存フレーズと同じ内容になる行は更新せず、残りだけ反映する
+            skipped = [row for _, row in changed_rows.iterrows()
+                       if not update_phrase(row['id'], row['japanese_new'], row['english_new'])]
+            if not skipped:
+                st.success(f"{len(changed_rows)}件のフレーズを更新しました。")
+                st.rerun()
+            if len(changed_rows) > len(skipped):
+                st.success(f"{len(changed_rows) - len(skipped)}件のフレーズを更新しました。")
+            for row in skipped:
+                st.warning(f"同じフレーズが既にあるため更新しませんでした: {row['japanese_new']} / {row['english_new']}")
 
     except Exception as e:
         st.error(f"データの更新中にエラーが発生しました: {e}")
@@ -327,28 +299,49 @@ if st.session_state.csv_preview is not None:
                     except Exception:
                         existing_pairs_by_folder[str(f)] = set()
 
+        def _cell(row, col):
+            """空セル（NaN）は空文字として扱う"""
+            v = row.get(col, "")
+            return "" if pd.isna(v) else str(v).strip()
+
         # 行を走査して取込候補を生成
-        preview_rows = []
+        candidates = []
         for _, row in df.iterrows():
-            en = str(row.get(en_col, "")).strip()
-            jp = str(row.get(jp_col, "")).strip()
+            en = _cell(row, en_col)
+            jp = _cell(row, jp_col)
 
             # どのフォルダに入れるか
-            targets = [str(row.get(f_col)).strip()] if (f_col is not None and str(row.get(f_col, "")).strip()) else default_targets
+            targets = [_cell(row, f_col)] if (f_col is not None and _cell(row, f_col)) else default_targets
             if not targets:
                 continue
+            candidates.append([en, jp, targets])
+
+        # 翻訳補完（空欄のある行をまとめて翻訳）
+        if do_translate:
+            need = [c for c in candidates if (c[0] or c[1]) and not (c[0] and c[1])]
+            if need:
+                bar = st.progress(0.0, text="翻訳で空欄を補完中...")
+                results = translate_batch(
+                    client,
+                    [c[0] or c[1] for c in need],  # どちらか片方を渡す（関数側で自動判定）
+                    progress=lambda done, total: bar.progress(done / total if total else 1.0,
+                                                              text=f"翻訳で空欄を補完中... {done}/{total}"),
+                )
+                failed = 0
+                for c, tr in zip(need, results):
+                    if tr is None:
+                        failed += 1
+                        continue
+                    if not c[0]:
+                        c[0] = tr["english"].strip()
+                    if not c[1]:
+                        c[1] = tr["japanese"].strip()
+                bar.empty()
+                if failed:
+                    st.warning(f"翻訳補完に失敗した行が {failed} 行あります。")
 
-            # 翻訳補完
-            if do_translate and (not en or not jp):
-                try:
-                    tr = translate_text(client, en or jp)  # どちらか片方を渡す（関数側で自動判定）
-                    if not en:
-                        en = tr["english"].strip()
-                    if not jp:
-                        jp = tr["japanese"].strip()
-                except Exception as e:
-                    st.warning(f"翻訳補完に失敗した行があります: {e}")
-
+        preview_rows = []
+        for en, jp, targets in candidates:
             # 空行スキップ
             if not en and not jp:
                 continue
@@ -403,9 +396,9 @@ if st.session_state.csv_preview is not None:
                     except Exception:
                         pass
 
-            # 実インポート
-            progress = st.progress(0)
-            for i, row in dfp.iterrows():
+            # 実インポート（全行を1トランザクションでまとめて追加）
+            rows = []
+            for _, row in dfp.iterrows():
                 en = str(row["english"]).strip()
                 jp = str(row["japanese"]).strip()
                 targets = [x.strip() for x in str(row["folders"]).split(",") if str(row["folders"]).strip()]
@@ -415,12 +408,13 @@ if st.session_state.csv_preview is not None:
                     if dedupe and f in dups:
                         skipped += 1
                         continue
-                    try:
-                        add_phrase(f, jp, en)
-                        done += 1
-                    except Exception as e:
-                        st.error(f"『{f}』への追加でエラー: {e}")
-                progress.progress(int((i+1)/len(dfp)*100))
+                    rows.append((f, jp, en))
+            try:
+                done = add_phrases_bulk(rows)
+                # DB側の一意制約で弾かれた行（CSV内の重複など）もスキップに数える
+                skipped += len(rows) - done
+            except Exception as e:
+                st.error(f"インポート中にエラーが発生しました: {e}")
 
             st.success(f"インポート完了：追加 {done} 件 / スキップ(重複) {skipped} 件 / 新規フォルダ作成 {created_folders} 件")
             # 後片付け
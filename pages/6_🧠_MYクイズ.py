@@ -1,44 +1,46 @@
 # pages/6_🧠_MYクイズ.py
-import random
-import re
 import streamlit as st
 
 # 既存DBユーティリティ
-from database import get_folders, get_phrases_by_folder
+from database import get_folders, sample_phrases
+# 答え合わせ（日本語は文字 bigram、英語は編集距離のあいまい一致）
+from grading import grade_batch, is_correct
+# 復習スケジュール（SM-2）
+from srs import DIRECTIONS, describe_interval, due_count, due_queue, record_answer
 
 st.set_page_config(page_title="🧠 MYクイズ", page_icon="🧠", layout="centered")
 st.header("🧠 MYクイズ")
 
 # ---------------- ヘルパー ----------------
-def _norm_text(s: str) -> str:
-    """大文字小文字・余分な空白・句読点差を吸収する簡易正規化（英日両対応）"""
-    if not s:
-        return ""
-    s = s.strip()
-    s = re.sub(r"\s+", " ", s)
-    # 句読点など広めに除去（ひらカナ漢字は残す／- ' は残す）
-    s = re.sub(r"[^\w\s'\-ぁ-んァ-ン一-龥]", "", s, flags=re.UNICODE)
-    return s.lower()
-
-def _overlap_ratio(a: str, b: str) -> float:
-    """英語の単語Jaccard重なりで緩め採点（日本語は正規化一致を優先）"""
-    a_n = _norm_text(a)
-    b_n = _norm_text(b)
-    if not a_n or not b_n:
-        return 1.0 if a_n == b_n else 0.0
-    aw = set(re.findall(r"[a-zA-Z']+", a_n))
-    bw = set(re.findall(r"[a-zA-Z']+", b_n))
-    if not aw or not bw:
-        return 1.0 if a_n == b_n else 0.0
-    return len(aw & bw) / len(aw | bw)
+def _record_grades(indices, answers):
+    """解答をまとめて採点（grading.grade_batch）して quiz_results に入れ、初回の答え合わせなら復習スケジュールも更新する"""
+    items = st.session_state.quiz_items
+    golds = [items[i]["a"] for i in indices]
+    ratios = grade_batch(answers, golds)
+    for idx, ans, gold, ratio in zip(indices, answers, golds, ratios):
+        item = items[idx]
+        correct = is_correct(ans, gold, ratio)
+        next_review = st.session_state.quiz_results.get(idx, {}).get("next_review")
+        # 復習スケジュールは最初の答え合わせの結果だけで更新する
+        if "dir" in item and (item["id"], item["dir"]) not in st.session_state.quiz_reviewed:
+            st.session_state.quiz_reviewed.add((item["id"], item["dir"]))
+            try:
+                state = record_answer(item["id"], item["dir"], correct, float(ratio))
+                next_review = describe_interval(state) if state else None
+            except Exception as e:
+                st.warning(f"復習スケジュールの更新に失敗しました: {e}")
+        st.session_state.quiz_results[idx] = {"checked": True, "correct": correct, "ratio": float(ratio),
+                                              "next_review": next_review}
 
 # --------------- セッション ---------------
 if "quiz_items" not in st.session_state:
-    st.session_state.quiz_items = []   # [{id, q, a}]
+    st.session_state.quiz_items = []   # [{id, dir, q, a}]
 if "quiz_meta" not in st.session_state:
-    st.session_state.quiz_meta = {"folder": None, "direction": "日→英", "num_q": 10}
+    st.session_state.quiz_meta = {"folder": None, "direction": "日→英", "num_q": 10, "order": "復習の期限順"}
 if "quiz_results" not in st.session_state:
-    st.session_state.quiz_results = {} # idx -> {"checked": bool, "correct": bool, "ratio": float}
+    st.session_state.quiz_results = {} # idx -> {"checked": bool, "correct": bool, "ratio": float, "next_review": str}
+if "quiz_reviewed" not in st.session_state:
+    st.session_state.quiz_reviewed = set()  # 復習スケジュールを更新済みの (id, dir)
 
 # --------------- 設定UI -------------------
 try:
@@ -60,6 +62,11 @@ with colB:
 with colC:
     num_q = st.number_input("出題数", min_value=1, max_value=100, value=st.session_state.quiz_meta["num_q"], step=1)
 
+# 出題の選び方（ランダムは SQL 側で抽出するので、大きなフォルダでも全件は読まない）
+ORDER_OPTIONS = ["復習の期限順", "ランダム", "ランダム（間違えた問題を多めに）"]
+order = st.radio("出題の選び方", ORDER_OPTIONS, horizontal=True,
+                 index=ORDER_OPTIONS.index(st.session_state.quiz_meta.get("order", ORDER_OPTIONS[0])))
+
 c1, c2 = st.columns([1,1])
 with c1:
     make_btn = st.button("📝 問題を作成 / 再生成", use_container_width=True)
@@ -72,41 +79,56 @@ if reset_btn:
     st.rerun()
 
 # --------------- 問題作成 -----------------
+# 復習の期限が来ている順に出題する（期限が来たものが足りなければ、次に期限が来るものから補う）
+try:
+    st.caption(f"『{quiz_folder}』で復習の期限が来ている問題: {due_count(quiz_folder, DIRECTIONS[direction])} 問")
+except Exception:
+    pass
+
 if make_btn:
     try:
-        df = get_phrases_by_folder(quiz_folder)  # ※ multiselectは不可。文字列を渡す
+        # ※ multiselectは不可。文字列を渡す
+        if order == "復習の期限順":
+            items = due_queue(quiz_folder, DIRECTIONS[direction], int(num_q))
+        else:
+            items = sample_phrases(quiz_folder, int(num_q), direction=DIRECTIONS[direction],
+                                   weight_errors=(order != "ランダム"))
     except Exception as e:
-        df = None
+        items = None
         st.error(f"単語の取得に失敗しました: {e}")
 
-    if df is None or df.empty:
-        st.warning("このフォルダにはまだ単語がありません。")
+    if not items:
+        if items is not None:
+            st.warning("このフォルダにはまだ単語がありません。")
     else:
-        need = {"id", "japanese", "english"}
-        if not need.issubset(set(df.columns)):
-            st.error("データの列名が不足しています（id, japanese, english が必要）。")
-        else:
-            items = df[["id","japanese","english"]].to_dict("records")
-            random.shuffle(items)
-            items = items[: int(num_q)]
-
-            quiz_items = []
-            for it in items:
-                if direction == "日→英":
-                    quiz_items.append({"id": it["id"], "q": it["japanese"], "a": it["english"]})
-                else:
-                    quiz_items.append({"id": it["id"], "q": it["english"], "a": it["japanese"]})
-
-            st.session_state.quiz_items = quiz_items
-            st.session_state.quiz_results = {}  # クリア
-            st.session_state.quiz_meta = {"folder": quiz_folder, "direction": direction, "num_q": int(num_q)}
-            st.success(f"『{quiz_folder}』から {len(quiz_items)} 問を作成しました。下のエクスパンダーで解いてください。")
+        quiz_items = []
+        for it in items:
+            if direction == "日→英":
+                quiz_items.append({"id": it["id"], "dir": DIRECTIONS[direction], "q": it["japanese"], "a": it["english"]})
+            else:
+                quiz_items.append({"id": it["id"], "dir": DIRECTIONS[direction], "q": it["english"], "a": it["japanese"]})
+
+        st.session_state.quiz_items = quiz_items
+        st.session_state.quiz_results = {}  # クリア
+        st.session_state.quiz_reviewed = set()
+        st.session_state.quiz_meta = {"folder": quiz_folder, "direction": direction, "num_q": int(num_q), "order": order}
+        st.success(f"『{quiz_folder}』から {len(quiz_items)} 問を作成しました。下のエクスパンダーで解いてください。")
 
 # --------------- 全問エクスパンダー表示 ---------------
 items = st.session_state.quiz_items
 if items:
     st.caption(f"出題元: 『{st.session_state.quiz_meta['folder']}』 / 方向: {st.session_state.quiz_meta['direction']} / 全{len(items)}問")
 
+    # 入力済みの解答をまとめて採点（未採点のものだけ）
+    if st.button("📋 入力済みの解答をまとめて採点"):
+        pending = [i for i in range(len(items))
+                   if (st.session_state.get(f"ans_{i}") or "").strip()
+                   and not st.session_state.quiz_results.get(i, {}).get("checked")]
+        if pending:
+            _record_grades(pending, [st.session_state[f"ans_{i}"] for i in pending])
+        else:
+            st.info("未採点の解答がありません。")
+
     # 各問題を独立したエクスパンダーで表示
     for idx, item in enumerate(items):
         # エクスパンダーのタイトルに問題の先頭を少し載せる
@@ -131,11 +153,7 @@ if items:
 
             # 採点処理
             if check:
-                gold = item["a"]
-                exact = (_norm_text(user_ans) == _norm_text(gold))
-                ratio = _overlap_ratio(user_ans, gold)
-                is_correct = exact or (ratio >= 0.8)
-                st.session_state.quiz_results[idx] = {"checked": True, "correct": is_correct, "ratio": float(ratio)}
+                _record_grades([idx], [user_ans])
 
             # 結果表示（採点済みなら表示）
             res = st.session_state.quiz_results.get(idx, {"checked": False})
@@ -147,7 +165,8 @@ if items:
                     st.error("❌ 不正解")
                 st.markdown("**模範解答**")
                 st.write(gold)
-                st.caption(f"一致度: {int(res.get('ratio',0.0)*100)}%")
+                st.caption(f"一致度: {int(res.get('ratio',0.0)*100)}%"
+                           + (f" / 次の復習: {res['next_review']}" if res.get("next_review") else ""))
 
             # 正解だけ見る
             if reveal and not res.get("checked"):
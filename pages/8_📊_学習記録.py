@@ -3,7 +3,7 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from streamlit_calendar import calendar
-from database import get_study_log, log_study_session
+from database import get_study_rollup, get_study_total, log_study_session
 
 st.set_page_config(page_title="学習記録", layout="wide")
 st.title("📊 学習記録")
@@ -26,18 +26,44 @@ with st.sidebar:
             st.cache_data.clear() 
             st.rerun()
 
-# データベースから学習記録を取得
-df = get_study_log()
+# 表示期間ごとの (集計単位, 遡る期間, 空白期間を埋める頻度)
+PERIOD_SETTINGS = {
+    "日別": ("D", pd.DateOffset(days=89), "D"),
+    "週別": ("W", pd.DateOffset(weeks=51), "W-MON"),
+    "月別": ("M", pd.DateOffset(months=23), "MS"),
+}
 
-# データがない場合の初期表示
-if df.empty:
-    st.info("まだ学習記録がありません。サイドバーから今日の学習時間を記録してみましょう！")
-    # ダミーデータを作成して表示
-    st.subheader("表示例")
-    today = datetime.now()
+def _period_start(period_code, ts):
+    """ts を含む集計期間の開始日（週は月曜始まり）"""
+    ts = ts.normalize()
+    if period_code == "W":
+        return ts - pd.Timedelta(days=ts.weekday())
+    if period_code == "M":
+        return ts.replace(day=1)
+    return ts
+
+def _dummy_rollup(period_code):
+    """記録がないときの表示例（直近20日分）"""
+    today = pd.Timestamp(datetime.now())
     dates = [today - timedelta(days=x) for x in range(20)]
     minutes = np.random.randint(15, 60, size=20)
     df = pd.DataFrame({'session_date': dates, 'duration_minutes': minutes})
+    df['period_start'] = [_period_start(period_code, d) for d in df['session_date']]
+    return df.groupby('period_start', as_index=False)['duration_minutes'].sum()
+
+# 集計テーブルから累計だけを取得（全件は読まない）
+total_minutes, total_sessions = get_study_total()
+has_data = total_sessions > 0
+
+# データがない場合の初期表示
+if not has_data:
+    st.info("まだ学習記録がありません。サイドバーから今日の学習時間を記録してみましょう！")
+    st.subheader("表示例")
+
+def load_rollup(period_code, start=None):
+    if not has_data:
+        return _dummy_rollup(period_code)
+    return get_study_rollup(period_code, start=start.date() if start is not None else None)
 
 # --- UI ---
 tab1, tab2 = st.tabs(["📈 学習グラフ", "🗓️ カレンダー"])
@@ -47,39 +73,38 @@ with tab1:
     period_options = ["日別", "週別", "月別", "全期間"]
     selected_period = st.radio("表示期間を選択", period_options, horizontal=True)
 
-    # 日付をインデックスに設定
-    df_indexed = df.set_index('session_date')
-
-    # 集計
-    if selected_period == "日別":
-        data_to_show = df_indexed.resample('D').sum()
-        st.bar_chart(data_to_show['duration_minutes'])
-    elif selected_period == "週別":
-        data_to_show = df_indexed.resample('W-MON').sum()
-        st.bar_chart(data_to_show['duration_minutes'])
-    elif selected_period == "月別":
-        data_to_show = df_indexed.resample('M').sum()
-        st.bar_chart(data_to_show['duration_minutes'])
+    if selected_period in PERIOD_SETTINGS:
+        # 表示する期間の集計行だけを読む
+        period_code, span, freq = PERIOD_SETTINGS[selected_period]
+        end = _period_start(period_code, pd.Timestamp(datetime.now()))
+        start = _period_start(period_code, end - span)
+        rollup = load_rollup(period_code, start)
+        # 学習していない期間も0分として表示する
+        index = pd.date_range(start, end, freq=freq)
+        data_to_show = (
+            rollup.set_index('period_start')['duration_minutes']
+            .reindex(index, fill_value=0)
+        )
+        st.bar_chart(data_to_show)
     else: # 全期間
-        total_minutes = df['duration_minutes'].sum()
-        total_hours = total_minutes / 60
-        st.metric(label="累計学習時間", value=f"{total_hours:.1f} 時間", delta=f"{total_minutes} 分")
-        st.bar_chart(df.set_index('session_date')['duration_minutes'])
+        rollup = load_rollup("D")
+        shown_minutes = total_minutes if has_data else int(rollup['duration_minutes'].sum())
+        total_hours = shown_minutes / 60
+        st.metric(label="累計学習時間", value=f"{total_hours:.1f} 時間", delta=f"{shown_minutes} 分")
+        st.bar_chart(rollup.set_index('period_start')['duration_minutes'])
 
 with tab2:
     st.header("学習カレンダー")
     
-    # カレンダー用のイベントデータを作成
+    # カレンダー用のイベントデータを作成（日別の集計行をそのまま使う）
     calendar_events = []
-    if not df.empty:
-        # 日付ごとに学習時間を集計
-        weekly_summary = df.groupby('session_date')['duration_minutes'].sum().reset_index()
-        for _, row in weekly_summary.iterrows():
-            calendar_events.append({
-                "title": f"{row['duration_minutes']} min",
-                "start": row['session_date'].strftime("%Y-%m-%d"),
-                "allDay": True, # 終日イベントとして表示
-            })
+    daily_summary = load_rollup("D")
+    for _, row in daily_summary.iterrows():
+        calendar_events.append({
+            "title": f"{row['duration_minutes']} min",
+            "start": row['period_start'].strftime("%Y-%m-%d"),
+            "allDay": True, # 終日イベントとして表示
+        })
             
     calendar_options = {
         "headerToolbar": {
@@ -0,0 +1,111 @@
+"""ディスカッション設問の先読みプール。
+
+生成済みの設問を SQLite の question_pool テーブルに貯めておき、「設問を生成」では
+そこから1件取り出すだけにする（LLM の往復を待たない）。
+出題待ちが LOW_WATERMARK を下回ったら、バックグラウンドのワーカーが HIGH_WATERMARK まで補充する。
+出題済みの設問も正規化したキーで残すので、同じ設問は二度とプールに入らない。
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import streamlit as st
+from openai import OpenAI
+
+from database import add_pool_questions, count_pool_questions, pop_pool_question
+from generation import QUESTION_LEVELS, QUESTION_TOPICS, generate_toefl_question, generate_toefl_questions
+
+LOW_WATERMARK = 5
+HIGH_WATERMARK = 20
+# 1リクエストで生成する設問数 / 重複ばかりで増えないときに諦めるまでの回数
+GENERATE_BATCH = 8
+MAX_STALLS = 3
+
+# 補充中の (topic, level)。同じ条件の補充を二重に投げない
+_refilling = set()
+_refilling_lock = threading.Lock()
+
+
+@st.cache_resource
+def _executor() -> ThreadPoolExecutor:
+    """補充用のワーカー（プロセス共有・1本）"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="question-pool")
+
+
+def question_key(question: str) -> str:
+    """重複判定用のキー（NFKC・小文字化・記号と空白を除いたもののハッシュ）"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    text = re.sub(r"[\W_]+", "", text)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def refill(client: OpenAI, topic: Optional[str] = None, level: Optional[str] = None) -> int:
+    """出題待ちが HIGH_WATERMARK になるまで生成して追加する。追加した件数を返す"""
+    added, stalls = 0, 0
+    while count_pool_questions(topic, level) < HIGH_WATERMARK and stalls < MAX_STALLS:
+        t = topic or random.choice(QUESTION_TOPICS)
+        lv = level or random.choice(QUESTION_LEVELS)
+        try:
+            questions = generate_toefl_questions(client, GENERATE_BATCH, t, lv)
+        except Exception:
+            stalls += 1
+            continue
+        n = add_pool_questions([(q, question_key(q), t, lv) for q in questions])
+        stalls = stalls + 1 if n == 0 else 0
+        added += n
+    return added
+
+
+def _refill_job(client: OpenAI, topic: Optional[str], level: Optional[str]) -> None:
+    try:
+        refill(client, topic, level)
+    finally:
+        with _refilling_lock:
+            _refilling.discard((topic, level))
+
+
+def ensure_refill(client: OpenAI, topic: Optional[str] = None, level: Optional[str] = None) -> bool:
+    """出題待ちが LOW_WATERMARK 未満なら補充をバックグラウンドで始める。始めたら True"""
+    if count_pool_questions(topic, level) >= LOW_WATERMARK:
+        return False
+    with _refilling_lock:
+        if (topic, level) in _refilling:
+            return False
+        _refilling.add((topic, level))
+    _executor().submit(_refill_job, client, topic, level)
+    return True
+
+
+def next_question(client: OpenAI, topic: Optional[str] = None, level: Optional[str] = None) -> dict:
+    """次の設問を {"question", "topic", "level"} で返す。
+
+    プールにあれば取り出すだけ。空のときだけその場で1問生成する（出題済みとして記録）。
+    どちらの場合も、減った分の補充はバックグラウンドで行う。
+    """
+    row = pop_pool_question(topic, level)
+    ensure_refill(client, topic, level)
+    if row is not None:
+        return row
+    q = generate_toefl_question(client)
+    add_pool_questions([(q, question_key(q), topic or "", level or "")], status="served")
+    return {"question": q, "topic": topic or "", "level": level or ""}
+
+
+@st.cache_resource
+def seed_asked_questions(path: str) -> int:
+    """以前 output.json に保存していた出題済みの設問を、重複チェック用に一度だけ取り込む"""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return 0
+    questions = [d.get("question") for d in data if isinstance(d, dict)] if isinstance(data, list) else []
+    return add_pool_questions([(q, question_key(q), "", "") for q in questions if q], status="served")
@@ -0,0 +1,247 @@
+"""録音ログ（JSON Lines）と、その横に置くバイトオフセット索引。
+
+ログ本体 `recordings_xxx.jsonl` には1行1件で追記するだけなので、件数が増えても追記は O(1)。
+索引 `recordings_xxx.jsonl.idx` は固定長レコードの配列で、
+(オフセット, 行の長さ, timestamp, category, mode) を保持する。
+固定長なので「末尾N件」はシーク1回、日付範囲は二分探索で該当行だけを読める。
+"""
+import bisect
+import datetime as dt
+import json
+import os
+import struct
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+INDEX_SUFFIX = ".idx"
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+# offset(u64), length(u32), timestamp(15), category(16), mode(16)
+_INDEX_RECORD = struct.Struct("<QI15s16s16s")
+_lock = threading.Lock()
+
+
+def index_path(log_path: str) -> str:
+    return log_path + INDEX_SUFFIX
+
+
+def _field(value: Any, size: int) -> bytes:
+    return str(value or "").encode("utf-8")[:size]
+
+
+def _pack(offset: int, length: int, item: Dict[str, Any]) -> bytes:
+    return _INDEX_RECORD.pack(
+        offset,
+        length,
+        _field(item.get("timestamp"), 15),
+        _field(item.get("category"), 16),
+        _field(item.get("mode"), 16),
+    )
+
+
+def _unpack(raw: bytes) -> Dict[str, Any]:
+    offset, length, ts, category, mode = _INDEX_RECORD.unpack(raw)
+    return {
+        "offset": offset,
+        "length": length,
+        "timestamp": ts.rstrip(b"\0").decode("utf-8", "ignore"),
+        "category": category.rstrip(b"\0").decode("utf-8", "ignore"),
+        "mode": mode.rstrip(b"\0").decode("utf-8", "ignore"),
+    }
+
+
+def _encode_line(item: Dict[str, Any]) -> bytes:
+    return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _to_timestamp(value: Any) -> str:
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.strftime(TIMESTAMP_FORMAT)
+    return str(value)
+
+
+# =============== 書き込み ===============
+def append_record(log_path: str, item: Dict[str, Any], stamp: bool = False) -> None:
+    """ログ末尾に1件追記し、索引にもオフセットを追記する。
+
+    read_range は timestamp が追記順に並んでいる前提なので、完了順が前後しうる書き手（解析ジョブなど）は
+    stamp=True にする。追記と同じロックの中で timestamp を現在時刻にするので、ログは必ず時刻順になる。
+    """
+    with _lock:
+        if stamp:
+            item["timestamp"] = dt.datetime.now().strftime(TIMESTAMP_FORMAT)
+        line = _encode_line(item)
+        _ensure_index(log_path)
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        with open(log_path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(line)
+        with open(index_path(log_path), "ab") as f:
+            f.write(_pack(offset, len(line), item))
+
+
+def rebuild_index(log_path: str) -> int:
+    """ログ本体を先頭から走査して索引を作り直す。索引の件数を返す。"""
+    records = []
+    if os.path.exists(log_path):
+        with open(log_path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で落ちた行などは読み飛ばす
+                    item = None
+                if isinstance(item, dict):
+                    records.append(_pack(offset, len(line), item))
+                offset += len(line)
+    tmp = index_path(log_path) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"".join(records))
+    os.replace(tmp, index_path(log_path))
+    return len(records)
+
+
+def _ensure_index(log_path: str) -> None:
+    """索引が無い/ログ本体とずれている場合だけ作り直す（通常は stat 2回で済む）。"""
+    idx = index_path(log_path)
+    if not os.path.exists(log_path):
+        return
+    log_size = os.path.getsize(log_path)
+    if os.path.exists(idx):
+        idx_size = os.path.getsize(idx)
+        if idx_size % _INDEX_RECORD.size == 0:
+            if idx_size == 0 and log_size == 0:
+                return
+            if idx_size:
+                with open(idx, "rb") as f:
+                    f.seek(idx_size - _INDEX_RECORD.size)
+                    last = _unpack(f.read(_INDEX_RECORD.size))
+                if last["offset"] + last["length"] == log_size:
+                    return
+    rebuild_index(log_path)
+
+
+def migrate_json_array(json_path: str, log_path: str) -> int:
+    """旧形式（JSON配列を毎回書き直す形式）のログを JSON Lines に一度だけ移行する。
+
+    移行先が既にある場合は何もしない。元のJSONファイルは残す。移行した件数を返す。
+    """
+    if os.path.exists(log_path) or not os.path.exists(json_path):
+        return 0
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return 0
+    items = [d for d in data if isinstance(d, dict)] if isinstance(data, list) else []
+
+    with _lock:
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        lines, records, offset = [], [], 0
+        for item in items:
+            line = _encode_line(item)
+            lines.append(line)
+            records.append(_pack(offset, len(line), item))
+            offset += len(line)
+        tmp = log_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"".join(lines))
+        with open(index_path(log_path), "wb") as f:
+            f.write(b"".join(records))
+        os.replace(tmp, log_path)
+    return len(items)
+
+
+# =============== 読み込み ===============
+class _IndexView:
+    """索引ファイルを、必要なレコードだけ読むシーケンスとして扱う。"""
+
+    def __init__(self, f):
+        self._f = f
+        self._len = os.fstat(f.fileno()).st_size // _INDEX_RECORD.size
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        self._f.seek(i * _INDEX_RECORD.size)
+        return _unpack(self._f.read(_INDEX_RECORD.size))
+
+    def slice(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """連続したレコードを1回の read でまとめて読む。"""
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return []
+        self._f.seek(start * _INDEX_RECORD.size)
+        raw = self._f.read((stop - start) * _INDEX_RECORD.size)
+        return [_unpack(raw[i:i + _INDEX_RECORD.size]) for i in range(0, len(raw), _INDEX_RECORD.size)]
+
+
+def _matches(rec: Dict[str, Any], category: Optional[str], mode: Optional[str]) -> bool:
+    return (category is None or rec["category"] == category) and (mode is None or rec["mode"] == mode)
+
+
+def _load_entries(log_path: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out = []
+    with open(log_path, "rb") as f:
+        for rec in records:
+            f.seek(rec["offset"])
+            out.append(json.loads(f.read(rec["length"])))
+    return out
+
+
+def _iter_index_backwards(view: _IndexView, block: int = 256) -> Iterator[Dict[str, Any]]:
+    stop = len(view)
+    while stop > 0:
+        start = max(stop - block, 0)
+        yield from reversed(view.slice(start, stop))
+        stop = start
+
+
+def read_latest(log_path: str, n: int = 20, category: Optional[str] = None,
+                mode: Optional[str] = None) -> List[Dict[str, Any]]:
+    """新しい順に最大n件を返す。category / mode で絞り込める。"""
+    if n <= 0 or not os.path.exists(log_path):
+        return []
+    with _lock:
+        _ensure_index(log_path)
+    with open(index_path(log_path), "rb") as f:
+        view = _IndexView(f)
+        picked = []
+        for rec in _iter_index_backwards(view):
+            if _matches(rec, category, mode):
+                picked.append(rec)
+                if len(picked) >= n:
+                    break
+    return _load_entries(log_path, picked)
+
+
+def read_range(log_path: str, start: Any = None, end: Any = None, category: Optional[str] = None,
+               mode: Optional[str] = None) -> List[Dict[str, Any]]:
+    """timestamp が [start, end] に入る記録を古い順に返す。
+
+    start / end は datetime・date または "YYYYMMDD_HHMMSS" 形式（前方一致）の文字列。
+    記録は時刻順に追記される前提で、索引を二分探索して該当範囲だけを読む。
+    """
+    if not os.path.exists(log_path):
+        return []
+    with _lock:
+        _ensure_index(log_path)
+    lo_key = _to_timestamp(start) if start is not None else None
+    # 終端は前方一致で含めたいので、その接頭辞以降の最大値として扱う
+    hi_key = _to_timestamp(end) + "\uffff" if end is not None else None
+    if isinstance(end, dt.date) and not isinstance(end, dt.datetime):
+        hi_key = end.strftime("%Y%m%d") + "\uffff"
+
+    with open(index_path(log_path), "rb") as f:
+        view = _IndexView(f)
+        ts_key = lambda rec: rec["timestamp"]
+        lo = bisect.bisect_left(view, lo_key, key=ts_key) if lo_key is not None else 0
+        hi = bisect.bisect_right(view, hi_key, key=ts_key) if hi_key is not None else len(view)
+        picked = [rec for rec in view.slice(lo, hi) if _matches(rec, category, mode)]
+    return _load_entries(log_path, picked)
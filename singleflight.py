@@ -0,0 +1,82 @@
+"""同じリクエストの同時実行をまとめる（single-flight）。
+
+Streamlit の再実行やボタンの連打で、同じ翻訳・生成・評価のリクエストが前の呼び出しの完了前に
+もう一度飛ぶことがある。SingleFlight.do(key, fn) は、同じ key の呼び出しが実行中ならそれを待って
+同じ結果を返し、上流への呼び出しを1回にする。完了後も grace_sec 秒のあいだは結果を使い回す
+（再実行の直後に届いた重複もまとめるため）。失敗した結果は使い回さない。
+毎回違う結果がほしい呼び出し（temperature > 0 の生成など）は grace_sec=0 を渡し、実行中の重複だけをまとめる。
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# 完了した結果を使い回す秒数
+GRACE_SEC = 2.0
+
+
+class _Flight:
+    def __init__(self, grace_sec: float):
+        self.grace_sec = grace_sec
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.finished_at = 0.0
+
+
+class SingleFlight:
+    """key ごとに実行中（と完了直後）の呼び出しを1つにまとめる。スレッド間で共有する"""
+
+    def __init__(self, grace_sec: float = GRACE_SEC):
+        self.grace_sec = grace_sec
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"executed": 0, "coalesced": 0}
+
+    def _expire(self, now: float) -> None:
+        expired = [k for k, f in self._flights.items()
+                   if f.done.is_set() and now - f.finished_at > f.grace_sec]
+        for k in expired:
+            del self._flights[k]
+
+    def do(self, key: str, fn: Callable[[], Any], grace_sec: Optional[float] = None) -> Any:
+        """fn() の結果を返す。同じ key が実行中・完了直後ならその結果を共有する（戻り値は呼び出し元で書き換えないこと）
+
+        grace_sec はこの呼び出しの結果を完了後に使い回す秒数（省略時はインスタンスの grace_sec、0 なら使い回さない）。
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(self.grace_sec if grace_sec is None else grace_sec)
+                self._stats["executed"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            raise
+        finally:
+            flight.finished_at = time.monotonic()
+            flight.done.set()
+            if flight.grace_sec <= 0:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        """上流を実際に呼んだ回数と、まとめて省いた回数"""
+        with self._lock:
+            return dict(self._stats, in_flight=sum(1 for f in self._flights.values() if not f.done.is_set()))
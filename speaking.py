@@ -0,0 +1,317 @@
+"""スピーキング録音の解析処理（保存・長さ計算・文字起こし・評価）。
+
+Streamlit の画面処理から切り離してあるので、バックグラウンドのジョブ（analysis_jobs.py）からも呼べる。
+"""
+import hashlib
+import io
+import json
+import re
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+from openai import OpenAI
+
+from audio_processing import TARGET_SAMPLE_RATE, encode_for_storage, encode_mono_for_storage, encode_wav, load_mono
+from fluency import fluency_evidence
+from llm_client import chat_completion, record_metric, transcription
+from telemetry import instrumented, record_stream_end, set_parse_status
+from vad import detect_speech, join_segments
+
+EVALUATION_MODEL = "gpt-4o-mini"
+TRANSCRIPTION_MODEL = "whisper-1"
+# 評価プロンプトや採点基準を変えたら上げる（録音解析キャッシュの鍵に入るので、古い結果は使われなくなる）
+RUBRIC_VERSION = 2
+# 文字起こしに送る前に、発話のあいだの無音をこの秒数までに詰める
+TRANSCRIBE_MAX_PAUSE_SEC = 1.0
+# これより長い音声は無音の位置で CHUNK_MAX_SEC 以下に分けて並列に文字起こしする
+SINGLE_SHOT_MAX_SEC = 60.0
+CHUNK_MAX_SEC = 45.0
+# 無音が無く途中で切るときに前後のチャンクを重ねる秒数（重なった単語はつなぐときに除く）
+CHUNK_OVERLAP_SEC = 1.5
+TRANSCRIBE_WORKERS = 4
+# ストリーミング評価で途中経過を通知する最短間隔（秒）
+STREAM_UPDATE_INTERVAL = 0.2
+
+
+def save_bytes_to_file(b: bytes, path: str) -> None:
+    with open(path, "wb") as f:
+        f.write(b)
+
+def save_recording(wav_bytes: bytes, base_path: str, samples: Optional[np.ndarray] = None) -> str:
+    """録音を保存用の形式（16kHz モノラルの FLAC / WAV）にして base_path + 拡張子 に保存し、パスを返す
+
+    呼び出し側で load_mono 済みなら samples に渡す（もう一度デコード・リサンプルしない）。
+    """
+    data, ext = encode_for_storage(wav_bytes) if samples is None else encode_mono_for_storage(samples)
+    path = base_path + ext
+    save_bytes_to_file(data, path)
+    return path
+
+def compute_wav_duration_seconds(wav_bytes: bytes) -> float:
+    # st_audiorec は WAV ヘッダ付与済み
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        frames = wf.getnframes()
+        rate = wf.getframerate()
+        return float(frames) / float(rate) if rate else 0.0
+
+def fingerprint_audio(b: bytes) -> str:
+    return hashlib.md5(b).hexdigest()
+
+@st.cache_resource
+def _transcribe_executor() -> ThreadPoolExecutor:
+    """長い録音のチャンクを並列に送るワーカー（同時数は llm_client のレート制限でも抑えられる）"""
+    return ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS, thread_name_prefix="transcribe")
+
+def plan_chunks(segments: List[Tuple[float, float]], duration: float,
+                max_sec: float = CHUNK_MAX_SEC, overlap_sec: float = CHUNK_OVERLAP_SEC) -> List[Tuple[float, float, bool]]:
+    """発話区間から、max_sec 以下のチャンク [(開始秒, 終了秒, 前と重なっているか), ...] を作る。
+
+    区切りは発話区間のあいだの無音に置く。1つの発話区間が max_sec より長いときだけ
+    途中で切り、前のチャンクと overlap_sec 重ねる。
+    """
+    if not segments:
+        segments = [(0.0, duration)]
+    chunks: List[Tuple[float, float, bool]] = []
+    start, end, overlapped = segments[0][0], segments[0][0], False
+    for s, e in segments:
+        if e - start > max_sec and end > start:
+            chunks.append((start, end, overlapped))
+            start, overlapped = s, False
+        while e - start > max_sec:
+            chunks.append((start, start + max_sec, overlapped))
+            start, overlapped = start + max_sec - overlap_sec, True
+        end = e
+    chunks.append((start, end, overlapped))
+    return [(round(s, 3), round(e, 3), o) for s, e, o in chunks]
+
+def _words(text: str) -> List[str]:
+    return [re.sub(r"[^\w']", "", w).lower() for w in text.split()]
+
+def stitch_transcripts(texts: List[str], overlapped: List[bool], max_overlap_words: int = 8) -> str:
+    """チャンクごとの文字起こしを順につなぐ。重ねて切った境目では、前の末尾と同じ単語列を次の先頭から除く"""
+    out: List[str] = []
+    for text, ov in zip(texts, overlapped):
+        words = text.split()
+        if ov and out:
+            tail, head = _words(" ".join(out[-max_overlap_words:])), _words(" ".join(words[:max_overlap_words]))
+            for k in range(min(len(tail), len(head)), 0, -1):
+                if tail[-k:] == head[:k]:
+                    words = words[k:]
+                    break
+        out.extend(words)
+    return " ".join(out)
+
+def _transcribe_once(client: OpenAI, wav_bytes: bytes) -> str:
+    # OpenAI API はファイルlikeを受け付ける
+    audio_f = io.BytesIO(wav_bytes)
+    audio_f.name = "audio.wav"
+    r = transcription(
+        client,
+        model=TRANSCRIPTION_MODEL,
+        file=audio_f
+    )
+    return r.text.strip()
+
+@instrumented("transcribe_chunk")
+def _transcribe_chunk(client: OpenAI, samples: np.ndarray) -> str:
+    return _transcribe_once(client, encode_wav(samples, TARGET_SAMPLE_RATE))
+
+@instrumented("transcribe_wav_bytes")
+def transcribe_samples(client: OpenAI, x: np.ndarray, segments: List[Tuple[float, float]],
+                       trim: bool = True) -> str:
+    """16kHz モノラル信号 x を文字起こしする。segments は x の発話区間（vad.detect_speech の結果）。
+
+    発話区間を検出済みの呼び出し側（解析ジョブなど）が、同じ区間を流暢さの指標と共有するための入口。
+    trim=True なら前後の無音を削って長い間を詰めてから送る。
+    SINGLE_SHOT_MAX_SEC より長い音声は無音の位置でチャンクに分け、並列に送って順につなぐ。
+    """
+    rate = TARGET_SAMPLE_RATE
+    if trim and segments:
+        x, segments = join_segments(x, segments, rate, TRANSCRIBE_MAX_PAUSE_SEC)
+    duration = len(x) / rate
+    if duration <= SINGLE_SHOT_MAX_SEC:
+        return _transcribe_once(client, encode_wav(x, rate))
+
+    chunks = plan_chunks(segments, duration)
+    futures = [_transcribe_executor().submit(_transcribe_chunk, client, x[int(s * rate):int(e * rate)])
+               for s, e, _ in chunks]
+    return stitch_transcripts([f.result() for f in futures], [o for _, _, o in chunks])
+
+def transcribe_wav_bytes(client: OpenAI, wav_bytes: bytes, trim: bool = True) -> str:
+    """OpenAI Whisperで文字起こし（要APIキー）。
+
+    16kHz モノラルにして発話区間を検出し、transcribe_samples で送る（vad.py）。
+    呼び出し側で既に削ってある場合は trim=False にする。
+    """
+    x = load_mono(wav_bytes, TARGET_SAMPLE_RATE)
+    return transcribe_samples(client, x, detect_speech(x, TARGET_SAMPLE_RATE), trim)
+
+def _evaluation_messages(question: str, transcript: str, fluency: Optional[dict] = None) -> list:
+    # 録音から測った流暢さの指標（fluency.py）があれば、fluency の採点の根拠として添える
+    evidence = f"Measured from the recording: {fluency_evidence(fluency)}\n" if fluency else ""
+    user = f"""
+Question: {question}
+Learner's response (transcribed): {transcript}
+{evidence}
+Rate on 0–5 scale:
+- grammar
+- content_relevance
+- fluency
+
+Return strict JSON:
+{{
+  "scores": {{"grammar": <int>, "content_relevance": <int>, "fluency": <int>}},
+  "comment": "<one-paragraph natural feedback>",
+  "tips": ["<short fix 1>", "<short fix 2>", "<short fix 3>"]
+}}
+"""
+    return [
+        {"role": "system", "content": "You are a precise English speaking evaluator for TOEFL practice."},
+        {"role": "user", "content": user}
+    ]
+
+def _extract_json(content: str) -> dict:
+    # JSON抽出
+    start = content.find("{"); end = content.rfind("}")
+    if start != -1 and end != -1:
+        content = content[start:end+1]
+    return json.loads(content)
+
+@instrumented("evaluate_speaking", parses_json=True)
+def evaluate_speaking(client: OpenAI, question: str, transcript: str, fluency: Optional[dict] = None) -> dict:
+    """文法/内容/流暢さを5点満点で評価し、短い講評と改善提案をJSONで返す。
+
+    fluency（fluency.py の指標）を渡すと、プロンプトに根拠として添える。
+    """
+    resp = chat_completion(
+        client,
+        model=EVALUATION_MODEL,
+        temperature=0.4,
+        messages=_evaluation_messages(question, transcript, fluency)
+    )
+    return _extract_json(resp.choices[0].message.content)
+
+def _scan(text: str):
+    """JSON テキストを走査して (文字列の中か, 閉じていない括弧のスタック, 値の区切り位置) を返す"""
+    in_string = escape = False
+    stack, cuts = [], []
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+            cuts.append(i + 1)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == ",":
+            cuts.append(i)
+    return in_string, escape, stack, cuts
+
+def parse_partial_json(text: str) -> Optional[dict]:
+    """途中までしか届いていない JSON オブジェクトを、読めるところまで dict にする。
+
+    開いたままの文字列・配列・オブジェクトを閉じて読む。それでも読めない（キーだけ・値の途中など）ときは
+    直前の区切り（, や { [ の直後）まで戻して読み直す。何も読めなければ None。
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = text[start:]
+    while text:
+        in_string, escape, stack, cuts = _scan(text)
+        candidate = text
+        if in_string:
+            if escape:
+                candidate = candidate[:-1]
+            # 途中で切れた \uXXXX は落とす
+            tail = candidate[-6:]
+            u = tail.rfind("\\u")
+            if u != -1 and len(tail) - u < 6:
+                candidate = candidate[:len(candidate) - (len(tail) - u)]
+            candidate += '"'
+        candidate = candidate.rstrip()
+        if candidate.endswith(","):
+            candidate = candidate[:-1]
+        closed = candidate + "".join("}" if c == "{" else "]" for c in reversed(stack))
+        try:
+            data = json.loads(closed)
+            return data if isinstance(data, dict) else None
+        except ValueError:
+            pass
+        # 直前の区切りまで戻す
+        cut = max((c for c in cuts if c < len(text)), default=0)
+        if cut <= 0:
+            return None
+        text = text[:cut]
+    return None
+
+@instrumented("evaluate_speaking_stream", parses_json=True)
+def evaluate_speaking_stream(client: OpenAI, question: str, transcript: str,
+                             on_update: Optional[Callable[[dict], None]] = None,
+                             fluency: Optional[dict] = None) -> dict:
+    """evaluate_speaking のストリーミング版。
+
+    届いた分の JSON をその都度読み、scores / comment / tips が増えるたびに on_update(途中の評価) を呼ぶ。
+    最初のスコアが読めるまでの秒数は "evaluation_time_to_first_feedback" として記録する。
+    ストリーミングが使えない・途中で失敗したときは、通常の evaluate_speaking でやり直す。
+    """
+    started = time.perf_counter()
+    try:
+        stream = chat_completion(
+            client,
+            model=EVALUATION_MODEL,
+            temperature=0.4,
+            stream=True,
+            stream_options={"include_usage": True},
+            messages=_evaluation_messages(question, transcript, fluency)
+        )
+        content, last, last_sent, first_feedback, usage = "", None, 0.0, False, None
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            content += chunk.choices[0].delta.content or ""
+            partial = parse_partial_json(content)
+            if not partial or partial == last:
+                continue
+            last = partial
+            if not first_feedback and partial.get("scores"):
+                first_feedback = True
+                record_metric("evaluation_time_to_first_feedback", time.perf_counter() - started)
+            now = time.perf_counter()
+            if on_update and now - last_sent >= STREAM_UPDATE_INTERVAL:
+                last_sent = now
+                on_update(partial)
+        record_stream_end(usage)
+        result = _extract_json(content)
+        set_parse_status("ok")
+    except Exception as e:
+        if isinstance(e, (ValueError, KeyError, TypeError)):
+            set_parse_status("failed")
+        record_metric("evaluation_stream_fallbacks", 1)
+        result = evaluate_speaking(client, question, transcript, fluency)
+    record_metric("evaluation_total_seconds", time.perf_counter() - started)
+    if on_update:
+        on_update(result)
+    return result
+
+def analysis_version() -> str:
+    """採点基準と使うモデルの版（録音解析キャッシュの鍵に使う）"""
+    return f"rubric{RUBRIC_VERSION}:{EVALUATION_MODEL}:{TRANSCRIPTION_MODEL}"
+
+def failed_evaluation(error: Exception) -> dict:
+    """評価に失敗したときに記録する既定値"""
+    return {"scores": {"grammar": 0, "content_relevance": 0, "fluency": 0},
+            "comment": f"Evaluation failed: {error}", "tips": []}
@@ -0,0 +1,77 @@
+"""MYクイズの復習スケジュール（SM-2 方式の間隔反復）。
+
+フレーズ×出題方向ごとに reviews テーブルへ 連続正解数・間隔（日）・易しさ係数（ease）・次の期限 を持つ。
+答え合わせの結果（一致度）を 0〜5 の評価にして next_state で次の期限を決める。
+出題は期限の早い順に N 件を索引から読むだけなので、フォルダが大きくても全件は読まない。
+"""
+import time
+from typing import Dict, List, Optional
+
+from database import count_due_reviews, get_due_reviews, get_review, save_review
+
+# 画面の出題方向と reviews.direction の対応
+DIRECTIONS = {"日→英": "ja-en", "英→日": "en-ja"}
+# 間違えたカードを同じ日にもう一度出すまでの分数
+RELEARN_MINUTES = 10
+MIN_EASE = 1.3
+DAY_SEC = 86400
+
+
+def quality_from_grade(correct: bool, ratio: float) -> int:
+    """答え合わせの結果を SM-2 の評価（0〜5、3以上が正解）にする"""
+    if correct:
+        return 5 if ratio >= 0.95 else 4
+    if ratio >= 0.5:
+        return 2
+    return 1 if ratio > 0 else 0
+
+
+def next_state(state: Dict, quality: int, now: float) -> Dict:
+    """SM-2 で次の状態（repetitions, interval_days, ease, due_at, lapses）を計算する"""
+    ease = max(MIN_EASE, state["ease"] + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    repetitions, lapses = state["repetitions"], state["lapses"]
+    if quality < 3:
+        repetitions, interval, lapses = 0, 0.0, lapses + 1
+        due_at = now + RELEARN_MINUTES * 60
+    else:
+        if repetitions == 0:
+            interval = 1.0
+        elif repetitions == 1:
+            interval = 6.0
+        else:
+            interval = round(state["interval_days"] * ease, 2)
+        repetitions += 1
+        due_at = now + interval * DAY_SEC
+    return {"repetitions": repetitions, "interval_days": interval, "ease": round(ease, 3), "due_at": due_at,
+            "lapses": lapses, "last_quality": quality, "reviewed_at": now}
+
+
+def record_answer(phrase_id: int, direction: str, correct: bool, ratio: float,
+                  now: Optional[float] = None) -> Optional[Dict]:
+    """答え合わせの結果で復習状態を更新し、新しい状態を返す（フレーズが削除済みなら None）"""
+    now = time.time() if now is None else now
+    state = get_review(phrase_id, direction)
+    if state is None:
+        return None
+    new = next_state(state, quality_from_grade(correct, ratio), now)
+    save_review(phrase_id, direction, new)
+    return new
+
+
+def due_queue(folder: str, direction: str, n: int) -> List[Dict]:
+    """期限の早い順に n 件（期限が来ているものが n 件未満なら、次に期限が来るものも含める）"""
+    return get_due_reviews(folder, direction, n)
+
+
+def due_count(folder: str, direction: str, now: Optional[float] = None) -> int:
+    return count_due_reviews(folder, direction, time.time() if now is None else now)
+
+
+def describe_interval(state: Dict, now: Optional[float] = None) -> str:
+    """次の出題までの目安（「10分後」「6日後」など）"""
+    seconds = state["due_at"] - (time.time() if now is None else now)
+    if seconds < 3600:
+        return f"{max(1, round(seconds / 60))}分後"
+    if seconds < DAY_SEC:
+        return f"{round(seconds / 3600)}時間後"
+    return f"{round(seconds / DAY_SEC)}日後"
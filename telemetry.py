@@ -0,0 +1,218 @@
+"""API呼び出しの計測（所要時間・トークン数・送信バイト数・リトライ回数・JSON解析の成否・概算コスト）。
+
+llm_client の _call がリクエストごとに record_call を呼ぶ。記録はキューに積むだけで、
+専用スレッドが FLUSH_INTERVAL 秒ごと（または FLUSH_BATCH 件たまったら）まとめて llm_calls テーブルへ書く。
+画面の処理を DB 書き込みで待たせないため。
+
+どの処理からの呼び出しか・応答の JSON を読めたかは、呼び出し側の関数に
+@instrumented("translate_text", parses_json=True) を付けて記録する。
+"""
+import atexit
+import functools
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+
+from database import insert_llm_calls, prune_llm_calls
+
+FLUSH_INTERVAL = 1.0
+FLUSH_BATCH = 100
+QUEUE_MAX = 10000
+RETENTION_DAYS = 90
+
+# 概算コスト用の単価（USD / 100万トークン。whisper-1 は USD / 分、画像は usage が無いときの1枚あたり）
+MODEL_PRICES: Dict[str, Dict[str, float]] = {
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-image-1": {"input": 5.00, "output": 40.00, "per_image": 0.167},
+    "whisper-1": {"per_minute": 0.006},
+}
+
+_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=QUEUE_MAX)
+_dropped = 0
+_local = threading.local()
+
+
+def estimate_cost(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+                  audio_seconds: Optional[float] = None, images: int = 0) -> Optional[float]:
+    """MODEL_PRICES から概算コスト（USD）を計算する。単価が分からなければ None"""
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return None
+    if "per_minute" in price:
+        return price["per_minute"] * (audio_seconds or 0) / 60
+    if prompt_tokens is None and completion_tokens is None:
+        return price.get("per_image", 0) * images if images else None
+    return ((prompt_tokens or 0) * price.get("input", 0) + (completion_tokens or 0) * price.get("output", 0)) / 1e6
+
+
+def _usage_tokens(usage: Any):
+    """chat の prompt/completion_tokens、画像の input/output_tokens のどちらにも対応する"""
+    if usage is None:
+        return None, None
+    prompt = getattr(usage, "prompt_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if prompt is None and completion is None:
+        prompt = getattr(usage, "input_tokens", None)
+        completion = getattr(usage, "output_tokens", None)
+    return prompt, completion
+
+
+# =============== 非同期の書き込み ===============
+def _write_loop() -> None:
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < FLUSH_BATCH:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        try:
+            insert_llm_calls(batch)
+        except Exception:
+            pass  # 計測の失敗でアプリを止めない
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+@st.cache_resource
+def _writer() -> threading.Thread:
+    """プロセスで1本の書き込みスレッド（起動時に古い記録を削除する）"""
+    try:
+        prune_llm_calls(time.time() - RETENTION_DAYS * 86400)
+    except Exception:
+        pass
+    thread = threading.Thread(target=_write_loop, name="telemetry-writer", daemon=True)
+    thread.start()
+    return thread
+
+
+def _enqueue(event: Dict[str, Any]) -> None:
+    global _dropped
+    _writer()
+    try:
+        _queue.put_nowait(event)
+    except queue.Full:
+        _dropped += 1
+
+
+def flush() -> None:
+    """キューに残っている記録が書き込まれるまで待つ"""
+    if _queue.unfinished_tasks:
+        _writer()
+        _queue.join()
+
+
+def dropped_count() -> int:
+    """キューが満杯で捨てた記録の数"""
+    return _dropped
+
+
+atexit.register(flush)
+
+
+# =============== 呼び出し側の処理単位 ===============
+class _Operation:
+    def __init__(self, name: str, parses_json: bool):
+        self.name = name
+        self.parses_json = parses_json
+        self.parse_status: Optional[str] = None
+        self.calls: List[Dict[str, Any]] = []
+
+    def finish(self, parse_status: Optional[str]) -> None:
+        status = self.parse_status or parse_status
+        for event in self.calls:
+            if self.parses_json and event["status"] == "ok":
+                event["parse_status"] = status
+            _enqueue(event)
+
+
+def _stack() -> List[_Operation]:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def instrumented(name: str, parses_json: bool = False) -> Callable:
+    """この関数の中の API 呼び出しを name の処理として記録する。
+
+    parses_json=True なら、関数が ValueError / KeyError / TypeError で終わったとき
+    （＝応答の JSON を読めなかったとき）に parse_status を failed にする。
+    """
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            op = _Operation(name, parses_json)
+            stack = _stack()
+            stack.append(op)
+            try:
+                result = fn(*args, **kwargs)
+            except (ValueError, KeyError, TypeError):
+                op.finish("failed")
+                raise
+            except BaseException:
+                op.finish(None)
+                raise
+            finally:
+                stack.pop()
+            op.finish("ok")
+            return result
+        return wrapper
+    return decorator
+
+
+def set_parse_status(status: str) -> None:
+    """例外を握りつぶす処理（フォールバックするときなど）で、解析の成否を明示する"""
+    stack = _stack()
+    if stack:
+        stack[-1].parse_status = status
+
+
+def record_stream_end(usage: Any = None) -> None:
+    """ストリームを読み終えたときに呼ぶ。所要時間を最後のチャンクまでに延ばし、最後に届いた usage を反映する"""
+    stack = _stack()
+    if not stack or not stack[-1].calls:
+        return
+    event = stack[-1].calls[-1]
+    event["latency_ms"] += (time.time() - event["ts"]) * 1e3
+    if usage is not None:
+        event["prompt_tokens"], event["completion_tokens"] = _usage_tokens(usage)
+        event["cost_usd"] = estimate_cost(event["model"], event["prompt_tokens"], event["completion_tokens"])
+
+
+def record_call(endpoint: str, model: str, status: str, latency_ms: float, retries: int,
+                usage: Any = None, error_type: Optional[str] = None, request_bytes: Optional[int] = None,
+                audio_seconds: Optional[float] = None, stream: bool = False, images: int = 0) -> None:
+    """API リクエスト1回分（リトライ込み）を記録する。llm_client._call から呼ぶ"""
+    prompt_tokens, completion_tokens = _usage_tokens(usage)
+    event = {
+        "ts": time.time(),
+        "endpoint": endpoint,
+        "operation": "",
+        "model": model or "",
+        "status": status,
+        "error_type": error_type,
+        "latency_ms": latency_ms,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "request_bytes": request_bytes,
+        "audio_seconds": audio_seconds,
+        "retries": retries,
+        "stream": int(stream),
+        "parse_status": None,
+        "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens, audio_seconds, images)
+                    if status == "ok" else None,
+    }
+    stack = _stack()
+    if stack:
+        event["operation"] = stack[-1].name
+        stack[-1].calls.append(event)
+    else:
+        _enqueue(event)
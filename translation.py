@@ -0,0 +1,239 @@
+"""日↔英翻訳と、その結果の永続キャッシュ。
+
+MYフレーズ登録・インプット教材・CSV取込の空欄補完はすべて translate_text を通す。
+同じ文（空白や全角/半角の違いは正規化）・同じ方向・同じモデルの翻訳は
+SQLite の translation_cache から返すので、2回目以降はAPIを呼ばない。
+"""
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Sequence
+
+from openai import OpenAI
+
+from llm_client import chat_completion
+from database import get_cached_translation, get_translation_cache_size, put_cached_translation
+from telemetry import instrumented
+
+TRANSLATION_MODEL = "gpt-4o-mini"
+# translate_batch: 1リクエストに詰める件数 / 同時に投げるリクエスト数
+BATCH_SIZE = 25
+MAX_WORKERS = 4
+
+# プロセス内のヒット/ミス回数（画面表示用）
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def is_japanese(text: str) -> bool:
+    return bool(re.search(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9faf]", text))
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用の正規化（NFKC・前後空白除去・連続空白の圧縮）"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def translation_direction(text: str) -> str:
+    return "ja-en" if is_japanese(text) else "en-ja"
+
+
+def cache_key(text: str, direction: str, model: str = TRANSLATION_MODEL) -> str:
+    raw = f"{direction}\0{model}\0{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats() -> Dict[str, float]:
+    """翻訳キャッシュのヒット/ミス回数と件数"""
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": (hits / total) if total else 0.0,
+        "entries": get_translation_cache_size(),
+    }
+
+
+@instrumented("translate_text", parses_json=True)
+def _request_translation(client: OpenAI, text: str, src_is_jp: bool, model: str) -> Dict[str, str]:
+    sys = "You are a professional translator for English↔Japanese study."
+    if src_is_jp:
+        user = f"""
+Translate the following Japanese text into natural, concise, study-friendly English.
+Keep meaning faithful; don't add info.
+
+Return ONLY JSON: {{"english":"...","japanese":"..."}}.
+- "japanese" MUST be the original input (unchanged).
+Text: {text}
+"""
+    else:
+        user = f"""
+Translate the following English text into natural, concise, study-friendly Japanese.
+Keep meaning faithful; don't add info.
+
+Return ONLY JSON: {{"english":"...","japanese":"..."}}.
+- "english" MUST be the original input (unchanged).
+Text: {text}
+"""
+    resp = chat_completion(
+        client,
+        model=model,
+        temperature=0.2,
+        messages=[
+            {"role": "system", "content": sys},
+            {"role": "user", "content": user}
+        ]
+    )
+    content = resp.choices[0].message.content.strip()
+    start = content.find("{"); end = content.rfind("}")
+    if start != -1 and end != -1:
+        content = content[start:end+1]
+    data = json.loads(content)
+    return {"english": data["english"], "japanese": data["japanese"]}
+
+
+def translate_text(client: OpenAI, text: str, model: str = TRANSLATION_MODEL) -> Dict[str, str]:
+    """日↔英を自動判定して、{"english": "...", "japanese": "..."} を返す（キャッシュ優先）"""
+    src_is_jp = is_japanese(text)
+    direction = "ja-en" if src_is_jp else "en-ja"
+    key = cache_key(text, direction, model)
+
+    result = get_cached_translation(key)
+    if result is not None:
+        _count("hits")
+    else:
+        _count("misses")
+        result = _request_translation(client, text, src_is_jp, model)
+        put_cached_translation(key, direction, model, result["english"], result["japanese"])
+
+    # 原文側は常に今回の入力をそのまま返す
+    result["japanese" if src_is_jp else "english"] = text
+    return result
+
+
+# =============== まとめて翻訳（CSV取込の空欄補完用） ===============
+@instrumented("translate_batch", parses_json=True)
+def _request_batch(client: OpenAI, texts: Sequence[str], model: str) -> Dict[int, Dict[str, str]]:
+    """複数の文を1回のリクエストで翻訳し、{番号: {"english", "japanese"}} を返す"""
+    items = [{"id": i, "text": t} for i, t in enumerate(texts)]
+    sys = "You are a professional translator for English↔Japanese study."
+    user = f"""
+Each item below is either English or Japanese. Translate each one into the other language
+(natural, concise, study-friendly). Keep meaning faithful; don't add info.
+
+Return ONLY JSON: {{"items": [{{"id": <id>, "english": "...", "japanese": "..."}}, ...]}}
+- Keep every "id" exactly as given and return one object per input item.
+- The side in the original language MUST be the original input (unchanged).
+Items: {json.dumps(items, ensure_ascii=False)}
+"""
+    resp = chat_completion(
+        client,
+        model=model,
+        temperature=0.2,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": sys},
+            {"role": "user", "content": user}
+        ]
+    )
+    content = resp.choices[0].message.content.strip()
+    start = content.find("{"); end = content.rfind("}")
+    if start != -1 and end != -1:
+        content = content[start:end+1]
+    out = {}
+    for row in json.loads(content).get("items", []):
+        try:
+            out[int(row["id"])] = {"english": str(row["english"]), "japanese": str(row["japanese"])}
+        except (KeyError, TypeError, ValueError):
+            continue
+    return out
+
+
+def _translate_chunk(client: OpenAI, texts: List[str], model: str) -> List[Optional[Dict[str, str]]]:
+    """1バッチ分を翻訳する。返ってこなかった文は1件ずつ翻訳し直す"""
+    try:
+        got = _request_batch(client, texts, model)
+    except Exception:
+        got = {}
+    results: List[Optional[Dict[str, str]]] = []
+    for i, text in enumerate(texts):
+        tr = got.get(i)
+        if tr is None:
+            try:
+                tr = _request_translation(client, text, is_japanese(text), model)
+            except Exception:
+                tr = None
+        results.append(tr)
+    return results
+
+
+def translate_batch(
+    client: OpenAI,
+    texts: Sequence[str],
+    batch_size: int = BATCH_SIZE,
+    max_workers: int = MAX_WORKERS,
+    progress: Optional[Callable[[int, int], None]] = None,
+    model: str = TRANSLATION_MODEL,
+) -> List[Optional[Dict[str, str]]]:
+    """texts をまとめて翻訳し、入力と同じ順番で結果を返す（失敗した文は None）
+
+    キャッシュにある文はAPIを呼ばない。残りは重複を除いて batch_size 件ずつ1リクエストにまとめ、
+    最大 max_workers 本を並行で投げる（レート制限は llm_client 側で共有）。progress(完了件数, 全件数) は呼び出し元のスレッドで呼ばれる。
+    """
+    results: List[Optional[Dict[str, str]]] = [None] * len(texts)
+    pending: Dict[str, List[int]] = {}   # cache_key -> texts 内の位置
+    for i, text in enumerate(texts):
+        src_is_jp = is_japanese(text)
+        key = cache_key(text, "ja-en" if src_is_jp else "en-ja", model)
+        if key in pending:
+            pending[key].append(i)
+            continue
+        cached = get_cached_translation(key)
+        if cached is not None:
+            _count("hits")
+            results[i] = cached
+        else:
+            _count("misses")
+            pending[key] = [i]
+
+    total = len(texts)
+    done = total - sum(len(v) for v in pending.values())
+    if progress:
+        progress(done, total)
+
+    keys = list(pending)
+    chunks = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(_translate_chunk, client, [texts[pending[k][0]] for k in chunk], model): chunk
+            for chunk in chunks
+        }
+        for fut in as_completed(futures):
+            chunk = futures[fut]
+            for key, tr in zip(chunk, fut.result()):
+                positions = pending[key]
+                if tr is not None:
+                    first = texts[positions[0]]
+                    put_cached_translation(key, translation_direction(first), model, tr["english"], tr["japanese"])
+                for i in positions:
+                    results[i] = dict(tr) if tr is not None else None
+                done += len(positions)
+            if progress:
+                progress(done, total)
+
+    # 原文側は常に入力をそのまま返す
+    for i, tr in enumerate(results):
+        if tr is not None:
+            tr["japanese" if is_japanese(texts[i]) else "english"] = texts[i]
+    return results
@@ -0,0 +1,114 @@
+"""週の教材の読み上げ音声（TTS）の保存と再利用。
+
+音声は (英文, エンジン, 声) の sha256 をファイル名にして <audio_dir>/tts/ に保存する。
+同じ英文・エンジン・声なら合成せずに保存済みのファイルを返すので、再生成ボタンを押しても
+同じ教材の音声は作り直さず、別の週でも同じ英文なら1つのファイルを共有する。
+
+gTTS は文ごと（CHUNK_CHARS 文字までまとめる）に並列で合成して、MP3 をそのままつなぐ。
+pyttsx3（オフライン）は1つのエンジンを並列に使えないので、全文を1回で合成する。
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import streamlit as st
+
+TTS_SUBDIR = "tts"
+# gTTS の言語（"en" は米国英語の声）
+GTTS_VOICE = "en"
+# 並列に合成する1チャンクの最大文字数と、同時に送る数
+CHUNK_CHARS = 400
+SYNTH_WORKERS = 4
+
+
+@st.cache_resource
+def _executor() -> ThreadPoolExecutor:
+    """文ごとの合成を並列に行うワーカー"""
+    return ThreadPoolExecutor(max_workers=SYNTH_WORKERS, thread_name_prefix="tts")
+
+
+def cache_key(text: str, engine: str, voice: str) -> str:
+    """(英文, エンジン, 声) のハッシュ。空白の違いだけの英文は同じキーになる"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(json.dumps([engine, voice, normalized]).encode("utf-8")).hexdigest()
+
+
+def _path_for(text: str, engine: str, voice: str, audio_dir: str, ext: str) -> str:
+    return os.path.join(audio_dir, TTS_SUBDIR, f"{cache_key(text, engine, voice)}.{ext}")
+
+
+def cached_path(text: str, engine: str, voice: str, audio_dir: str, ext: str) -> Optional[str]:
+    """保存済みの音声があればそのパス"""
+    path = _path_for(text, engine, voice, audio_dir, ext)
+    return path if os.path.exists(path) else None
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """書きかけのファイルをキャッシュのヒットと見間違えないよう、一時ファイルから置き換える"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def split_sentences(text: str, max_chars: int = CHUNK_CHARS) -> List[str]:
+    """英文を文で区切り、max_chars 文字までの文をまとめたチャンクにする"""
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", " ".join(text.split())) if s]
+    chunks: List[str] = []
+    for s in sentences:
+        if chunks and len(chunks[-1]) + 1 + len(s) <= max_chars:
+            chunks[-1] += " " + s
+        else:
+            chunks.append(s)
+    return chunks
+
+
+def _gtts_bytes(chunk: str, voice: str) -> bytes:
+    from gtts import gTTS
+    buf = io.BytesIO()
+    gTTS(chunk, lang=voice).write_to_fp(buf)
+    return buf.getvalue()
+
+
+def synthesize_gtts(text: str, audio_dir: str, voice: str = GTTS_VOICE) -> str:
+    """gTTS（オンライン）で MP3 を作り、保存先のパスを返す。保存済みなら合成しない"""
+    path = _path_for(text, "gtts", voice, audio_dir, "mp3")
+    if os.path.exists(path):
+        return path
+    chunks = split_sentences(text)
+    if not chunks:
+        raise ValueError("empty text")
+    parts = list(_executor().map(lambda c: _gtts_bytes(c, voice), chunks))
+    _write_atomic(path, b"".join(parts))
+    return path
+
+
+def synthesize_pyttsx3(text: str, audio_dir: str) -> str:
+    """pyttsx3（オフライン）で WAV を作り、保存先のパスを返す。保存済みなら合成しない"""
+    import pyttsx3
+    engine = pyttsx3.init()
+    # 英語声に切替（環境によっては未対応）
+    try:
+        voices = engine.getProperty("voices")
+        for v in voices:
+            if "en" in (v.languages[0].decode() if v.languages else "").lower() or "english" in v.name.lower():
+                engine.setProperty("voice", v.id)
+                break
+    except Exception:
+        pass
+    voice = str(engine.getProperty("voice") or "")
+    path = _path_for(text, "pyttsx3", voice, audio_dir, "wav")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp.wav"
+    engine.save_to_file(text, tmp)
+    engine.runAndWait()
+    os.replace(tmp, path)
+    return path
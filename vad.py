@@ -0,0 +1,137 @@
+"""NumPy だけで行う発話区間検出（VAD）。
+
+短いフレームごとのエネルギー（dB）とゼロ交差率から発話フレームを判定し、
+近い区間をつなぎ・短すぎる区間を捨てて、発話区間 [(開始秒, 終了秒), ...] を返す。
+しきい値は録音ごとの雑音レベル（エネルギーの下位パーセンタイル）から決めるので、マイクの音量差に強い。
+
+trim_silence は前後の無音を削り、必要なら長い間（ま）を詰めた WAV を返す。
+文字起こしに送る量を減らすのと、発話時間 / 無音時間を記録するのに使う。
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from audio_processing import TARGET_SAMPLE_RATE, encode_wav, load_mono
+
+FRAME_MS = 30
+HOP_MS = 10
+# 雑音レベル（下位 NOISE_PERCENTILE% のエネルギー）から何 dB 上を発話とみなすか
+NOISE_PERCENTILE = 10
+SPEECH_MARGIN_DB = 12.0
+# これより小さい音は雑音レベルに関係なく無音（dBFS）
+ABSOLUTE_FLOOR_DB = -50.0
+# 摩擦音（s, f など）はエネルギーが低くゼロ交差率が高いので、その分しきい値を下げる
+FRICATIVE_ZCR = 0.25
+FRICATIVE_RELIEF_DB = 6.0
+# これより短い無音はつなぎ、これより短い発話は捨てる。区間の前後には PAD_SEC の余白を付ける
+MIN_GAP_SEC = 0.3
+MIN_SPEECH_SEC = 0.15
+PAD_SEC = 0.1
+
+
+def frame_features(x: np.ndarray, rate: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    """フレームごとの (エネルギー dB, ゼロ交差率, フレーム間隔秒)"""
+    frame = max(1, int(rate * FRAME_MS / 1000))
+    hop = max(1, int(rate * HOP_MS / 1000))
+    if len(x) < frame:
+        x = np.pad(x, (0, frame - len(x)))
+    frames = np.lib.stride_tricks.sliding_window_view(x, frame)[::hop]
+    energy_db = 10 * np.log10(np.mean(frames.astype(np.float64) ** 2, axis=1) + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+    return energy_db, zcr, hop / rate
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """True が続く区間の [開始, 終了) インデックスの配列（shape: [区間数, 2]）"""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+
+
+def detect_speech(x: np.ndarray, rate: int) -> List[Tuple[float, float]]:
+    """モノラル信号から発話区間 [(開始秒, 終了秒), ...] を返す"""
+    if len(x) == 0:
+        return []
+    energy_db, zcr, hop_sec = frame_features(x, rate)
+    threshold = max(np.percentile(energy_db, NOISE_PERCENTILE) + SPEECH_MARGIN_DB, ABSOLUTE_FLOOR_DB)
+    speech = (energy_db > threshold) | (
+        (energy_db > threshold - FRICATIVE_RELIEF_DB) & (zcr > FRICATIVE_ZCR) & (energy_db > ABSOLUTE_FLOOR_DB)
+    )
+    runs = _runs(speech)
+    if len(runs) == 0:
+        return []
+
+    # 短い無音をつなぐ
+    starts, ends = runs[:, 0] * hop_sec, runs[:, 1] * hop_sec + FRAME_MS / 1000
+    keep = np.concatenate([[True], starts[1:] - ends[:-1] >= MIN_GAP_SEC])
+    merged_starts = starts[keep]
+    merged_ends = np.maximum.reduceat(ends, np.flatnonzero(keep))
+
+    # 短すぎる発話を捨て、前後に余白を付ける
+    duration = len(x) / rate
+    long_enough = merged_ends - merged_starts >= MIN_SPEECH_SEC
+    segments = []
+    for s, e in zip(merged_starts[long_enough], merged_ends[long_enough]):
+        s, e = max(0.0, s - PAD_SEC), min(duration, e + PAD_SEC)
+        if segments and s <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], e)
+        else:
+            segments.append((float(s), float(e)))
+    return [(round(s, 3), round(e, 3)) for s, e in segments]
+
+
+def speech_summary(segments: List[Tuple[float, float]], duration_sec: float) -> Dict[str, float]:
+    """発話時間と無音時間（秒）"""
+    speech = float(sum(e - s for s, e in segments))
+    return {"speech_sec": round(speech, 2), "silence_sec": round(max(0.0, duration_sec - speech), 2)}
+
+
+def analyze_samples(x: np.ndarray, rate: int = TARGET_SAMPLE_RATE) -> Dict:
+    """モノラル信号の発話区間と発話/無音時間を返す（{"segments", "duration_sec", "speech_sec", "silence_sec"}）"""
+    segments = detect_speech(x, rate)
+    duration = len(x) / rate
+    return dict(segments=segments, duration_sec=round(duration, 2), **speech_summary(segments, duration))
+
+
+def analyze_wav(wav_bytes: bytes, rate: int = TARGET_SAMPLE_RATE) -> Dict:
+    """WAV の発話区間と発話/無音時間を返す（analyze_samples と同じ形）"""
+    return analyze_samples(load_mono(wav_bytes, rate), rate)
+
+
+def join_segments(x: np.ndarray, segments: List[Tuple[float, float]], rate: int,
+                  max_pause_sec: Optional[float] = None) -> Tuple[np.ndarray, List[Tuple[float, float]]]:
+    """最初の発話の始まりから最後の発話の終わりまでを切り出した信号と、その信号上での発話区間を返す。
+
+    max_pause_sec を指定すると、発話区間のあいだの無音をその秒数までに詰める。
+    """
+    offset = segments[0][0]
+    if max_pause_sec is None:
+        moved = [(round(s - offset, 3), round(e - offset, 3)) for s, e in segments]
+        return x[int(offset * rate):int(segments[-1][1] * rate)], moved
+
+    pieces, moved, position = [], [], 0.0
+    for i, (s, e) in enumerate(segments):
+        start = s
+        if i:
+            gap = s - segments[i - 1][1]
+            # 間は max_pause_sec 分だけ残す
+            start = s - max_pause_sec if gap > max_pause_sec else segments[i - 1][1]
+        pieces.append(x[int(start * rate):int(e * rate)])
+        position += len(pieces[-1]) / rate
+        moved.append((round(position - (e - s), 3), round(position, 3)))
+    return np.concatenate(pieces), moved
+
+
+def trim_silence(wav_bytes: bytes, max_pause_sec: Optional[float] = None,
+                 rate: int = TARGET_SAMPLE_RATE) -> Tuple[bytes, Dict]:
+    """前後の無音を削った 16kHz モノラル WAV と、analyze_wav と同じ形の解析結果を返す。
+
+    max_pause_sec を指定すると、発話区間のあいだの無音をその秒数までに詰める。
+    発話が見つからなければ元の音声（16kHz モノラル）をそのまま返す。
+    """
+    x = load_mono(wav_bytes, rate)
+    info = analyze_samples(x, rate)
+    segments = info["segments"]
+    if not segments:
+        return encode_wav(x, rate), info
+    return encode_wav(join_segments(x, segments, rate, max_pause_sec)[0], rate), info